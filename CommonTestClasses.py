@@ -22,14 +22,19 @@
 """
 
 import logging
+import logging.handlers
+import gzip
 import traceback
 import sys
 import os
 import time
+import threading
+import Queue
 import tempfile
 import shutil
 import types
 import json
+import struct
 from unittest import TestCase
 from unittest import TextTestResult
 from unittest import TextTestRunner
@@ -39,6 +44,7 @@ import BTE.src.Resources
 from BTE.src.DatabaseManagers import DatabaseManagerHyperion
 from BTE.src.Helpers import timestamp
 from BTE.src.Helpers import replace_escaping_symbols
+from BTE.src.Helpers import dump_xmlrpc_stats
 from BTE.src.CustomExceptions import BTEAssertionError, BTEValueError, BTEKeyError
 
 
@@ -153,6 +159,12 @@ class BeoTestClassBase(TestCase):
     self.logger.info("*************Test Case method ends********")
     self.logger.info(const.STOP_TIME)
     self.logger.flush_test_log()
+    try:
+      dump_xmlrpc_stats(self.logger.get_log_folder())
+    # pylint: disable=W0703
+    except Exception as e:
+      print("***Error: An exception happened during dumping of xmlrpc statistics: %s" % e)
+      sys.exc_clear()
 
   def delete(self):
     if hasattr(self, "logger") and self.logger is not None:
@@ -381,6 +393,26 @@ class BeoLog(object):
     logger.error("error message")
     logger.critical("critical message")
 
+  If asynchronous is set, a message is only formatted and put into a bounded queue on the calling thread,
+  it is printed, written and uploaded by a background thread in batches.
+  The calling thread is blocked only if the queue is full. L{flush_test_log} waits until the queue is empty.
+
+  Messages are uploaded into the db in bulk by L{DBLogBatcher}: when db_batch_size messages are collected
+  or the oldest one is older than db_max_age sec (by a timer thread), and by L{flush_test_log}.
+  It is done only if the db manager has the method upload_log_entries, DatabaseManagerHyperion has not it,
+  so with it every message is uploaded at once as before.
+
+  Every sink (L{SINK_STDOUT}, L{SINK_FILE}, L{SINK_DB}) has an own min message type (see L{set_level}).
+  A message could have lazy %-style arguments, it is formatted only if at least one sink accepts it:
+
+    >>> logger.debug("the state is %s", state)
+
+  If binary_log is set, messages are written into L{LOG_BINARY_FILENAME_SHORT_NAME} by L{BinaryLogWriter}
+  as well (the sink L{SINK_BINARY}), it could be read by L{BinaryLogReader} and exported into the text format.
+
+  If log_max_bytes or log_max_age is set, the text log is rotated by L{RotatingCompressedFileHandler}:
+  rolled segments are compressed and only the first log_head_bytes and the last log_tail_bytes of the log are kept.
+
   @ivar _log_filename: the full name of the log file
   @type _log_filename: string
   @ivar _log_filename_short: the short name of the log file
@@ -391,12 +423,37 @@ class BeoLog(object):
   @type DB_MANGER_DUMP_FILENAME_SHORT_NAME: string
   @ivar _logger: a logger object
   @type _logger: Logger
+  @ivar _queue: a queue of records for the background thread, None if messages are logged synchronously
+  @type _queue: Queue.Queue
+  @ivar _batch_size: max number of records processed at once by the background thread
+  @type _batch_size: int
+  @ivar _worker: the background thread
+  @type _worker: threading.Thread
+  @ivar _db_batcher: a batcher of uploads into the db, None if there is no db manager
+  @type _db_batcher: DBLogBatcher
+  @ivar _levels: min levels of sinks: a sink and a level from L{LOG_LEVELS}
+  @type _levels: dictionary
+  @ivar _binary_log: a writer of the binary log, None if it is not used
+  @type _binary_log: BinaryLogWriter
   """
 
   LOG_FILENAME_SHORT_NAME = "test_case_log.txt"
+  LOG_BINARY_FILENAME_SHORT_NAME = "test_case_log.blog"
+  LOG_LEVELS = {const.message_type_debug: logging.DEBUG,
+                const.message_type_info: logging.INFO,
+                const.message_type_warn: logging.WARN,
+                const.message_type_error: logging.ERROR,
+                const.message_type_critical: logging.CRITICAL}
+  SINK_STDOUT = "stdout"
+  SINK_FILE = "file"
+  SINK_DB = "db"
+  SINK_BINARY = "binary"
   DB_MANGER_DUMP_FILENAME_SHORT_NAME = "db_manger_dump_file.txt"
 
-  def __init__(self, log_root="", log_folder_name="", log_filename="", use_time_stamp=True, result_id=-1):
+  def __init__(self, log_root="", log_folder_name="", log_filename="", use_time_stamp=True, result_id=-1,
+               asynchronous=False, queue_size=10000, batch_size=100, db_manager=None, db_batch_size=100,
+               db_max_age=5.0, levels=None, binary_log=False, log_max_bytes=0, log_max_age=0, log_head_bytes=0,
+               log_tail_bytes=0):
     """initializes logging environment
     @param log_root: a root folder of a new log folder
     @type log_root: string
@@ -406,6 +463,33 @@ class BeoLog(object):
     @type use_time_stamp: boolean
     @param log_filename: a name of a log file which will be used to log info, for ex. "log.txt"
     @type log_filename: string
+    @param asynchronous: whether to log messages by a background thread
+    @type asynchronous: boolean
+    @param queue_size: max number of messages waiting for the background thread
+    @type queue_size: int
+    @param batch_size: max number of messages processed at once by the background thread
+    @type batch_size: int
+    @param db_manager: a db manager to upload messages to, by default DatabaseManagerHyperion is created
+      if result_id is set, e.g. L{LocalDBLogSink} could be used instead
+    @param db_batch_size: max number of messages uploaded into the db at once, 1 to upload every message at once,
+      it is used only if the db manager has the method upload_log_entries
+    @type db_batch_size: int
+    @param db_max_age: max time in sec a message waits for the upload into the db
+    @type db_max_age: float
+    @param levels: min message types of sinks, for ex. {BeoLog.SINK_STDOUT: const.message_type_info},
+      all messages are logged into sinks, which are not specified
+    @type levels: dictionary
+    @param binary_log: whether to write messages into the binary log as well
+    @type binary_log: boolean
+    @param log_max_bytes: max size of the text log in bytes before it is rolled into a segment, 0 - unlimited
+    @type log_max_bytes: int
+    @param log_max_age: max time in sec the text log is written before it is rolled into a segment, 0 - unlimited
+    @type log_max_age: float
+    @param log_head_bytes: uncompressed size of the first segments, which are always kept
+    @type log_head_bytes: int
+    @param log_tail_bytes: uncompressed size of the last segments, which are always kept,
+      if both log_head_bytes and log_tail_bytes are 0 all segments are kept
+    @type log_tail_bytes: int
     """
     # handle port number if it is assigned, for example, 192.168.1.1:800_6
     log_folder_name = replace_escaping_symbols(log_folder_name)
@@ -440,17 +524,40 @@ class BeoLog(object):
     self._logger.propagate = 0
     # create a handler only if there is no one.
     if len(self._logger.handlers) == 0:
-      handler = logging.FileHandler(self._log_filename, encoding='utf-8')
+      if log_max_bytes > 0 or log_max_age > 0:
+        handler = RotatingCompressedFileHandler(self._log_filename, log_max_bytes, log_max_age, log_head_bytes,
+                                                log_tail_bytes, encoding='utf-8')
+      else:
+        handler = logging.FileHandler(self._log_filename, encoding='utf-8')
       formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
       handler.setFormatter(formatter)
       self._logger.addHandler(handler)
 
+    self._queue = None
+    self._worker = None
+    self._batch_size = batch_size
+    self._db_batcher = None
+    self._binary_log = None
+    if binary_log:
+      self._binary_log = BinaryLogWriter(os.path.join(self.log_folder, self.LOG_BINARY_FILENAME_SHORT_NAME))
+    self._levels = {self.SINK_STDOUT: logging.DEBUG, self.SINK_FILE: logging.DEBUG, self.SINK_DB: logging.DEBUG,
+                    self.SINK_BINARY: logging.DEBUG}
+    for sink, message_type in (levels or {}).iteritems():
+      self.set_level(sink, message_type)
+    if asynchronous:
+      self._queue = Queue.Queue(maxsize=queue_size)
+      self._worker = threading.Thread(target=self._process_queue, name="BeoLogWriter")
+      self._worker.daemon = True
+      self._worker.start()
+
     self._result_id = result_id
-    self._db_manager = None
+    self._db_manager = db_manager
     try:
-      if (self._result_id > 0):
+      if (self._db_manager is None and self._result_id > 0):
         self._db_manager = DatabaseManagerHyperion(os.path.join(self.log_folder, self.DB_MANGER_DUMP_FILENAME_SHORT_NAME))
+      if (self._db_manager is not None):
         self._db_manager.start_log_thread()
+        self._db_batcher = DBLogBatcher(self._db_manager, self._result_id, db_batch_size, db_max_age, self._logger)
     # pylint: disable=W0703
     except Exception as e:
       self.warn("cannot create db manager: %s" % e)
@@ -458,11 +565,19 @@ class BeoLog(object):
   def delete(self):
     """it deletes/cleanup the instanse of the class
     """
+    if self._worker is not None:
+      self._queue.put(None)
+      self._worker.join()
+      self._worker = None
+    if (self._db_batcher is not None):
+      self._db_batcher.close()
     if (self._db_manager is not None):
       # without the timeout the exception 'IOError: [Errno 32] Broken pipe' can appear
       time.sleep(0.1)
       self._db_manager.delete()
       del self._db_manager
+    if (self._binary_log is not None):
+      self._binary_log.close()
     # close handlers
     for h in self._logger.handlers:
       try:
@@ -476,13 +591,156 @@ class BeoLog(object):
           raise BTEKeyError(e)
 
   def flush_test_log(self):
-    """it flushes the test log
+    """it flushes the test log, all queued messages are logged before
     """
+    if self._worker is not None:
+      self._queue.join()
+    if (self._db_batcher is not None):
+      self._db_batcher.flush()
+    if (self._binary_log is not None):
+      self._binary_log.flush()
     if (self._db_manager is not None):
       self._db_manager.stop_log_thread()
 
-  def _log_message(self, message, message_type):
+  def set_level(self, sink, message_type):
+    """it sets a min message type of messages, which are logged into a sink
+    @param sink: the sink: L{SINK_STDOUT}, L{SINK_FILE}, L{SINK_DB} or L{SINK_BINARY}
+    @type sink: string
+    @param message_type: the message type, for ex. const.message_type_info
+    @type message_type: string
+    """
+    if sink not in self._levels:
+      raise BTEValueError("unknown sink '%s'" % sink)
+    self._levels[sink] = self._get_level(message_type)
+
+  def _get_level(self, message_type):
+    """it returns a level of a message type, unknown types (for ex. syslog) are treated as info
+    @rtype: int
+    """
+    return self.LOG_LEVELS.get(message_type, logging.INFO)
+
+  def _get_sinks(self, message_type):
+    """it returns sinks, which accept a message type
+    @return: flags for L{SINK_STDOUT}, L{SINK_FILE}, L{SINK_DB} and L{SINK_BINARY}
+    @rtype: tuple
+    """
+    level = self._get_level(message_type)
+    return (level >= self._levels[self.SINK_STDOUT],
+            level >= self._levels[self.SINK_FILE] and self._logger is not None,
+            level >= self._levels[self.SINK_DB] and self._db_batcher is not None,
+            level >= self._levels[self.SINK_BINARY] and self._binary_log is not None)
+
+  def is_enabled_for(self, message_type):
+    """it checks whether a message of a message type is logged into at least one sink
+    @param message_type: the message type
+    @type message_type: string
+    @rtype: boolean
+    """
+    return any(self._get_sinks(message_type))
+
+  def _log_message(self, message, message_type, args=(), obj_info=None):
     """prints info into a log and into stdout
+    @param message: the message or a format string
+    @param message_type: a type of the message
+    @type message_type: string
+    @param args: arguments for the format string
+    @type args: tuple
+    @param obj_info: an information about the object, which logs the message
+    @type obj_info: string
+    """
+    sinks = self._get_sinks(message_type)
+    if not any(sinks):
+      return
+    if self._queue is None:
+      self._write_records([(timestamp(), time.time(), message, args, obj_info, message_type, sinks)])
+      return
+    # the message and its arguments could be changed by the caller, before they are used by the background thread
+    message = self._format_message(message, args)
+    self._queue.put((timestamp(), time.time(), message, (), obj_info, message_type, sinks))
+
+  def _process_queue(self):
+    """the main loop of the background thread, it logs queued messages in batches until it gets None
+    """
+    while True:
+      records = [self._queue.get()]
+      while len(records) < self._batch_size:
+        try:
+          records.append(self._queue.get_nowait())
+        except Queue.Empty:
+          sys.exc_clear()
+          break
+      try:
+        self._write_records([record for record in records if record is not None])
+      # logging must go on
+      # pylint: disable=W0703
+      except Exception as exc:
+        print("***Error: An exception happened during logging of messages: %s" % exc)
+        sys.exc_clear()
+      finally:
+        for _record in records:
+          self._queue.task_done()
+      if None in records:
+        return
+
+  def _write_records(self, records):
+    """it converts messages and logs them into stdout, the log file, the db and the binary log,
+    a record, which cannot be logged, is reported and skipped, other records are logged
+    @param records: tuples (a timestamp string, a time in sec, a message, arguments of the message,
+      an object info, a message type, flags of sinks)
+    @type records: list
+    """
+    lines = []
+    converted = []
+    for tstamp, created, message, args, obj_info, message_type, sinks in records:
+      try:
+        message = self._format_message(message, args)
+        if obj_info is not None:
+          obj_info = self._convert_message(obj_info)
+        text = message if obj_info is None else u"[%s]: %s" % (obj_info, message)
+        if sinks[0]:
+          line = self._format_stdout_line(tstamp, text, message_type)
+          if line is not None:
+            lines.append(line)
+        converted.append((tstamp, created, message, obj_info, text, message_type, sinks))
+      # logging must go on
+      # pylint: disable=W0703
+      except Exception as exc:
+        print("***Error: An exception happened during converting of a message: %s. Skipping the message" % exc)
+        sys.exc_clear()
+    if lines:
+      print(u"\n".join(lines))
+
+    for tstamp, created, message, obj_info, text, message_type, sinks in converted:
+      try:
+        if sinks[1]:
+          self._write_to_file(created, text, message_type)
+        if sinks[2]:
+          self._upload_to_db(tstamp, text, message_type)
+        if sinks[3]:
+          self._binary_log.write(created, self._get_level(message_type), obj_info, message)
+      # pylint: disable=W0703
+      except Exception as exc:
+        print("***Error: An exception happened during logging of a message: %s" % exc)
+        sys.exc_clear()
+
+  def _format_message(self, message, args):
+    """it applies arguments to a message and converts it into a string
+    @return: the formatted message
+    @rtype: unicode
+    """
+    if args:
+      try:
+        message = message % args
+      except (TypeError, ValueError, UnicodeError) as exc:
+        print("***Error: An exception happened during formatting a message '%s': %s" % (message, exc))
+        sys.exc_clear()
+    return self._convert_message(message)
+
+  def _convert_message(self, message):
+    """it converts a message into a string
+    @param message: the message
+    @return: the converted message
+    @rtype: unicode
     """
     try:
       if isinstance(message, dict):
@@ -498,74 +756,73 @@ class BeoLog(object):
           else:
             msg += str(m1) + ","
         message = "".join(msg.decode("utf-8"))[:-1]
-      elif isinstance(message, types.StringTypes):
+      elif isinstance(message, str):
         message = message.decode("utf-8")
-      else:
-        message = str(message)
+      elif not isinstance(message, unicode):
+        message = str(message).decode("utf-8")
     except (TypeError, UnicodeError) as exc:
-      print("***Error: An exception happened during converting a message to a string: %s. Skipping the message" % exc)
-
-    tstamp = timestamp()
+      print("***Error: An exception happened during converting a message to a string: %s. Replacing undecodable symbols" % exc)
+      sys.exc_clear()
+      message = (message if isinstance(message, str) else repr(message)).decode("utf-8", "replace")
+    return message
+
+  def _format_stdout_line(self, tstamp, message, message_type):
+    """it formats a line for stdout
+    @return: the line, None if the message cannot be printed, then it is still logged into other sinks
+    @rtype: unicode
+    """
     try:
-      print(u"%s - %s - %s" % (tstamp, message_type.upper(), message))
+      line = u"%s - %s - %s" % (tstamp, message_type.upper(), message)
+      line.encode(sys.stdout.encoding or "ascii")
+      return line
     except UnicodeError as exc:
-      # if we cannot print the message into std out, there is little sense in trying to upload it into DB or logger output
       print("***Error: An exception happened during printing a message to stdout: %s. Skipping the message.Printing it as list of symbols" % exc)
       try:
         print([ch for ch in message])
       # pylint: disable=W0703
       except Exception as exc:
         print("***Error: Cannot print a message. Exception: %s" % exc)
-      return
-
-    if (self._logger is not None):
-      if message_type == const.message_type_info:
-        self._logger.info(message)
-      elif message_type == const.message_type_debug:
-        self._logger.debug(message)
-      elif message_type == const.message_type_warn:
-        self._logger.warn(message)
-      elif message_type == const.message_type_error:
-        self._logger.error(message)
-      elif message_type == const.message_type_critical:
-        self._logger.critical(message)
+      return None
 
-    if (self._db_manager is not None):
-      try:
-        self._db_manager.upload_log_entry(tstamp, self._result_id, message, message_type)
-      except UnicodeError as exc:
-        try:
-          self._db_manager.upload_log_entry(tstamp, self._result_id, message.encode('utf-8'), message_type)
-        # pylint: disable=broad-except
-        except Exception as exc:
-          msg = "cannot log a message into the db: %s" % exc
-          print(msg)
-          self._logger.warn(msg)
-      # pylint: disable=broad-except
-      except Exception as exc:
-        msg = "cannot log a message into the db: %s" % exc
-        print(msg)
-        self._logger.warn(msg)
+  def _write_to_file(self, created, message, message_type):
+    """it writes a message into the log file
+    @param created: a time of the message in sec
+    @type created: float
+    """
+    if self._logger is None or message_type not in self.LOG_LEVELS:
+      return
+    record = self._logger.makeRecord(self._logger.name, self.LOG_LEVELS[message_type], "", 0, message, None, None)
+    # the time of the call, not of the write
+    record.created = created
+    record.msecs = (created - int(created)) * 1000
+    self._logger.handle(record)
+
+  def _upload_to_db(self, tstamp, message, message_type):
+    """it uploads a message into the db
+    """
+    if (self._db_batcher is not None):
+      self._db_batcher.add(tstamp, message, message_type)
 
-  def info(self, message):
-    """prints info into a log and into stdout"""
-    self._log_message(message, const.message_type_info)
+  def info(self, message, *args, **kwargs):
+    """prints info into a log and into stdout
+    the keyword argument obj_info is an information about the object, which logs the message"""
+    self._log_message(message, const.message_type_info, args, kwargs.get("obj_info"))
 
-  def debug(self, message):
+  def debug(self, message, *args, **kwargs):
     """prints debug into a log and into stdout"""
-    self._log_message(message, const.message_type_debug)
+    self._log_message(message, const.message_type_debug, args, kwargs.get("obj_info"))
 
-  def warn(self, message):
+  def warn(self, message, *args, **kwargs):
     """prints warn into a log and into stdout"""
-    self._log_message(message, const.message_type_warn)
+    self._log_message(message, const.message_type_warn, args, kwargs.get("obj_info"))
 
-  def error(self, message):
+  def error(self, message, *args, **kwargs):
     """prints error into a log and into stdout"""
-    self._log_message(message, const.message_type_error)
+    self._log_message(message, const.message_type_error, args, kwargs.get("obj_info"))
 
-  def critical(self, message):
+  def critical(self, message, *args, **kwargs):
     """prints critical into a log and into stdout"""
-    self._log_message(message, const.message_type_critical)
+    self._log_message(message, const.message_type_critical, args, kwargs.get("obj_info"))
 
   def get_log_folder(self):
     """returns a path to the folder where log are stored
@@ -581,6 +838,579 @@ class BeoLog(object):
     """
     return self._log_filename
 
+  def get_log_segments(self):
+    """returns paths to the compressed segments of the text log, which are rolled and kept, the oldest first
+    @return: the paths, an empty list if the text log is not rotated
+    @rtype: list
+    """
+    for handler in self._logger.handlers:
+      if isinstance(handler, RotatingCompressedFileHandler):
+        return handler.get_segments()
+    return []
+
+  def get_binary_log_file(self):
+    """returns a path to the binary log
+    @return: the path, None if the binary log is not used
+    @rtype: string
+    """
+    if self._binary_log is None:
+      return None
+    return self._binary_log.file_name
+
+
+###################################################################################
+class DBLogBatcher(object):
+  """it collects log entries and uploads them into a db manager in bulk, when there are batch_size entries
+  or the oldest entry is older than max_age sec (a timer uploads them, even if no new entries come).
+  If the db manager has the method upload_log_entries(entries), entries are uploaded by one call,
+  otherwise upload_log_entry is called for every entry and entries are not collected (batch_size is 1),
+  because batching would only delay them. DatabaseManagerHyperion has no upload_log_entries.
+  Entries, which could not be uploaded, are kept and uploaded again with next entries,
+  at most max_retained entries are kept, the oldest ones are dropped.
+  It could be used from several threads.
+  @ivar max_age: max time in sec an entry waits for the upload
+  @type max_age: float
+  @ivar _db_manager: a db manager
+  @ivar _result_id: an id of a result in the database
+  @type _result_id: int
+  @ivar _batch_size: max number of entries uploaded at once
+  @type _batch_size: int
+  @ivar _max_retained: max number of kept entries, which could not be uploaded
+  @type _max_retained: int
+  @ivar _logger: a logger to report errors to
+  @type _logger: Logger
+  @ivar _entries: collected entries: tuples (a timestamp, a result id, a message, a message type)
+  @type _entries: list
+  @ivar _timer: a timer, which uploads old entries, None if there are no entries
+  @type _timer: threading.Timer
+  @ivar _lock: a lock of _entries and _timer
+  @type _lock: threading.Lock
+  @ivar _upload_lock: a lock, which keeps the order of uploads
+  @type _upload_lock: threading.Lock
+  """
+  def __init__(self, db_manager, result_id, batch_size=100, max_age=5.0, logger=None, max_retained=None):
+    self.max_age = max_age
+    self._db_manager = db_manager
+    self._result_id = result_id
+    self._batch_size = batch_size if hasattr(db_manager, "upload_log_entries") else 1
+    self._max_retained = max_retained if max_retained is not None else 10 * batch_size
+    self._logger = logger
+    self._entries = []
+    self._timer = None
+    self._lock = threading.Lock()
+    self._upload_lock = threading.Lock()
+
+  def has_entries(self):
+    """it checks whether there are collected entries
+    @rtype: boolean
+    """
+    with self._lock:
+      return bool(self._entries)
+
+  def add(self, tstamp, message, message_type):
+    """it collects an entry and uploads collected entries if there are enough
+    @param tstamp: a timestamp of the message
+    @type tstamp: string
+    @param message: the message
+    @type message: unicode
+    @param message_type: a type of the message
+    @type message_type: string
+    """
+    with self._lock:
+      self._entries.append((tstamp, self._result_id, message, message_type))
+      if len(self._entries) < self._batch_size:
+        self._start_timer()
+        return
+    self.flush()
+
+  def flush(self):
+    """it uploads all collected entries
+    """
+    with self._upload_lock:
+      with self._lock:
+        self._cancel_timer()
+        entries, self._entries = self._entries, []
+      if entries:
+        self._upload(entries)
+
+  def close(self):
+    """it uploads all collected entries and stops the timer, entries, which could not be uploaded, are dropped
+    """
+    self.flush()
+    with self._lock:
+      self._cancel_timer()
+      entries, self._entries = self._entries, []
+    if entries:
+      self._report_error("dropped after failed uploads", len(entries))
+
+  def _start_timer(self):
+    """it starts the timer, which uploads old entries, if it is not running, the caller holds _lock
+    """
+    if self._timer is None and self.max_age > 0:
+      self._timer = threading.Timer(self.max_age, self.flush)
+      self._timer.daemon = True
+      self._timer.start()
+
+  def _cancel_timer(self):
+    """it cancels the timer, the caller holds _lock
+    """
+    if self._timer is not None:
+      self._timer.cancel()
+      self._timer = None
+
+  def _upload(self, entries):
+    """it uploads entries, the entries, which could not be uploaded, are kept
+    @param entries: the entries
+    @type entries: list
+    """
+    if hasattr(self._db_manager, "upload_log_entries"):
+      if not self._upload_entries(self._db_manager.upload_log_entries, entries):
+        self._retain(entries)
+      return
+    failed = [entry for entry in entries if not self._upload_entries(self._upload_log_entry, [entry])]
+    if failed:
+      self._retain(failed)
+
+  def _upload_log_entry(self, entries):
+    """it uploads a single entry by upload_log_entry of the db manager
+    @param entries: a list with one entry
+    @type entries: list
+    """
+    self._db_manager.upload_log_entry(*entries[0])
+
+  def _upload_entries(self, upload, entries):
+    """it uploads entries by a function, messages are encoded into utf-8 if the db manager cannot handle unicode
+    @param upload: a function, which uploads a list of entries
+    @type upload: function
+    @param entries: the entries
+    @type entries: list
+    @return: True if the entries were uploaded
+    @rtype: boolean
+    """
+    try:
+      upload(entries)
+      return True
+    except UnicodeError:
+      sys.exc_clear()
+    # pylint: disable=broad-except
+    except Exception as exc:
+      self._report_error(exc, len(entries))
+      sys.exc_clear()
+      return False
+    try:
+      upload([self._encode_entry(entry) for entry in entries])
+      return True
+    # pylint: disable=broad-except
+    except Exception as exc:
+      self._report_error(exc, len(entries))
+      sys.exc_clear()
+      return False
+
+  def _retain(self, entries):
+    """it keeps entries, which could not be uploaded, before newer entries, the oldest ones are dropped
+    if there are more than _max_retained entries
+    @param entries: the entries
+    @type entries: list
+    """
+    with self._lock:
+      entries = entries + self._entries
+      dropped = max(0, len(entries) - self._max_retained)
+      self._entries = entries[dropped:]
+      if self._entries:
+        self._start_timer()
+    if dropped:
+      self._report_error("too many failed uploads", dropped)
+
+  @staticmethod
+  def _encode_entry(entry):
+    """it encodes a message of an entry into utf-8
+    @rtype: tuple
+    """
+    tstamp, result_id, message, message_type = entry
+    if isinstance(message, unicode):
+      message = message.encode('utf-8')
+    return tstamp, result_id, message, message_type
+
+  def _report_error(self, exc, count):
+    """it reports a failed upload
+    """
+    msg = "cannot log %d message(s) into the db: %s" % (count, exc)
+    print(msg)
+    if self._logger is not None:
+      self._logger.warn(msg)
+
+
+###################################################################################
+class LocalDBLogSink(object):
+  """it is a local stand-in for a db manager, which keeps uploaded log entries in memory,
+  it could be used instead of DatabaseManagerHyperion for testing
+  @ivar batches: uploaded batches of entries
+  @type batches: list of lists
+  """
+  def __init__(self):
+    self.batches = []
+
+  def start_log_thread(self):
+    pass
+
+  def stop_log_thread(self):
+    pass
+
+  def delete(self):
+    pass
+
+  def upload_log_entries(self, entries):
+    """it stores a batch of entries: tuples (a timestamp, a result id, a message, a message type)
+    """
+    self.batches.append(list(entries))
+
+  def get_entries(self):
+    """it returns all uploaded entries
+    @rtype: list
+    """
+    return [entry for batch in self.batches for entry in batch]
+
+
+###################################################################################
+class RotatingCompressedFileHandler(logging.handlers.BaseRotatingHandler):
+  """a file handler, which rolls the log file into a segment, when the file has reached max_bytes
+  or it is written longer than max_age sec. A segment is the file compressed by gzip,
+  its name is the name of the file with a number, for ex. test_case_log.txt.0001.gz.
+  The rolled file is renamed to test_case_log.txt.0001 and compressed by a background daemon thread,
+  so logging is not blocked; segments are compressed one by one, in the order of rollovers.
+  After a compression middle segments are deleted, only the first segments with head_bytes of the log and
+  the last segments with tail_bytes of the log are kept, so the beginning and the end of a long log survive.
+  All sizes are counted in bytes of the uncompressed log.
+  @ivar max_bytes: max size of the file in bytes, 0 - unlimited; the size is checked before a record is written,
+    so the file could be bigger by the last record
+  @type max_bytes: int
+  @ivar max_age: max time in sec the file is written, 0 - unlimited
+  @type max_age: float
+  @ivar head_bytes: uncompressed size of the first segments, which are kept
+  @type head_bytes: int
+  @ivar tail_bytes: uncompressed size of the last segments, which are kept, if both sizes are 0 all segments are kept
+  @type tail_bytes: int
+  @ivar _opened: a time when the file was opened in sec
+  @type _opened: float
+  @ivar _segment_index: a number of the last segment
+  @type _segment_index: int
+  @ivar _compressor: a thread, which compresses the last rolled file, None if nothing was rolled
+  @type _compressor: threading.Thread
+  """
+
+  SEGMENT_SUFFIX = ".gz"
+  TEMP_SUFFIX = ".tmp"
+
+  def __init__(self, filename, max_bytes=0, max_age=0, head_bytes=0, tail_bytes=0, encoding=None):
+    logging.handlers.BaseRotatingHandler.__init__(self, filename, "a", encoding)
+    self.max_bytes = max_bytes
+    self.max_age = max_age
+    self.head_bytes = head_bytes
+    self.tail_bytes = tail_bytes
+    self._opened = time.time()
+    self._compressor = None
+    segments = self._list_segments()
+    # rolled files, which were not compressed before the last exit
+    rolled = self._list_segments("")
+    self._segment_index = max([index for index, _path in segments + rolled] or [0])
+    for index, path in rolled:
+      self._compress_later(path, "%s.%04d%s" % (self.baseFilename, index, self.SEGMENT_SUFFIX))
+
+  def _list_segments(self, suffix=SEGMENT_SUFFIX):
+    """it finds segments of the file
+    @param suffix: a suffix of segments after the number, "" to find rolled files, which are not compressed
+    @type suffix: string
+    @return: tuples (a number, a path) sorted by numbers
+    @rtype: list
+    """
+    folder, name = os.path.split(self.baseFilename)
+    prefix = name + "."
+    segments = []
+    for file_name in os.listdir(folder):
+      index = file_name[len(prefix):len(file_name) - len(suffix)]
+      if file_name.startswith(prefix) and file_name.endswith(suffix) and index.isdigit():
+        segments.append((int(index), os.path.join(folder, file_name)))
+    return sorted(segments)
+
+  def get_segments(self):
+    """it returns paths of segments, the oldest first, it waits until all rolled files are compressed
+    @rtype: list
+    """
+    self.wait_for_compression()
+    return [path for _index, path in self._list_segments()]
+
+  def wait_for_compression(self):
+    """it waits until all rolled files are compressed
+    """
+    compressor = self._compressor
+    if compressor is not None:
+      compressor.join()
+
+  def close(self):
+    """it waits until all rolled files are compressed and closes the file
+    """
+    self.wait_for_compression()
+    logging.handlers.BaseRotatingHandler.close(self)
+
+  def shouldRollover(self, record):
+    """it checks whether the file should be rolled before the record is written
+    @rtype: boolean
+    """
+    if self.stream is None:
+      self.stream = self._open()
+    if self.stream.tell() == 0:
+      return False
+    if self.max_age > 0 and record.created - self._opened >= self.max_age:
+      return True
+    # the bytes already written are counted, the record is not formatted twice
+    if self.max_bytes > 0 and self.stream.tell() >= self.max_bytes:
+      return True
+    return False
+
+  def doRollover(self):
+    """it renames the file, opens a new file and compresses the renamed file into a new segment later
+    """
+    if self.stream:
+      self.stream.close()
+      self.stream = None
+    self._segment_index += 1
+    rolled = "%s.%04d" % (self.baseFilename, self._segment_index)
+    os.rename(self.baseFilename, rolled)
+    self._opened = time.time()
+    self.stream = self._open()
+    self._compress_later(rolled, rolled + self.SEGMENT_SUFFIX)
+
+  def _compress_later(self, rolled, segment):
+    """it starts a thread, which compresses a rolled file into a segment after the previous segment
+    @param rolled: a path to the rolled file
+    @type rolled: string
+    @param segment: a path to the segment
+    @type segment: string
+    """
+    self._compressor = threading.Thread(target=self._compress, args=(rolled, segment, self._compressor),
+                                        name="log compressor")
+    # a hung compression must not block the exit, close() waits for it
+    self._compressor.daemon = True
+    self._compressor.start()
+
+  def _compress(self, rolled, segment, previous):
+    """it compresses a rolled file into a segment and deletes segments out of the retention,
+    it is called by a background thread
+    @param rolled: a path to the rolled file
+    @type rolled: string
+    @param segment: a path to the segment
+    @type segment: string
+    @param previous: a thread, which compresses the previous segment, or None
+    @type previous: threading.Thread
+    """
+    if previous is not None:
+      previous.join()
+    # a partially written segment must not be seen by the retention
+    temp = segment + self.TEMP_SUFFIX
+    try:
+      with open(rolled, "rb") as src:
+        dst = gzip.open(temp, "wb")
+        try:
+          shutil.copyfileobj(src, dst)
+        finally:
+          dst.close()
+      os.rename(temp, segment)
+      os.remove(rolled)
+    except (IOError, OSError) as exc:
+      print("***Error: Cannot compress the log segment '%s': %s" % (rolled, exc))
+      sys.exc_clear()
+      return
+    self._apply_retention()
+
+  @staticmethod
+  def _get_log_size(segment):
+    """it reads the uncompressed size of a segment from the gzip trailer
+    @param segment: a path to the segment
+    @type segment: string
+    @return: the size of the log in the segment in bytes modulo 2^32
+    @rtype: int
+    """
+    with open(segment, "rb") as f:
+      f.seek(-4, os.SEEK_END)
+      return struct.unpack("<I", f.read(4))[0]
+
+  def _apply_retention(self):
+    """it deletes middle segments, which are neither in the head nor in the tail
+    """
+    if self.head_bytes <= 0 and self.tail_bytes <= 0:
+      return
+    segments = [(path, self._get_log_size(path)) for _index, path in self._list_segments()]
+    keep = set()
+    for ordered, limit in ((segments, self.head_bytes), (reversed(segments), self.tail_bytes)):
+      total = 0
+      for path, size in ordered:
+        if total >= limit:
+          break
+        keep.add(path)
+        total += size
+    for path, _size in segments:
+      if path not in keep:
+        try:
+          os.remove(path)
+        except OSError as exc:
+          print("***Error: Cannot delete the log segment '%s': %s" % (path, exc))
+          sys.exc_clear()
+
+
+###################################################################################
+class BinaryLogWriter(object):
+  """it writes log records into a binary file. The file starts with L{MAGIC}, every record is
+  a header L{RECORD_HEADER} (a length of the payload, a time in sec, a logging level, a length of the object info)
+  followed by the payload: the object info and the message in utf-8.
+  The file is opened for appending, a torn record at the end is ignored by L{BinaryLogReader}.
+  It could be used from several threads.
+  @cvar MAGIC: the signature and the version of the format
+  @type MAGIC: string
+  @cvar RECORD_HEADER: the header of a record
+  @type RECORD_HEADER: struct.Struct
+  @ivar file_name: a name of the file
+  @type file_name: string
+  """
+
+  MAGIC = "BLOG\x01"
+  RECORD_HEADER = struct.Struct(">IdBH")
+
+  def __init__(self, file_name, buffer_size=65536):
+    """
+    @param file_name: a name of the file
+    @type file_name: string
+    @param buffer_size: a size of the write buffer in bytes
+    @type buffer_size: int
+    """
+    self.file_name = file_name
+    self._lock = threading.Lock()
+    self._file = open(file_name, "ab", buffer_size)
+    if self._file.tell() == 0:
+      self._file.write(self.MAGIC)
+
+  def write(self, created, level, obj_info, message):
+    """it writes a record
+    @param created: a time of the message in sec
+    @type created: float
+    @param level: a logging level, for ex. logging.INFO
+    @type level: int
+    @param obj_info: an information about the object, which logged the message, or None
+    @type obj_info: unicode
+    @param message: the message
+    @type message: unicode
+    """
+    obj_info = (obj_info or u"").encode("utf-8")[:0xFFFF]
+    message = message.encode("utf-8")
+    header = self.RECORD_HEADER.pack(len(obj_info) + len(message), created, level, len(obj_info))
+    with self._lock:
+      if self._file is not None:
+        self._file.write(header + obj_info + message)
+
+  def flush(self):
+    """it flushes written records into the file
+    """
+    with self._lock:
+      if self._file is not None:
+        self._file.flush()
+
+  def close(self):
+    """it closes the file
+    """
+    with self._lock:
+      if self._file is not None:
+        self._file.close()
+        self._file = None
+
+
+###################################################################################
+class BinaryLogReader(object):
+  """it reads records of a binary log written by L{BinaryLogWriter}. Records are read one by one,
+  payloads of records, which are skipped by a filter, are not decoded.
+
+    >>> for created, level, obj_info, message in BinaryLogReader(file_name).read(min_level=logging.ERROR):
+    ...   print(message)
+
+  @ivar file_name: a name of the file
+  @type file_name: string
+  """
+
+  TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+  def __init__(self, file_name):
+    """
+    @param file_name: a name of the file
+    @type file_name: string
+    """
+    self.file_name = file_name
+
+  def __iter__(self):
+    return self.read()
+
+  def read(self, min_level=logging.NOTSET, obj_info=None, start=None, end=None):
+    """it reads records
+    @param min_level: a min logging level of records
+    @type min_level: int
+    @param obj_info: a substring of the object info of records
+    @type obj_info: unicode
+    @param start: a min time of records in sec
+    @type start: float
+    @param end: a max time of records in sec
+    @type end: float
+    @return: a generator of tuples (a time in sec, a logging level, an object info or None, a message)
+    """
+    header = BinaryLogWriter.RECORD_HEADER
+    with open(self.file_name, "rb") as f:
+      if f.read(len(BinaryLogWriter.MAGIC)) != BinaryLogWriter.MAGIC:
+        raise BTEValueError("'%s' is not a binary log" % self.file_name)
+      while True:
+        data = f.read(header.size)
+        if len(data) < header.size:
+          return
+        length, created, level, obj_info_length = header.unpack(data)
+        if (level < min_level or (start is not None and created < start) or (end is not None and created > end)):
+          f.seek(length, os.SEEK_CUR)
+          continue
+        payload = f.read(length)
+        if len(payload) < length:
+          # the record is torn, e.g. the writer was killed
+          return
+        record_obj_info = payload[:obj_info_length].decode("utf-8") if obj_info_length else None
+        if obj_info is not None and (record_obj_info is None or obj_info not in record_obj_info):
+          continue
+        yield (created, level, record_obj_info, payload[obj_info_length:].decode("utf-8"))
+
+  def format_record(self, record, formatter=None):
+    """it formats a record the same way as the text log of L{BeoLog} does
+    @param record: a record returned by L{read}
+    @type record: tuple
+    @param formatter: a formatter, by default L{TEXT_FORMAT} is used
+    @type formatter: logging.Formatter
+    @rtype: unicode
+    """
+    created, level, obj_info, message = record
+    if obj_info is not None:
+      message = u"[%s]: %s" % (obj_info, message)
+    log_record = logging.LogRecord("", level, "", 0, message, None, None)
+    log_record.created = created
+    log_record.msecs = (created - int(created)) * 1000
+    return (formatter or logging.Formatter(self.TEXT_FORMAT)).format(log_record)
+
+  def export_text(self, text_file_name, **filters):
+    """it exports records into a text file in the format of the text log of L{BeoLog}
+    @param text_file_name: a name of the text file
+    @type text_file_name: string
+    @param filters: filters of L{read}
+    @return: a number of exported records
+    @rtype: int
+    """
+    formatter = logging.Formatter(self.TEXT_FORMAT)
+    count = 0
+    with open(text_file_name, "wb") as f:
+      for record in self.read(**filters):
+        f.write(self.format_record(record, formatter).encode("utf-8") + "\n")
+        count += 1
+    return count
+
 
 ###################################################################################
 class BeoLogProxy():
@@ -624,25 +1454,33 @@ class BeoLogProxy():
     self._obj_info = obj_info
 
   # pylint: disable=E0202
-  def info(self, message):
+  def info(self, message, *args):
     """prints info into a log and into stdout"""
-    self._logger.info("[%s]: %s" % (self._obj_info, message))
+    self._logger.info(message, *args, obj_info=self._obj_info)
 
-  def debug(self, message):
+  def debug(self, message, *args):
     """prints debug into a log and into stdout"""
-    self._logger.debug("[%s]: %s" % (self._obj_info, message))
+    self._logger.debug(message, *args, obj_info=self._obj_info)
 
-  def warn(self, message):
+  def warn(self, message, *args):
     """prints warn into a log and into stdout"""
-    self._logger.warn("[%s]: %s" % (self._obj_info, message))
+    self._logger.warn(message, *args, obj_info=self._obj_info)
 
-  def error(self, message):
+  def error(self, message, *args):
     """prints error into a log and into stdout"""
-    self._logger.error("[%s]: %s" % (self._obj_info, message))
+    self._logger.error(message, *args, obj_info=self._obj_info)
 
-  def critical(self, message):
+  def critical(self, message, *args):
     """prints critical into a log and into stdout"""
-    self._logger.critical("[%s]: %s" % (self._obj_info, message))
+    self._logger.critical(message, *args, obj_info=self._obj_info)
+
+  def is_enabled_for(self, message_type):
+    """it checks whether a message of a message type is logged
+    @param message_type: the message type
+    @type message_type: string
+    @rtype: boolean
+    """
+    return self._logger is None or self._logger.is_enabled_for(message_type)
 
   def get_log_folder(self):
     """returnes folderpath where log are stored
@@ -656,7 +1494,16 @@ class BeoLogProxy():
     """
     return self._logger.get_log_file()
 
-  def _print(self, message):
+  def get_binary_log_file(self):
+    """returns a path to the binary log
+    @return: the path, None if the binary log is not used
+    @rtype: string
+    """
+    return self._logger.get_binary_log_file()
+
+  def _print(self, message, *args):
+    if args:
+      message = message % args
     print "%s - %s" % (timestamp(), message)
 
 
@@ -1104,6 +1951,284 @@ class BeologTest(TestCase):
       print(index)
       self.bl._log_message(message, message_type)
 
+  def test_asynchronous(self):
+    """ the background thread logs all messages in the order of calls
+    """
+    bl = BeoLog(asynchronous=True, queue_size=10, batch_size=4)
+    for index in range(100):
+      bl.info("message %d" % index)
+    bl.debug({"string": "ABCD"})
+    bl.flush_test_log()
+    with open(bl.get_log_file()) as f:
+      lines = f.read().splitlines()
+    self.assertEqual(101, len(lines))
+    for index, line in enumerate(lines[:100]):
+      self.assertTrue(line.endswith(" - INFO - message %d" % index), line)
+    self.assertTrue(lines[100].endswith(' - DEBUG - {"string": "ABCD"}'), lines[100])
+    bl.delete()
+
+  def test_asynchronous_mutable_args(self):
+    """ arguments are applied on the calling thread, so later changes of them are not logged
+    """
+    bl = BeoLog(asynchronous=True)
+    # the background thread waits, until the argument is changed
+    changed = threading.Event()
+    write_records = bl._write_records
+
+    def wait_and_write_records(records):
+      changed.wait(5)
+      write_records(records)
+
+    bl._write_records = wait_and_write_records
+    state = {"state": "before"}
+    bl.info("state %s", state)
+    state["state"] = "after"
+    changed.set()
+    bl.flush_test_log()
+    with open(bl.get_log_file()) as f:
+      lines = f.read().splitlines()
+    self.assertTrue(lines[-1].endswith(" - INFO - state {'state': 'before'}"), lines[-1])
+    bl.delete()
+
+  def test_asynchronous_bad_record(self):
+    """ a record, which cannot be logged, is skipped, other records of the batch are logged
+    """
+    class BadArgument(object):
+      """an argument, which cannot be converted into a string"""
+
+      def __str__(self):
+        raise RuntimeError("cannot convert")
+
+    bl = BeoLog(asynchronous=True, batch_size=100)
+    # the background thread waits, until all records are queued
+    queued = threading.Event()
+    write_records = bl._write_records
+
+    def wait_and_write_records(records):
+      queued.wait(5)
+      write_records(records)
+
+    bl._write_records = wait_and_write_records
+    for index in range(5):
+      bl.info("before %d", index)
+    bl._queue.put((timestamp(), time.time(), BadArgument(), (), None, const.message_type_info, (True, True, False, False)))
+    for index in range(5):
+      bl.info("after %d", index)
+    queued.set()
+    bl.flush_test_log()
+    with open(bl.get_log_file()) as f:
+      lines = f.read().splitlines()[-10:]
+    self.assertEqual(["before %d" % index for index in range(5)] + ["after %d" % index for index in range(5)],
+                     [line.split(" - INFO - ")[-1] for line in lines])
+    bl.delete()
+
+  def test_db_batches(self):
+    """ messages are uploaded into the db in batches
+    """
+    sink = LocalDBLogSink()
+    bl = BeoLog(result_id=1, db_manager=sink, db_batch_size=10)
+    for index in range(25):
+      bl.info("message %d" % index)
+    self.assertEqual([10, 10], [len(batch) for batch in sink.batches])
+    bl.flush_test_log()
+    self.assertEqual([10, 10, 5], [len(batch) for batch in sink.batches])
+    self.assertEqual([u"message %d" % index for index in range(25)], [entry[2] for entry in sink.get_entries()])
+    self.assertEqual(set([(1, "info")]), set((entry[1], entry[3]) for entry in sink.get_entries()))
+    bl.delete()
+
+  def test_db_without_bulk_upload(self):
+    """ messages are uploaded at once, if the db manager cannot upload them in bulk
+    """
+    class SingleDBLogSink(object):
+      """a db manager, which uploads entries one by one"""
+      def __init__(self):
+        self.entries = []
+
+      def upload_log_entry(self, tstamp, result_id, message, message_type):
+        self.entries.append((tstamp, result_id, message, message_type))
+
+    sink = SingleDBLogSink()
+    batcher = DBLogBatcher(sink, 1, batch_size=10)
+    batcher.add("tstamp", u"message", "info")
+    self.assertEqual([("tstamp", 1, u"message", "info")], sink.entries)
+    self.assertFalse(batcher.has_entries())
+    batcher.close()
+
+  def test_db_batch_max_age(self):
+    """ old messages are uploaded into the db by the timer, even if no new messages come
+    """
+    sink = LocalDBLogSink()
+    bl = BeoLog(result_id=1, db_manager=sink, db_batch_size=10, db_max_age=0.2)
+    bl.info("message")
+    self.assertEqual([], sink.batches)
+    deadline = time.time() + 5
+    while not sink.batches and time.time() < deadline:
+      time.sleep(0.05)
+    self.assertEqual([[u"message"]], [[entry[2] for entry in batch] for batch in sink.batches])
+    bl.delete()
+
+  def test_db_failed_upload_kept(self):
+    """ messages, which could not be uploaded into the db, are uploaded again with next messages
+    """
+    class FailingDBLogSink(LocalDBLogSink):
+      """a db sink, which fails while failing is set"""
+      failing = True
+
+      def upload_log_entries(self, entries):
+        if self.failing:
+          raise IOError("db is not available")
+        LocalDBLogSink.upload_log_entries(self, entries)
+
+    sink = FailingDBLogSink()
+    batcher = DBLogBatcher(sink, 1, batch_size=2, max_age=0, max_retained=3)
+    for index in range(4):
+      batcher.add("tstamp", u"message %d" % index, "info")
+    self.assertEqual([], sink.batches)
+    self.assertTrue(batcher.has_entries())
+    sink.failing = False
+    batcher.add("tstamp", u"message 4", "info")
+    batcher.flush()
+    self.assertEqual([u"message %d" % index for index in range(1, 5)], [entry[2] for entry in sink.get_entries()])
+    self.assertFalse(batcher.has_entries())
+    batcher.close()
+
+  def test_lazy_formatting_and_levels(self):
+    """ arguments are applied only to messages accepted by at least one sink
+    """
+    class Argument(object):
+      """an argument, which counts its formattings"""
+      count = 0
+
+      def __str__(self):
+        Argument.count += 1
+        return "argument"
+
+    sink = LocalDBLogSink()
+    bl = BeoLog(result_id=1, db_manager=sink, db_batch_size=1,
+                levels={BeoLog.SINK_STDOUT: const.message_type_warn, BeoLog.SINK_FILE: const.message_type_info})
+    bl.set_level(BeoLog.SINK_DB, const.message_type_info)
+    self.assertFalse(bl.is_enabled_for(const.message_type_debug))
+    for _index in range(10):
+      bl.debug("debug %s", Argument())
+    self.assertEqual(0, Argument.count)
+    bl.info("info %s %d", Argument(), 1)
+    self.assertEqual(1, Argument.count)
+    BeoLogProxy(bl, "tal,leader,dut").error("error %s", "text")
+    bl.flush_test_log()
+    self.assertEqual([u"info argument 1", u"[tal,leader,dut]: error text"], [entry[2] for entry in sink.get_entries()])
+    with open(bl.get_log_file()) as f:
+      lines = f.read().splitlines()[-2:]
+    self.assertTrue(lines[0].endswith(" - INFO - info argument 1"), lines[0])
+    self.assertTrue(lines[1].endswith(" - ERROR - [tal,leader,dut]: error text"), lines[1])
+    bl.delete()
+
+  def test_undecodable_and_unprintable_messages(self):
+    """ a byte string, which is not utf-8, is logged with replaced symbols, a message, which cannot be printed
+    into stdout, is still logged into other sinks
+    """
+    sink = LocalDBLogSink()
+    bl = BeoLog(result_id=1, db_manager=sink, db_batch_size=1, levels={BeoLog.SINK_STDOUT: const.message_type_critical})
+    BeoLogProxy(bl, "tal").info("bytes \xff\xfe")
+    bl.info(u"unicode \xe4")
+    bl.flush_test_log()
+    self.assertEqual([u"[tal]: bytes \ufffd\ufffd", u"unicode \xe4"], [entry[2] for entry in sink.get_entries()])
+    with open(bl.get_log_file()) as f:
+      lines = f.read().decode("utf-8").splitlines()[-2:]
+    self.assertTrue(lines[0].endswith(u" - INFO - [tal]: bytes \ufffd\ufffd"), lines[0])
+    self.assertTrue(lines[1].endswith(u" - INFO - unicode \xe4"), lines[1])
+    bl.delete()
+
+  def test_log_rotation(self):
+    """ the text log is rolled into compressed segments, only the head and the tail segments are kept
+    """
+    log_root = tempfile.mkdtemp()
+    try:
+      bl = BeoLog(log_root=log_root, log_folder_name="rotation", log_max_bytes=1000, log_head_bytes=1,
+                  log_tail_bytes=1, levels={BeoLog.SINK_STDOUT: const.message_type_critical})
+      for index in range(100):
+        bl.info("message %03d %s", index, "x" * 50)
+      bl.flush_test_log()
+      segments = bl.get_log_segments()
+      self.assertEqual(2, len(segments))
+      self.assertTrue(segments[0].endswith("test_case_log.txt.0001.gz"), segments[0])
+      f = gzip.open(segments[0])
+      try:
+        lines = f.read().splitlines()
+      finally:
+        f.close()
+      self.assertTrue(lines[0].endswith(" - INFO - message 000 " + "x" * 50), lines[0])
+      self.assertTrue(all(len(line) < 1000 for line in lines))
+      with open(bl.get_log_file()) as f:
+        self.assertTrue(f.read().splitlines()[-1].endswith("message 099 " + "x" * 50))
+      bl.delete()
+
+      # the retention counts bytes of the uncompressed log: two segments of about 1000 bytes fit into the head
+      bl = BeoLog(log_root=log_root, log_folder_name="retention", log_max_bytes=1000, log_head_bytes=1500,
+                  log_tail_bytes=1, levels={BeoLog.SINK_STDOUT: const.message_type_critical})
+      for index in range(100):
+        bl.info("message %03d %s", index, "x" * 50)
+      bl.flush_test_log()
+      segments = bl.get_log_segments()
+      self.assertEqual(3, len(segments))
+      self.assertTrue(segments[1].endswith("test_case_log.txt.0002.gz"), segments[1])
+      bl.delete()
+
+      # a time based rollover
+      handler = RotatingCompressedFileHandler(os.path.join(log_root, "age.txt"), max_age=10)
+      record = logging.LogRecord("", logging.INFO, "", 0, "message", None, None)
+      handler.emit(record)
+      self.assertFalse(handler.shouldRollover(record))
+      record.created += 10
+      self.assertTrue(handler.shouldRollover(record))
+      handler.emit(record)
+      handler.close()
+      self.assertEqual([os.path.join(log_root, "age.txt.0001.gz")], handler.get_segments())
+
+      # the size is measured in written bytes, a rolled file is compressed after the rollover
+      handler = RotatingCompressedFileHandler(os.path.join(log_root, "bytes.txt"), max_bytes=16, encoding="utf-8")
+      record = logging.LogRecord("", logging.INFO, "", 0, u"\xe4" * 8, None, None)
+      handler.emit(record)
+      self.assertTrue(handler.shouldRollover(record))
+      self.assertTrue(handler._compressor is None)
+      handler.emit(record)
+      self.assertEqual([os.path.join(log_root, "bytes.txt.0001.gz")], handler.get_segments())
+      self.assertFalse(os.path.exists(os.path.join(log_root, "bytes.txt.0001")))
+      self.assertTrue(handler._compressor.daemon)
+      handler.close()
+    finally:
+      shutil.rmtree(log_root)
+
+  def test_binary_log(self):
+    """ the binary log is read by BinaryLogReader and exported into the text format
+    """
+    log_root = tempfile.mkdtemp()
+    try:
+      bl = BeoLog(log_root=log_root, log_folder_name="binary", binary_log=True,
+                  levels={BeoLog.SINK_STDOUT: const.message_type_critical})
+      bl.debug("debug %d", 1)
+      BeoLogProxy(bl, "tal,leader").error(u"error text")
+      bl.info({"key": 2})
+      bl.flush_test_log()
+      reader = BinaryLogReader(bl.get_binary_log_file())
+      records = list(reader)
+      self.assertEqual([(logging.DEBUG, None, u"debug 1"), (logging.ERROR, u"tal,leader", u"error text"),
+                        (logging.INFO, None, u'{"key": 2}')], [record[1:] for record in records])
+      filtered = reader.read(min_level=logging.INFO, obj_info=u"leader")
+      self.assertEqual([u"error text"], [record[3] for record in filtered])
+      text_file = os.path.join(log_root, "exported.txt")
+      self.assertEqual(3, reader.export_text(text_file))
+      with open(text_file) as f:
+        exported = f.read()
+      with open(bl.get_log_file()) as f:
+        self.assertEqual(f.read(), exported)
+      bl.delete()
+      # a torn record at the end is ignored
+      with open(reader.file_name, "ab") as f:
+        f.write(BinaryLogWriter.RECORD_HEADER.pack(100, time.time(), logging.INFO, 0) + "torn")
+      self.assertEqual(3, len(list(reader)))
+    finally:
+      shutil.rmtree(log_root)
+
 
 # if __name__ == "__main__":
 # #===============================================================================
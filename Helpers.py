@@ -13,6 +13,7 @@ import httplib
 import os
 import re
 import socket
+import select
 import inspect
 import sys
 import tempfile
@@ -23,11 +24,22 @@ import traceback
 import shutil
 import fnmatch
 import gzip
+import bisect
+import hashlib
+import itertools
+import mmap
+import json
+import multiprocessing
 import smtplib
+import struct
+import threading
+import weakref
+import zlib
+import Queue
 import netifaces
-from collections import deque, defaultdict
+from collections import deque, defaultdict, OrderedDict
 from datetime import datetime
-from ftplib import FTP, Error
+from ftplib import FTP, Error, error_perm, error_temp
 from email.MIMEText import MIMEText
 from telnetlib import Telnet
 
@@ -36,6 +48,9 @@ import BTE.src.CustomExceptions as CustomExceptions
 from BTE.src.CustomExceptions import BTEResourceCreationError
 from BTE.src.LabEnvironment import Environment
 
+# a size of a block which is sent by ftp at once
+FTP_BLOCK_SIZE = 8192
+
 
 def email(to, subject, message):
   """
@@ -198,7 +213,9 @@ def create_ftp_test_run_folder(queue_task_id):
   _ftp_action((ftp_folder,))
 
 
-def upload_logs(source, queue_task_id, desitation_folder="", recursive=True):
+def upload_logs(source, queue_task_id, desitation_folder="", recursive=True, session_pool=None,
+                connections=1, max_bandwidth=None, use_manifest=False, compress_extensions=None,
+                keep_compressed=False):
   """it uploads all log files to the Hyperion's web site
   the following command will be used
   scp -r mydir someuser@hyperion.bang-olufsen.dk:/tmp
@@ -211,6 +228,23 @@ def upload_logs(source, queue_task_id, desitation_folder="", recursive=True):
   @type desitation_folder: string
   @param recursive: wheather a source should be uploaded recursivly
   @type recursive: boolean
+  @param session_pool: a pool of ftp sessions to upload logs through. if it is None (by default),
+                       a pool is created for the call, so all files are uploaded through one ftp login
+  @type session_pool: FTPSessionPool
+  @param connections: a number of ftp connections which upload files in parallel, 1 by default
+  @type connections: int
+  @param max_bandwidth: a cap of the total upload bandwidth in bytes per sec, None (by default) means no cap.
+                        it is used only if the pool is created by the call
+  @type max_bandwidth: int
+  @param use_manifest: whether to keep a L{UploadManifest} next to the source.
+                       if it is True, files uploaded by a previous call are skipped
+                       and partially uploaded files are resumed
+  @type use_manifest: boolean
+  @param compress_extensions: extensions of files, which are gzipped on the fly while uploading,
+                              None (by default) means that files are uploaded as they are
+  @type compress_extensions: list
+  @param keep_compressed: whether to keep a local copy of gzipped files (the original file is removed then)
+  @type keep_compressed: boolean
   """
   # check sources
   if not (source is not None and os.path.exists(source)):
@@ -221,25 +255,52 @@ def upload_logs(source, queue_task_id, desitation_folder="", recursive=True):
   ftp_log_root = Environment.get_hyperion_ftp_log_root()
   ftp_folder = os.path.join(str(ftp_log_root), str(queue_task_id), desitation_folder)
 
-  spec_symbols = [" ", "(", ")"]
-  if os.path.isdir(source):
-    # pylint:disable=W0612
-    for root, _dirs, files in os.walk(source):
-      if (not recursive and root != source):
-        break
+  own_pool = session_pool is None
+  if own_pool:
+    session_pool = FTPSessionPool(size=connections, max_bandwidth=max_bandwidth)
+  previous_manifest = session_pool.manifest
+  if use_manifest:
+    session_pool.manifest = UploadManifest(source)
 
-      remote_path = root.replace(source, ftp_folder)
+  try:
+    actions = _get_upload_actions(source, ftp_folder, recursive, compress_extensions, keep_compressed)
+    if connections > 1:
+      _ftp_actions_parallel(actions, session_pool, connections)
+    else:
+      for args in actions:
+        _ftp_action(args, session_pool)
+  finally:
+    session_pool.manifest = previous_manifest
+    if own_pool:
+      session_pool.close()
+      print "%s: ftp statistics of uploading '%s': %s" % (timestamp(), source, session_pool.get_stats())
 
-      # replace special symbols
-      for symbol in spec_symbols:
-        remote_path = remote_path.replace(symbol, "\\" + symbol)
 
-      _ftp_action((remote_path,))
-      for f in files:
-        _ftp_action((os.path.join(root, f), os.path.join(remote_path, f)))
-  else:
-    _ftp_action((ftp_folder,))
-    _ftp_action((source, os.path.join(ftp_folder, os.path.basename(source))))
+def compress_and_upload_logs(file_extension, search_folder, queue_task_id, desitation_folder="",
+                             keep_compressed=False, connections=1, max_bandwidth=None):
+  """it uploads logs to the Hyperion's web site and gzips files with the extension in the list on the fly.
+  Unlike L{compress_files} followed by L{upload_logs}, the folder is walked only once
+  and gzipped data is sent directly to the ftp server without temporary files.
+  @param file_extension: A list of file extensions that should be compressed.
+  @type file_extension: list
+  @param search_folder: a source (a file or a folder) to upload
+  @type search_folder: string
+  @param queue_task_id: an id of the task. it is used for creation of a folder on the ftp server
+  @type queue_task_id: int
+  @param desitation_folder: a full name of the destination folder starting from the ftp_log_root.
+  @type desitation_folder: string
+  @param keep_compressed: whether to replace local files by their gzipped copies, as L{compress_files} does
+  @type keep_compressed: boolean
+  @param connections: a number of ftp connections which upload files in parallel
+  @type connections: int
+  @param max_bandwidth: a cap of the total upload bandwidth in bytes per sec, None means no cap
+  @type max_bandwidth: int
+  """
+  return upload_logs(search_folder, queue_task_id, desitation_folder,
+                     connections=connections,
+                     max_bandwidth=max_bandwidth,
+                     compress_extensions=file_extension,
+                     keep_compressed=keep_compressed)
 
 
 def upload_stdout(stdout_filename, stdout_original, stderr_original, log_folder):
@@ -280,29 +341,106 @@ def upload_stdout(stdout_filename, stdout_original, stderr_original, log_folder)
     shutil.move(stdout_filename, log_folder)
 
 
-def compress_files(file_extension, search_folder):
+def compress_files(file_extension, search_folder, processes=1, compress_level=9, split_size=None):
   """it compresses and removes files with the extension in the list from the search_folder and sub directories.
   @param file_extension: A list of file extensions that should be compressed.
   @type file_extension: list
   @param search_folder: The base directory where the search should take place.
   @type search_folder: string
+  @param processes: a number of processes which compress files in parallel, 1 by default
+  @type processes: int
+  @param compress_level: a level of compression from 1 (the fastest) to 9 (the best, by default)
+  @type compress_level: int
+  @param split_size: files bigger than split_size bytes are split into parts which are compressed
+                     in parallel as independent gzip members. None (by default) means no splitting
+  @type split_size: int
+  @return: statistics of compression: files, bytes_in, bytes_out, seconds and bytes_per_sec
+           (compressed bytes per sec) or None, if the folder does not exist
+  @rtype: dictionary
   """
-  # run through all extensions
   # check sources
   if not (search_folder is not None and os.path.exists(search_folder)):
     print "Logs were not compressed. The path '%s' does not exist" % search_folder
-    return
+    return None
 
-  for file_type in file_extension:
-    # pylint:  disable=W0612
-    for root, _dirs, filenames in os.walk(search_folder):
-      for filename in fnmatch.filter(filenames, "*.%s" % file_type):
+  start = time.time()
+  # every job is (file name, offset, length, compress level), length is None for a whole file
+  jobs = []
+  # sizes of split files at the moment of the walk, a file could grow while it is compressed
+  sizes = {}
+  # pylint:  disable=W0612
+  for root, _dirs, filenames in os.walk(search_folder):
+    for filename in filenames:
+      if _match_extensions(filename, file_extension):
         full_filename = os.path.join(root, filename)
-        with open(full_filename, "rb") as f_in:
-          f_out = gzip.open("%s.gz" % full_filename, "wb")
-          f_out.writelines(f_in)
-          f_out.close()
-        os.remove(full_filename)
+        size = os.path.getsize(full_filename)
+        if split_size and size > split_size:
+          sizes[full_filename] = size
+          jobs.extend((full_filename, offset, split_size, compress_level) for offset in xrange(0, size, split_size))
+        else:
+          jobs.append((full_filename, 0, None, compress_level))
+
+  stats = {"files": 0, "bytes_in": 0, "bytes_out": 0}
+  pool = None
+  if processes > 1 and len(jobs) > 1:
+    pool = multiprocessing.Pool(processes)
+    results = pool.imap(_compress_chunk, jobs)
+  else:
+    results = itertools.imap(_compress_chunk, jobs)
+
+  f_out = None
+  try:
+    # parts of a file follow each other, as imap keeps an order of jobs
+    for (full_filename, offset, length, _level), (bytes_in, data) in itertools.izip(jobs, results):
+      stats["bytes_in"] += bytes_in
+      if data is None:
+        stats["bytes_out"] += os.path.getsize("%s.gz" % full_filename)
+      else:
+        if offset == 0:
+          f_out = open("%s.gz" % full_filename, "wb")
+        f_out.write(data)
+        stats["bytes_out"] += len(data)
+        # parts are planned by the size of the walk, the file could be bigger now
+        if offset + length < sizes[full_filename]:
+          continue
+        f_out.close()
+        f_out = None
+      stats["files"] += 1
+      os.remove(full_filename)
+  finally:
+    if f_out is not None:
+      f_out.close()
+    if pool is not None:
+      pool.close()
+      pool.join()
+
+  stats["seconds"] = time.time() - start
+  stats["bytes_per_sec"] = stats["bytes_out"] / stats["seconds"] if stats["seconds"] else 0.0
+  print "%s: compression statistics of '%s': %s" % (timestamp(), search_folder, stats)
+  return stats
+
+
+def _compress_chunk(job):
+  """it compresses a file or a part of the file. it is executed in a process of a pool
+  @param job: (file name, offset, length, compress level). if length is None,
+              the whole file is compressed into "<file name>.gz", otherwise the part is
+              compressed into a gzip member, which is returned
+  @type job: tuple
+  @return: a number of read bytes and the gzip member or None, if the whole file is compressed
+  @rtype: tuple (int, string)
+  """
+  full_filename, offset, length, compress_level = job
+  with open(full_filename, "rb") as f_in:
+    if length is None:
+      f_out = gzip.open("%s.gz" % full_filename, "wb", compress_level)
+      f_out.writelines(f_in)
+      f_out.close()
+      return f_in.tell(), None
+    f_in.seek(offset)
+    data = f_in.read(length)
+  # wbits 16 + MAX_WBITS produce a gzip header and trailer
+  compressor = zlib.compressobj(compress_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+  return len(data), compressor.compress(data) + compressor.flush()
 
 
 def sys_path_append(path):
@@ -314,6 +452,18 @@ def sys_path_append(path):
     sys.path.append(path)
 
 
+def _match_extensions(file_name, file_extension):
+  """it checks whether a file matches the pattern "*.<extension>" of one of the extensions
+  @param file_name: a name of the file
+  @type file_name: string
+  @param file_extension: a list of file extensions, they could contain shell-style wildcards
+  @type file_extension: list
+  @return: whether the file has one of extensions
+  @rtype: boolean
+  """
+  return any(fnmatch.fnmatch(file_name, "*.%s" % ext) for ext in file_extension)
+
+
 def _get_stderr_file_name(stdout_filename):
   """it calculates name for stderr output based on the stdout's filename
   @param stdout_filename: std_out filename
@@ -326,94 +476,331 @@ def _get_stderr_file_name(stdout_filename):
   return os.path.join(os.path.dirname(stdout_filename), stderr_filename)
 
 
-def _ftp_action(args):
+def _get_upload_actions(source, ftp_folder, recursive, compress_extensions=None, keep_compressed=False):
+  """it walks through a source and generates arguments for L{_ftp_action}.
+  A folder is always generated before its files and sub folders
+  @param source: a source (a file or a folder) to upload
+  @type source: string
+  @param ftp_folder: a full name of the destination folder on the ftp server
+  @type ftp_folder: string
+  @param recursive: wheather a source should be uploaded recursivly
+  @type recursive: boolean
+  @param compress_extensions: extensions of files which should be gzipped, None means no files
+  @type compress_extensions: list
+  @param keep_compressed: whether to keep a local copy of gzipped files
+  @type keep_compressed: boolean
+  @return: a generator of typils ("folder",), ("local_file","remote_file")
+           and ("local_file","remote_file.gz",keep_compressed)
+  @rtype: generator
+  """
+  def get_file_action(local_file, remote_file):
+    """it returns arguments to upload a file"""
+    if compress_extensions and _match_extensions(local_file, compress_extensions):
+      return (local_file, remote_file + ".gz", keep_compressed)
+    return (local_file, remote_file)
+
+  spec_symbols = [" ", "(", ")"]
+  if os.path.isdir(source):
+    # pylint:disable=W0612
+    for root, _dirs, files in os.walk(source):
+      if (not recursive and root != source):
+        break
+
+      remote_path = root.replace(source, ftp_folder)
+
+      # replace special symbols
+      for symbol in spec_symbols:
+        remote_path = remote_path.replace(symbol, "\\" + symbol)
+
+      yield (remote_path,)
+      for f in files:
+        yield get_file_action(os.path.join(root, f), os.path.join(remote_path, f))
+  else:
+    yield (ftp_folder,)
+    yield get_file_action(source, os.path.join(ftp_folder, os.path.basename(source)))
+
+
+def _ftp_actions_parallel(actions, session_pool, connections):
+  """it executes ftp actions using several connections in parallel.
+  Folders are created by the calling thread, files are put into a bounded queue
+  which is served by 'connections' threads. As a folder is created before its files are queued,
+  parent folders always exist before their children are uploaded.
+  @param actions: arguments for L{_ftp_action}
+  @type actions: iterable
+  @param session_pool: a pool of ftp sessions to execute actions on
+  @type session_pool: FTPSessionPool
+  @param connections: a number of threads which upload files
+  @type connections: int
+  """
+  files_queue = Queue.Queue(maxsize=connections * 4)
+
+  def upload_worker():
+    """it uploads files from the queue until it gets None"""
+    while True:
+      args = files_queue.get()
+      try:
+        if args is None:
+          return
+        _ftp_action(args, session_pool)
+      # a broken file should not stop uploading of other files
+      # pylint: disable=W0703
+      except Exception as e:
+        print "%s: An exception '%s' happened during uploading of '%s'" % (timestamp(), e, args[0])
+        print "".join(traceback.format_exception(*sys.exc_info()))
+        sys.exc_clear()
+      finally:
+        files_queue.task_done()
+
+  workers = [threading.Thread(target=upload_worker, name="ftp_upload_%s" % i) for i in range(connections)]
+  for worker in workers:
+    worker.daemon = True
+    worker.start()
+  try:
+    for args in actions:
+      if len(args) == 1:
+        _ftp_action(args, session_pool)
+      else:
+        files_queue.put(args)
+  finally:
+    for _worker in workers:
+      files_queue.put(None)
+    for worker in workers:
+      worker.join()
+
+
+def _ftp_action(args, session_pool=None):
   """it uploads a file or create a folder using the ftp connection, depending on arguments
   @param args: a typil of arguments,
               if a len of the typil is 1 ("folder",) the folder will be created,
               if a len of the typil is 2 ("local_file","remote_file") the local file will be uploaded
+              if a len of the typil is 3 ("local_file","remote_file",keep_compressed) the local file
+              will be gzipped on the fly and uploaded, the gzipped copy is kept locally if keep_compressed is True
   @type args: typil
+  @param session_pool: a pool of ftp sessions to execute the action on.
+                       if it is None, a new ftp connection is opened and closed for the action
+  @type session_pool: FTPSessionPool
   """
-  # 5 min to upload files
-  connection_timeout = 300
-  if len(args) == 1:
-    # only 60s to create a folder
-    connection_timeout = 60
-  ftp_server = Environment.get_hyperion_ftp_host()
-  ftp_user, ftp_password = Environment.get_hyperion_ftp_username_password()
-
-  # trying to connect 5 times to upload a log
-  counter = 0
-  max_count_attempts = 5
-  while (counter < max_count_attempts):
-    ftp_srv = None
-    try:
-      ftp_srv = FTP(ftp_server, ftp_user, ftp_password, timeout=connection_timeout)
-      break
-    # pylint: disable=W0703
-    except Error as e:
-      print "%s: An exception '%s' happened during creation of a ftp conneciton. Attempt %s" % (timestamp(), e, counter)
-      print "".join(traceback.format_exception(*sys.exc_info()))
-      sys.exc_clear()
-      if ftp_srv is not None:
-        try:
-          ftp_srv.quit()
-        # pylint: disable=W0703
-        except Error as e_quit:
-          print "%s: An exception '%s' happened during closing a ftp conneciton" % (timestamp(), e_quit)
-          ftp_srv.close()
-
-    counter += 1
-    time.sleep(counter)
-
-  ftp_log_root = Environment.get_hyperion_ftp_log_root()
-  if(counter >= max_count_attempts):
-    print "%s: Cannot connect to the ftp server in %s attempts" % (timestamp(), max_count_attempts)
+  if len(args) not in (1, 2, 3):
+    print "%s: Incorrect arguments: '%s'" % (timestamp(), str(args))
     return
+
+  own_pool = session_pool is None
+  if own_pool:
+    # 5 min to upload files, only 60s to create a folder
+    session_pool = FTPSessionPool(timeout=60 if len(args) == 1 else 300)
   try:
     if len(args) == 1:
-      folder, = args
-
-      # creating folders recursivly
-      folders_str = folder.replace(ftp_log_root, "").strip('/')
-      folders = folders_str.split('/')
-      path = ftp_log_root
-      for fold in folders:
-        path = os.path.join(path, fold)
-        if path not in ftp_srv.nlst(os.path.dirname(path)):
-          ftp_srv.mkd(path)
-          # drwxr-xr-x
-          ftp_srv.voidcmd('SITE CHMOD 775 %s' % path)
-
-    # uploading a file
+      session_pool.execute(_ftp_create_folder, session_pool, *args)
     elif len(args) == 2:
-      source, dest = args
-      if (os.path.exists(source)):
-        # if destination exits, change the name
-        if dest in ftp_srv.nlst(os.path.dirname(dest)):
-          dest = dest + "." + time.strftime("%Y_%m_%d_%H_%M_%S")
-
-        ftp_srv.storbinary("STOR %s" % dest, open(source, "rb"))
-        # -rw-r--r--
-        ftp_srv.voidcmd('SITE CHMOD 644 %s' % dest)
-      else:
-        print "%s: cannot upload. the source doesn't exist: '%s'" % (timestamp(), source)
+      session_pool.execute(_ftp_upload_file, session_pool, *args)
     else:
-      print "%s: Incorrect arguments: '%s'" % (timestamp(), str(args))
-  # pylint: disable=W0703
-  except Error as e:
-    print "%s: An exception '%s' happened during creation of a folder or uploading of a file" % (timestamp(), e)
-    print "".join(traceback.format_exception(*sys.exc_info()))
-    sys.exc_clear()
+      session_pool.execute(_ftp_upload_compressed_file, session_pool, *args)
   finally:
+    if own_pool:
+      session_pool.close()
+
+
+def _ftp_create_folder(ftp_srv, session_pool, folder):
+  """it creates a folder and all its parents on the ftp server.
+  Remote folders are listed through the directory cache of the pool,
+  so every remote folder is listed at most once per pool
+  @param ftp_srv: an opened ftp connection
+  @type ftp_srv: FTP
+  @param session_pool: a pool the connection belongs to
+  @type session_pool: FTPSessionPool
+  @param folder: a full name of the folder starting from the ftp_log_root
+  @type folder: string
+  @return: a number of transferred bytes
+  @rtype: int
+  """
+  ftp_log_root = Environment.get_hyperion_ftp_log_root()
+
+  # creating folders recursivly
+  folders_str = folder.replace(ftp_log_root, "").strip('/')
+  folders = folders_str.split('/')
+  path = ftp_log_root
+  for fold in folders:
+    path = os.path.join(path, fold)
+    if not session_pool.dir_cache.exists(ftp_srv, path):
+      ftp_srv.mkd(path)
+      # drwxr-xr-x
+      ftp_srv.voidcmd('SITE CHMOD 775 %s' % path)
+      session_pool.dir_cache.add(path, is_folder=True)
+  return 0
+
+
+def _ftp_upload_file(ftp_srv, session_pool, source, dest):
+  """it uploads a local file to the ftp server.
+  if the destination exists, a timestamp is added to the name of the destination.
+  if the pool has a manifest, a file which has already been uploaded is skipped
+  and a partially uploaded file is resumed by the REST command
+  @param ftp_srv: an opened ftp connection
+  @type ftp_srv: FTP
+  @param session_pool: a pool the connection belongs to, its bandwidth limiter, directory cache
+                       and manifest are used
+  @type session_pool: FTPSessionPool
+  @param source: a full name of the local file
+  @type source: string
+  @param dest: a full name of the remote file
+  @type dest: string
+  @return: a number of transferred bytes
+  @rtype: int
+  """
+  if not os.path.exists(source):
+    print "%s: cannot upload. the source doesn't exist: '%s'" % (timestamp(), source)
+    return 0
+
+  manifest = session_pool.manifest
+  remote = None
+  offset = 0
+  target = dest
+  if manifest is not None:
+    if manifest.is_uploaded(source, target):
+      session_pool.count_skipped()
+      return 0
+    remote = manifest.get_partial_upload(source, target)
+    if remote is not None:
+      dest = remote
+      offset = _ftp_get_size(ftp_srv, dest)
+      if offset > os.path.getsize(source):
+        offset = 0
+
+  # if destination exits, change the name. a partially uploaded destination is overwritten
+  if remote is None and session_pool.dir_cache.exists(ftp_srv, dest):
+    dest = dest + "." + time.strftime("%Y_%m_%d_%H_%M_%S")
+
+  if manifest is not None:
+    manifest.start(source, target, dest)
+  md5 = hashlib.md5()
+  with open(source, "rb") as f_in:
+    # the hash covers the whole file, so the part, which has been already uploaded, is read as well
+    while f_in.tell() < offset:
+      md5.update(f_in.read(min(FTP_BLOCK_SIZE, offset - f_in.tell())))
+
+    def callback(block):
+      """it is called by ftplib for every sent block"""
+      md5.update(block)
+      if session_pool.bandwidth_limiter is not None:
+        session_pool.bandwidth_limiter.consume(len(block))
+    ftp_srv.storbinary("STOR %s" % dest, f_in, FTP_BLOCK_SIZE, callback, offset or None)
+    bytes_sent = f_in.tell() - offset
+  session_pool.dir_cache.add(dest)
+  # -rw-r--r--
+  ftp_srv.voidcmd('SITE CHMOD 644 %s' % dest)
+  if manifest is not None:
+    manifest.finish(source, target, md5.hexdigest())
+  return bytes_sent
+
+
+def _ftp_upload_compressed_file(ftp_srv, session_pool, source, dest, keep_compressed=False):
+  """it gzips a local file on the fly and uploads it to the ftp server.
+  if the destination exists, a timestamp is added to the name of the destination.
+  if the pool has a manifest, a file which has already been uploaded is skipped.
+  @param ftp_srv: an opened ftp connection
+  @type ftp_srv: FTP
+  @param session_pool: a pool the connection belongs to, its bandwidth limiter, directory cache
+                       and manifest are used
+  @type session_pool: FTPSessionPool
+  @param source: a full name of the local file
+  @type source: string
+  @param dest: a full name of the remote gzipped file
+  @type dest: string
+  @param keep_compressed: whether to replace the local file by its gzipped copy
+  @type keep_compressed: boolean
+  @return: a number of transferred bytes
+  @rtype: int
+  """
+  if not os.path.exists(source):
+    print "%s: cannot upload. the source doesn't exist: '%s'" % (timestamp(), source)
+    return 0
+
+  manifest = session_pool.manifest
+  remote = None
+  target = dest
+  if manifest is not None:
+    if manifest.is_uploaded(source, target):
+      session_pool.count_skipped()
+      return 0
+    # a gzip stream cannot be resumed, but the partially uploaded destination is overwritten
+    remote = manifest.get_partial_upload(source, target)
+    if remote is not None:
+      dest = remote
+
+  # if destination exits, change the name
+  if remote is None and session_pool.dir_cache.exists(ftp_srv, dest):
+    dest = dest + "." + time.strftime("%Y_%m_%d_%H_%M_%S")
+
+  if manifest is not None:
+    manifest.start(source, target, dest)
+  local_copy = "%s.gz" % source
+  md5 = hashlib.md5()
+  ftp_srv.voidcmd("TYPE I")
+  conn = ftp_srv.transfercmd("STOR %s" % dest)
+  try:
+    writer = _FTPDataWriter(conn, session_pool.bandwidth_limiter, local_copy if keep_compressed else None)
     try:
-      ftp_srv.quit()
-    # pylint: disable=W0703
-    except Error as e_quit:
-      print "%s: An exception '%s' happened during closing a ftp conneciton" % (timestamp(), e_quit)
-      ftp_srv.close()
+      f_out = gzip.GzipFile(os.path.basename(source), "wb", fileobj=writer)
+      with open(source, "rb") as f_in:
+        for block in iter(lambda: f_in.read(FTP_BLOCK_SIZE), ""):
+          md5.update(block)
+          f_out.write(block)
+      f_out.close()
+    finally:
+      writer.close()
+  except:
+    if keep_compressed and os.path.exists(local_copy):
+      os.remove(local_copy)
+    raise
+  finally:
+    conn.close()
+  ftp_srv.voidresp()
+  session_pool.dir_cache.add(dest)
+  # -rw-r--r--
+  ftp_srv.voidcmd('SITE CHMOD 644 %s' % dest)
+  if manifest is not None:
+    manifest.finish(source, target, md5.hexdigest())
+  if keep_compressed:
+    os.remove(source)
+    # the gzipped copy is found instead of the file by the next upload of the folder
+    if manifest is not None:
+      manifest.add_uploaded(local_copy, target, dest, writer.md5.hexdigest())
+  return writer.bytes_sent
+
+
+def _ftp_get_size(ftp_srv, path):
+  """it returns a size of a remote file
+  @param ftp_srv: an opened ftp connection
+  @type ftp_srv: FTP
+  @param path: a full name of the remote file
+  @type path: string
+  @return: a size of the file in bytes or 0, if the file does not exist
+  @rtype: int
+  """
+  try:
+    # some servers report the size only in the binary mode
+    ftp_srv.voidcmd("TYPE I")
+    return ftp_srv.size(path) or 0
+  except error_perm:
+    sys.exc_clear()
+    return 0
+
+
+def _get_md5(file_name):
+  """it calculates a md5 hash of a local file
+  @param file_name: a full name of the file
+  @type file_name: string
+  @return: a hex digest of the md5 hash
+  @rtype: string
+  """
+  md5 = hashlib.md5()
+  with open(file_name, "rb") as f:
+    for block in iter(lambda: f.read(FTP_BLOCK_SIZE), ""):
+      md5.update(block)
+  return md5.hexdigest()
 
 
-def analyze_sys_log(log_file_name, test_hash, test_results, keywords, role_name=None):
+def analyze_sys_log(log_file_name, test_hash, test_results, keywords, role_name=None, use_mmap=False,
+                    use_index=False):
   """it analyses a log file and adds (annotate) results into test_results
   @param log_file_name: a full name of the log file
   @type log_file_name: string
@@ -426,6 +813,12 @@ def analyze_sys_log(log_file_name, test_hash, test_results, keywords, role_name=
   @param role_name: a name of the role (None by default),
                     if there are more then one DUT in the test.
   @type role_name: string
+  @param use_mmap: whether to memory-map the log file instead of reading it line by line.
+                   it is much faster for big logs, as only lines with keywords are extracted
+  @type use_mmap: boolean
+  @param use_index: whether to use (and to update) a L{SysLogIndex} of the log file.
+                    it is much faster, if the same log is analysed many times, for ex. for several tests
+  @type use_index: boolean
   @return: whether a log file has been analysed
   @rtype: boolean
   """
@@ -437,25 +830,213 @@ def analyze_sys_log(log_file_name, test_hash, test_results, keywords, role_name=
     print "there are no key words for analysis"
     return False
 
-  is_test_hash_found = False
-  is_analysed = False
+  if use_index:
+    matches, is_analysed = SysLogIndex(log_file_name).get_matches(test_hash, keywords, role_name)
+  elif use_mmap:
+    matches, is_analysed = _scan_sys_log_mmap(log_file_name, test_hash, KeywordScanner(keywords, role_name))
+  else:
+    matches, is_analysed = _scan_sys_log(log_file_name, test_hash, KeywordScanner(keywords, role_name))
+  _annotate_sys_log_matches(test_results, [matches])
+  return is_analysed
+
+
+def analyze_sys_logs(jobs, test_results, processes=None, use_mmap=True):
+  """it analyses many log files for many roles and adds (annotate) results into test_results at once.
+  Jobs for the same log file and the same test hash are merged, so every log file is scanned once
+  for keywords of all roles. Log files are scanned in parallel in a pool of processes.
+  @param jobs: jobs to analyse as tuples (log_file_name, test_hash, keywords, role_name),
+               see L{analyze_sys_log} for a description of their items
+  @type jobs: list of tuples
+  @param test_results: a result of execution of a test case
+  @type test_results: BeoTestResult
+  @param processes: a number of processes in the pool, None (by default) means
+                    a number of log files, but not more than a number of CPUs
+  @type processes: int
+  @param use_mmap: whether to memory-map log files instead of reading them line by line
+  @type use_mmap: boolean
+  @return: whether a log file has been analysed, for every job
+  @rtype: list of boolean
+  """
+  # (log_file_name, test_hash) -> a list of (keywords, role_name), groups are annotated in the order of jobs
+  groups = OrderedDict()
+  for log_file_name, test_hash, keywords, role_name in jobs:
+    if not os.path.exists(log_file_name):
+      print "the file with the name '%s' does not exists" % log_file_name
+    elif len(keywords) == 0:
+      print "there are no key words for analysis"
+    else:
+      groups.setdefault((log_file_name, test_hash), []).append((keywords, role_name))
+  if not groups:
+    return [False] * len(jobs)
+
+  group_jobs = [(log_file_name, test_hash, keywords_roles, use_mmap)
+                for (log_file_name, test_hash), keywords_roles in groups.iteritems()]
+  if processes is None:
+    processes = min(len(group_jobs), multiprocessing.cpu_count())
+  if processes > 1:
+    pool = multiprocessing.Pool(processes)
+    try:
+      results = pool.map(_analyze_sys_log_group, group_jobs)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    results = map(_analyze_sys_log_group, group_jobs)
+
+  is_analysed = {}
+  for (log_file_name, test_hash, _keywords_roles, _use_mmap), (_matches, group_is_analysed) in zip(group_jobs, results):
+    is_analysed[(log_file_name, test_hash)] = group_is_analysed
+  _annotate_sys_log_matches(test_results, [matches for matches, _group_is_analysed in results])
+  return [is_analysed.get((log_file_name, test_hash), False) for log_file_name, test_hash, _keywords, _role_name in jobs]
+
+
+def _analyze_sys_log_group(group_job):
+  """it scans a log file for keywords of several roles. it is executed in a process of a pool
+  @param group_job: (log_file_name, test_hash, [(keywords, role_name), ...], use_mmap)
+  @type group_job: tuple
+  @return: a list of found lines as (line number, line, keys) and whether there were lines to analyse
+  @rtype: tuple (list, boolean)
+  """
+  log_file_name, test_hash, keywords_roles, use_mmap = group_job
+  scanner = None
+  for keywords, role_name in keywords_roles:
+    if scanner is None:
+      scanner = KeywordScanner(keywords, role_name)
+    else:
+      scanner.add(keywords, role_name)
+  if use_mmap:
+    return _scan_sys_log_mmap(log_file_name, test_hash, scanner)
+  return _scan_sys_log(log_file_name, test_hash, scanner)
+
+
+def _annotate_sys_log_matches(test_results, matches_lists):
+  """it merges found lines into syslog annotations of test results
+  @param test_results: a result of execution of a test case
+  @type test_results: BeoTestResult
+  @param matches_lists: lists of found lines as (line number, line, keys)
+  @type matches_lists: list of lists
+  """
   kw_dict, _keywords = test_results.GetAnnotations().get(const.message_type_syslog, (defaultdict(list), None))
   kw_dict = defaultdict(list, kw_dict)
+  for matches in matches_lists:
+    for line_number, line, keys in matches:
+      for key in keys:
+        kw_dict[key].append("(%s): %s" % (line_number, line))
+  test_results.Annotate({const.message_type_syslog: (dict(kw_dict), dict(kw_dict).keys())})
 
+
+def _scan_sys_log(log_file_name, test_hash, scanner):
+  """it reads a log file line by line and finds keywords in lines after the line with the test hash
+  @param log_file_name: a full name of the log file
+  @type log_file_name: string
+  @param test_hash: a unique indentificator of a test which was printed in a log
+  @type test_hash: string
+  @param scanner: a scanner of keywords
+  @type scanner: KeywordScanner
+  @return: a list of found lines as (line number, line, keys) and whether there were lines to analyse
+  @rtype: tuple (list, boolean)
+  """
+  matches = []
+  is_test_hash_found = False
+  is_analysed = False
   with open(log_file_name, 'r') as log_file:
     for i, line in enumerate(log_file):
       if not is_test_hash_found:
         is_test_hash_found = str(test_hash) in line
         continue
       is_analysed = True
-      for keyword in keywords:
-        key = keyword
-        if role_name != None:
-          key = "%s_%s" % (role_name, keyword)
-        if keyword in line:
-          kw_dict[key].append("(%s): %s" % (i + 1, line))
-    test_results.Annotate({const.message_type_syslog: (dict(kw_dict), dict(kw_dict).keys())})
-  return is_analysed
+      keys = scanner.scan(line)
+      if keys:
+        matches.append((i + 1, line, keys))
+  return matches, is_analysed
+
+
+def _scan_sys_log_mmap(log_file_name, test_hash, scanner):
+  """it memory-maps a log file and finds keywords in lines after the line with the test hash.
+  The test hash is found by one search, then keywords are searched in the rest of the file
+  and only lines with keywords are extracted. Lines are counted only to number found lines.
+  @param log_file_name: a full name of the log file
+  @type log_file_name: string
+  @param test_hash: a unique indentificator of a test which was printed in a log
+  @type test_hash: string
+  @param scanner: a scanner of keywords
+  @type scanner: KeywordScanner
+  @return: a list of found lines as (line number, line, keys) and whether there were lines to analyse
+  @rtype: tuple (list, boolean)
+  """
+  matches = []
+  with open(log_file_name, 'rb') as log_file:
+    size = os.fstat(log_file.fileno()).st_size
+    # an empty file cannot be mapped
+    if size == 0:
+      return matches, False
+    data = mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      pos = data.find(str(test_hash))
+      if pos != -1:
+        pos = data.find("\n", pos)
+      # the analysis starts from the line after the line with the test hash
+      if pos == -1 or pos + 1 == size:
+        return matches, False
+      pos += 1
+      line_number = _count_lines(data, 0, pos) + 1
+      for _line_start, line_number, line, keys in _scan_lines_mmap(data, pos, size, line_number, scanner):
+        matches.append((line_number, line, keys))
+    finally:
+      data.close()
+  return matches, True
+
+
+def _scan_lines_mmap(data, start, end, line_number, scanner):
+  """it finds lines with keywords in a part of a memory-mapped file
+  @param data: a memory-mapped file
+  @type data: mmap
+  @param start: a start of the part, it has to be a start of a line
+  @type start: int
+  @param end: an end of the part, it has to be an end of a line or of the file
+  @type end: int
+  @param line_number: a number of the line which starts at 'start'
+  @type line_number: int
+  @param scanner: a scanner of keywords
+  @type scanner: KeywordScanner
+  @return: a generator of found lines as (offset of the line, line number, line, keys)
+  @rtype: generator
+  """
+  pos = start
+  line_start = start
+  while pos < end:
+    found = scanner.find(data, pos, end)
+    if found == -1:
+      break
+    previous_line_start = line_start
+    line_start = data.rfind("\n", pos, found) + 1 or pos
+    line_end = data.find("\n", found, end) + 1 or end
+    line_number += _count_lines(data, previous_line_start, line_start)
+    line = data[line_start:line_end]
+    keys = scanner.scan(line)
+    if keys:
+      yield line_start, line_number, line, keys
+    pos = line_end
+
+
+def _count_lines(data, start, end):
+  """it counts line breaks in a part of a memory-mapped file. The part is read by chunks.
+  @param data: a memory-mapped file
+  @type data: mmap
+  @param start: a start of the part
+  @type start: int
+  @param end: an end of the part
+  @type end: int
+  @return: a number of line breaks
+  @rtype: int
+  """
+  count = 0
+  chunk_size = 16 * 1024 * 1024
+  while start < end:
+    stop = min(end, start + chunk_size)
+    count += data[start:stop].count("\n")
+    start = stop
+  return count
 
 
 def is_host_alive(host, port=None):
@@ -534,125 +1115,2662 @@ class SocketHelper (object):
     return None
 
 
-class SerializableQueue(object):
-  """ the class implements a queue which could be serialized to a file and loaded back
-  if there is more than n items in a queue, it is serialized into a file and becomes empty.
-  Only strings can be serialized. Every item in the queue is saved as a separated string in a serialization file
-  @todo: make the type check for the requirement, that "Only strings can be serialized"
-
-  @ivar __queue: a queue to store queries
-  @type __queue: deque
-  @ivar __full_file_name: a full name of the file for serialization
-  @type __full_file_name: string
-  @ivar __max_length: max length of the queue until serialization happens
-  @type __max_length: int
-  @ivar __is_queue_serialized: a flag, indicating the the queue has been serialized
-  @type __is_queue_serialized: boolean
-  """
-  def __init__(self, full_file_name, max_length):
-    self.__queue = deque()
-    if full_file_name is None:
-      self.__full_file_name = tempfile.mktemp()
-    else:
-      self.__full_file_name = full_file_name
-    self.__max_length = max_length
-    self.__is_queue_serialized = False
+class FTPSessionPool(object):
+  """a pool of authenticated sessions to the Hyperion's ftp server.
+  Sessions are opened on demand (not more than 'size' at the same time) and reused by all actions
+  executed through the pool, so uploading of many files costs only one login per session.
+  If a session is broken, it is dropped and the action is repeated on a new session.
+
+  @cvar CONNECTION_ERRORS: exceptions which mean that a session is broken and should be reopened
+  @type CONNECTION_ERRORS: tuple
+  @ivar _size: max number of sessions which are opened at the same time
+  @type _size: int
+  @ivar _timeout: a timeout in sec for a socket of a session
+  @type _timeout: int
+  @ivar _max_count_attempts: how many times to try to connect or to execute an action
+  @type _max_count_attempts: int
+  @ivar _idle: sessions which are opened, but not used at the moment
+  @type _idle: deque
+  @ivar bandwidth_limiter: a limiter of the total upload bandwidth of all sessions, None means no limit
+  @type bandwidth_limiter: BandwidthLimiter
+  @ivar dir_cache: listings of remote folders shared by all sessions
+  @type dir_cache: RemoteDirectoryCache
+  @ivar manifest: a manifest of uploaded files, None means that files are always uploaded
+  @type manifest: UploadManifest
+  @ivar _stats: counters of the pool: connections, reconnects, actions, failures, bytes and latencies
+  @type _stats: dictionary
+  """
+  CONNECTION_ERRORS = (socket.error, EOFError, error_temp)
+
+  def __init__(self, size=1, timeout=300, max_count_attempts=5, max_bandwidth=None):
+    self._size = size
+    self._timeout = timeout
+    self._max_count_attempts = max_count_attempts
+    self._idle = deque()
+    self._lock = threading.Lock()
+    self._slots = threading.BoundedSemaphore(size)
+    self.bandwidth_limiter = None
+    if max_bandwidth:
+      self.bandwidth_limiter = BandwidthLimiter(max_bandwidth)
+    self.dir_cache = RemoteDirectoryCache()
+    self.manifest = None
+    self._stats = {"connections": 0,
+                   "reconnects": 0,
+                   "actions": 0,
+                   "failures": 0,
+                   "skipped": 0,
+                   "bytes": 0,
+                   "latency": 0.0,
+                   "latency_max": 0.0}
+
+  def execute(self, action, *args):
+    """it executes an action on one of the sessions of the pool.
+    If the session is broken, the action is repeated on a new session
+    @param action: a function, which is called as action(ftp_srv, *args)
+                   and returns a number of transferred bytes
+    @type action: function
+    @return: a result of the action or None, if the action has failed
+    @rtype: int
+    """
+    self._slots.acquire()
+    try:
+      counter = 0
+      while (counter < self._max_count_attempts):
+        ftp_srv = self._acquire()
+        if ftp_srv is None:
+          break
+        start = time.time()
+        try:
+          result = action(ftp_srv, *args)
+        except self.CONNECTION_ERRORS as e:
+          print "%s: An exception '%s' happened on a ftp session. Reconnecting. Attempt %s" % (timestamp(), e, counter)
+          sys.exc_clear()
+          self._discard(ftp_srv)
+          ftp_srv = None
+          self._count("reconnects", 1)
+          counter += 1
+          time.sleep(counter)
+          continue
+        # pylint: disable=W0703
+        except Error as e:
+          print "%s: An exception '%s' happened during creation of a folder or uploading of a file" % (timestamp(), e)
+          print "".join(traceback.format_exception(*sys.exc_info()))
+          sys.exc_clear()
+          # a permanent error is a reply of the server, so the session is still usable
+          if isinstance(e, error_perm):
+            self._release(ftp_srv)
+          else:
+            self._discard(ftp_srv)
+          ftp_srv = None
+          break
+        else:
+          self._release(ftp_srv)
+          ftp_srv = None
+        finally:
+          # any other exception (e.g. KeyboardInterrupt or an error of a local file) leaves
+          # the session in an unknown state, so it is closed instead of being returned to the pool
+          if ftp_srv is not None:
+            self._discard(ftp_srv)
+        latency = time.time() - start
+        with self._lock:
+          self._stats["actions"] += 1
+          self._stats["bytes"] += result or 0
+          self._stats["latency"] += latency
+          self._stats["latency_max"] = max(self._stats["latency_max"], latency)
+        return result
+
+      self._count("failures", 1)
+      return None
+    finally:
+      self._slots.release()
+
+  def close(self):
+    """it closes all opened sessions of the pool
+    """
+    with self._lock:
+      sessions = list(self._idle)
+      self._idle.clear()
+    for ftp_srv in sessions:
+      self._quit(ftp_srv)
+
+  def get_stats(self):
+    """it returns counters of the pool
+    @return: counters: connections, reconnects, actions, failures, skipped, bytes, latency (a total in sec),
+             latency_max, latency_avg and listings (a number of listed remote folders)
+    @rtype: dictionary
+    """
+    with self._lock:
+      stats = dict(self._stats)
+    stats["listings"] = self.dir_cache.listings
+    stats["latency_avg"] = stats["latency"] / stats["actions"] if stats["actions"] else 0.0
+    return stats
+
+  def count_skipped(self):
+    """it reports that a file has been skipped, as it was uploaded before
+    """
+    self._count("skipped", 1)
+
+  def _count(self, name, value):
+    """it increases a counter of the pool
+    @param name: a name of the counter
+    @type name: string
+    @param value: a value to add
+    @type value: int
+    """
+    with self._lock:
+      self._stats[name] += value
 
-  def __del__(self):
-    if os.path.exists(self.__full_file_name) and os.path.getsize(self.__full_file_name) == 0:
-      os.remove(self.__full_file_name)
+  def _acquire(self):
+    """it returns an idle session or opens a new one
+    @return: an opened ftp session or None, if it is impossible to connect
+    @rtype: FTP
+    """
+    with self._lock:
+      if self._idle:
+        return self._idle.popleft()
+    return self._connect()
+
+  def _release(self, ftp_srv):
+    """it returns a session back to the pool
+    @param ftp_srv: a session to return
+    @type ftp_srv: FTP
+    """
+    with self._lock:
+      self._idle.append(ftp_srv)
 
-  def __save(self):
-    """ it saves a queue as strings into a file
+  def _discard(self, ftp_srv):
+    """it closes a broken session
+    @param ftp_srv: a session to close
+    @type ftp_srv: FTP
     """
-    open_mode = "a"
-    if not self.__is_queue_serialized:
-      open_mode = "w"
-    with open(self.__full_file_name, open_mode) as f:
-      for item in self.__queue:
-        f.write("%s%s" % (item, "\n"))
+    try:
+      ftp_srv.close()
+    # pylint: disable=W0703
+    except Exception as e:
+      print "%s: An exception '%s' happened during closing a ftp conneciton" % (timestamp(), e)
+      sys.exc_clear()
 
-  def __load(self, queue):
-    """it loads the serialized queue from the file into a temporary queue
-    @param queue: a queue to load date into
-    @type queue: deque
-    @return: a queue with loaded results
-    @rtype: deque
+  def _quit(self, ftp_srv):
+    """it politely closes a session
+    @param ftp_srv: a session to close
+    @type ftp_srv: FTP
     """
-    with open(self.__full_file_name, "r") as f:
-      for ln in f:
-        queue.append(ln.rstrip("\n"))
-    return queue
+    try:
+      ftp_srv.quit()
+    # pylint: disable=W0703
+    except (Error, socket.error, EOFError) as e_quit:
+      print "%s: An exception '%s' happened during closing a ftp conneciton" % (timestamp(), e_quit)
+      sys.exc_clear()
+      self._discard(ftp_srv)
 
-  def get_queue(self):
-    """It returns the queue
-    @return: a queue with results
-    @rtype: deque
+  def _connect(self):
+    """it opens a new session to the ftp server
+    @return: an opened ftp session or None, if it is impossible to connect
+    @rtype: FTP
     """
-    queue = []
-    if self.__is_queue_serialized:
-      queue = self.__load(queue)
-    queue.extend(self.__queue)
-    return queue
+    ftp_server = Environment.get_hyperion_ftp_host()
+    ftp_user, ftp_password = Environment.get_hyperion_ftp_username_password()
+
+    # trying to connect 5 times to upload a log
+    counter = 0
+    while (counter < self._max_count_attempts):
+      try:
+        ftp_srv = FTP(ftp_server, ftp_user, ftp_password, timeout=self._timeout)
+        self._count("connections", 1)
+        return ftp_srv
+      # pylint: disable=W0703
+      except (Error, socket.error, EOFError) as e:
+        print "%s: An exception '%s' happened during creation of a ftp conneciton. Attempt %s" % (timestamp(), e, counter)
+        print "".join(traceback.format_exception(*sys.exc_info()))
+        sys.exc_clear()
+
+      counter += 1
+      time.sleep(counter)
+
+    print "%s: Cannot connect to the ftp server in %s attempts" % (timestamp(), self._max_count_attempts)
+    return None
 
-  def append(self, obj):
-    """append an obj to the right end of the queue
-    if there is more than n items in a queue, it is serialized into a file and becomes empty.
-    @param obj: an object to be appended
+
+class BandwidthLimiter(object):
+  """it limits a total bandwidth of several threads which send data.
+  Every sent block reserves a time slot proportional to its size,
+  a thread sleeps until its slot is over.
+  @ivar _rate: max bandwidth in bytes per sec
+  @type _rate: float
+  @ivar _next_time: a time when the next slot starts
+  @type _next_time: float
+  """
+  def __init__(self, max_bytes_per_sec):
+    self._rate = float(max_bytes_per_sec)
+    self._next_time = time.time()
+    self._lock = threading.Lock()
+
+  def consume(self, amount):
+    """it reports that some data has been sent and waits if the bandwidth is exceeded
+    @param amount: a number of sent bytes
+    @type amount: int
     """
-    self.__queue.append(obj)
-    if len(self.__queue) > self.__max_length:
-      self.flush()
+    with self._lock:
+      now = time.time()
+      self._next_time = max(now, self._next_time) + amount / self._rate
+      delay = self._next_time - now
+    if delay > 0:
+      time.sleep(delay)
+
+
+class RemoteDirectoryCache(object):
+  """a cache of contents of remote folders on the ftp server.
+  A folder is listed lazily, when its contents is requested for the first time,
+  and the listing is updated on creation of folders and uploading of files,
+  so every remote folder is listed at most once.
+  Only base names are stored, as a ftp server may return either names or full paths
+  @ivar _listings: base names of entries of remote folders
+  @type _listings: dictionary {folder: set of names}
+  @ivar _folder_locks: locks of remote folders, a lock is kept while its folder is listed,
+    so different folders are listed in parallel
+  @type _folder_locks: dictionary {folder: threading.Lock}
+  @ivar _lock: a lock of L{_listings} and L{_folder_locks}, it is never kept during listing
+  @type _lock: threading.Lock
+  @ivar listings: a number of requested listings
+  @type listings: int
+  """
+  def __init__(self):
+    self._listings = {}
+    self._folder_locks = {}
+    self._lock = threading.Lock()
+    self.listings = 0
+
+  def _get_folder_lock(self, folder):
+    """it returns a lock of a remote folder
+    @param folder: a full name of the remote folder
+    @type folder: string
+    @rtype: threading.Lock
+    """
+    with self._lock:
+      return self._folder_locks.setdefault(folder, threading.Lock())
+
+  def exists(self, ftp_srv, path):
+    """it checks whether a remote file or folder exists
+    @param ftp_srv: an opened ftp connection, which is used if the parent folder has not been listed yet
+    @type ftp_srv: FTP
+    @param path: a full name of the remote file or folder
+    @type path: string
+    @return: whether the path exists
+    @rtype: boolean
+    """
+    folder = os.path.dirname(path)
+    # the lock of the folder is kept during listing, otherwise a file uploaded meanwhile could be missed
+    with self._get_folder_lock(folder):
+      with self._lock:
+        names = self._listings.get(folder, None)
+        if names is not None:
+          return os.path.basename(path) in names
+      listed = set(os.path.basename(name) for name in ftp_srv.nlst(folder))
+      with self._lock:
+        names = self._listings.setdefault(folder, set())
+        names.update(listed)
+        self.listings += 1
+        return os.path.basename(path) in names
+
+  def add(self, path, is_folder=False):
+    """it adds a created remote file or folder to the cache
+    @param path: a full name of the remote file or folder
+    @type path: string
+    @param is_folder: whether the path is a new (empty) folder
+    @type is_folder: boolean
+    """
+    # it waits, if the parent folder is being listed
+    with self._get_folder_lock(os.path.dirname(path)):
+      with self._lock:
+        names = self._listings.get(os.path.dirname(path), None)
+        if names is not None:
+          names.add(os.path.basename(path))
+        if is_folder:
+          self._listings.setdefault(path, set())
 
-  def extend(self, objs):
-    """It extend a queue with another iterable object
-    if there is more than n items in a queue, it is serialized into a file and becomes empty.
-    @param objs: an iterable list of objects
+  def clear(self):
+    """it clears the cache
     """
-    self.__queue.extend(objs)
-    if len(self.__queue) > self.__max_length:
-      self.flush()
+    with self._lock:
+      self._listings.clear()
+
+
+class UploadManifest(object):
+  """a journal of files uploaded to the ftp server, which is stored next to the uploaded source
+  as '<source>.upload_manifest'. Every line of the journal is a json record with a path of the file
+  (relative to the folder of the journal), its size, mtime, md5 hash, a target (the intended remote name),
+  a remote name (the target or the target with a timestamp, if the target existed) and a state.
+  The latest record of a file and a target wins, so a record is only appended and a broken last line
+  (if uploading is killed) is ignored.
+  A file is considered as uploaded to a target, if its size and mtime (or md5 hash, if mtime is changed)
+  are equal to ones in the journal. Uploading of the same file to another target (e.g. another task)
+  is independent.
+
+  @cvar FILE_SUFFIX: a suffix of the journal file name
+  @type FILE_SUFFIX: string
+  @ivar file_name: a full name of the journal file
+  @type file_name: string
+  @ivar _entries: the latest records of files
+  @type _entries: dictionary {(relative path, target): record}
+  """
+  FILE_SUFFIX = ".upload_manifest"
+
+  def __init__(self, source):
+    self.file_name = source.rstrip(os.sep) + self.FILE_SUFFIX
+    self._folder = os.path.dirname(os.path.abspath(self.file_name))
+    self._entries = {}
+    self._lock = threading.Lock()
+    self._load()
+
+  def is_uploaded(self, source, dest):
+    """it checks whether a local file has been completely uploaded to a target and has not been changed since that
+    @param source: a full name of the local file
+    @type source: string
+    @param dest: the target, a full name of the remote file
+    @type dest: string
+    @return: whether the file has been uploaded
+    @rtype: boolean
+    """
+    entry = self._get_entry(source, dest)
+    if entry is None or not entry["done"]:
+      return False
+    size, mtime = self._get_size_mtime(source)
+    if size != entry["size"]:
+      return False
+    if mtime == entry["mtime"]:
+      return True
+    # the file is touched, but not necessarily changed
+    if _get_md5(source) != entry["md5"]:
+      return False
+    self._write(dict(entry, mtime=mtime))
+    return True
 
-  def flush(self):
-    """it flushes the queue into the file
+  def get_partial_upload(self, source, dest):
+    """it returns a remote name of a file, if uploading of the file to a target has been started, but not finished,
+    and the local file has not been changed since that
+    @param source: a full name of the local file
+    @type source: string
+    @param dest: the target, a full name of the remote file
+    @type dest: string
+    @return: a full name of the remote file or None
+    @rtype: string
     """
-    self.__save()
-    self.__queue.clear()
-    self.__is_queue_serialized = True
+    entry = self._get_entry(source, dest)
+    if entry is None or entry["done"]:
+      return None
+    if (entry["size"], entry["mtime"]) != self._get_size_mtime(source):
+      return None
+    return entry["remote"]
+
+  def start(self, source, dest, remote):
+    """it records that uploading of a file is started
+    @param source: a full name of the local file
+    @type source: string
+    @param dest: the target, a full name of the remote file
+    @type dest: string
+    @param remote: a full name of the remote file the file is uploaded to
+    @type remote: string
+    """
+    self._write(self._get_new_entry(source, dest, remote))
+
+  def finish(self, source, dest, md5):
+    """it records that a file has been uploaded
+    @param source: a full name of the local file
+    @type source: string
+    @param dest: the target, a full name of the remote file
+    @type dest: string
+    @param md5: a md5 hash of the uploaded content
+    @type md5: string
+    """
+    entry = self._get_entry(source, dest)
+    self._write(dict(entry, md5=md5, done=True))
+
+  def add_uploaded(self, source, dest, remote, md5):
+    """it records that a local file is the content, which has been uploaded to a target,
+    e.g. a gzipped copy, which replaces the uploaded file, so it is not uploaded again
+    @param source: a full name of the local file
+    @type source: string
+    @param dest: the target, a full name of the remote file
+    @type dest: string
+    @param remote: a full name of the remote file the content has been uploaded to
+    @type remote: string
+    @param md5: a md5 hash of the local file
+    @type md5: string
+    """
+    self._write(dict(self._get_new_entry(source, dest, remote), md5=md5, done=True))
 
-  def clear(self):
-    """it clear the queue
+  def _get_new_entry(self, source, dest, remote):
+    """it creates a record of a file, which is not uploaded yet
+    @return: the record
+    @rtype: dictionary
+    """
+    size, mtime = self._get_size_mtime(source)
+    return {"path": self._get_key(source),
+            "size": size,
+            "mtime": mtime,
+            "md5": None,
+            "target": dest,
+            "remote": remote,
+            "done": False}
+
+  def _get_key(self, source):
+    """it returns a key of a file in the journal
+    @param source: a full name of the local file
+    @type source: string
+    @return: a path of the file relative to the folder of the journal
+    @rtype: string
+    """
+    return os.path.relpath(os.path.abspath(source), self._folder)
+
+  def _get_entry(self, source, dest):
+    """it returns the latest record of a file and a target
+    @param source: a full name of the local file
+    @type source: string
+    @param dest: the target, a full name of the remote file
+    @type dest: string
+    @return: the record or None, if there is no record
+    @rtype: dictionary
     """
-    self.__queue.clear()
-    self.__is_queue_serialized = False
+    with self._lock:
+      return self._entries.get((self._get_key(source), dest), None)
 
+  @staticmethod
+  def _get_size_mtime(source):
+    """it returns a size and a mtime of a local file
+    @param source: a full name of the local file
+    @type source: string
+    @return: the size and the mtime
+    @rtype: tuple (int, float)
+    """
+    stat = os.stat(source)
+    return stat.st_size, stat.st_mtime
 
-class TimeoutServerProxy(xmlrpclib.ServerProxy):
-  """a xmlrpc servert proxy which uses a timeout for connections
+  def _load(self):
+    """it loads the journal, if it exists
+    """
+    if not os.path.exists(self.file_name):
+      return
+    with open(self.file_name, "r") as f:
+      for ln in f:
+        try:
+          entry = json.loads(ln)
+        except ValueError:
+          # a line could be broken, if the previous upload was killed
+          sys.exc_clear()
+          continue
+        # records written before targets were introduced have only the remote name
+        entry.setdefault("target", entry["remote"])
+        self._entries[(entry["path"], entry["target"])] = entry
+
+  def _write(self, entry):
+    """it appends a record to the journal
+    @param entry: a record to write
+    @type entry: dictionary
+    """
+    with self._lock:
+      self._entries[(entry["path"], entry["target"])] = entry
+      with open(self.file_name, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+class _FTPDataWriter(object):
+  """a file-like object, which sends written data into a ftp data connection
+  and optionally writes a copy of the data into a local file
+  @ivar bytes_sent: a number of sent bytes
+  @type bytes_sent: int
+  @ivar md5: a md5 hash of sent data
+  @type md5: hashlib.md5
   """
-  def __init__(self, uri, timeout=5, *l, **kw):
-    kw['transport'] = TimeoutTransport(timeout=timeout, use_datetime=kw.get('use_datetime', 0))
-    xmlrpclib.ServerProxy.__init__(self, uri, *l, **kw)
-
+  def __init__(self, conn, bandwidth_limiter=None, copy_file_name=None):
+    """constructor
+    @param conn: an opened data connection
+    @type conn: socket
+    @param bandwidth_limiter: a limiter of the upload bandwidth, None means no limit
+    @type bandwidth_limiter: BandwidthLimiter
+    @param copy_file_name: a full name of a local file to write a copy of the data, None means no copy
+    @type copy_file_name: string
+    """
+    self._conn = conn
+    self._bandwidth_limiter = bandwidth_limiter
+    self._copy = None
+    if copy_file_name is not None:
+      self._copy = open(copy_file_name, "wb")
+    self.bytes_sent = 0
+    self.md5 = hashlib.md5()
+
+  def write(self, data):
+    """it sends data
+    @param data: data to send
+    @type data: string
+    """
+    if not data:
+      return
+    self._conn.sendall(data)
+    self.bytes_sent += len(data)
+    self.md5.update(data)
+    if self._copy is not None:
+      self._copy.write(data)
+    if self._bandwidth_limiter is not None:
+      self._bandwidth_limiter.consume(len(data))
 
-class TimeoutTransport(xmlrpclib.Transport):
-  """ a timeout transport
-  @ivar timeout: a timeout in sec for a socket
-  @type timeout: int
+  def flush(self):
+    """it flushes the local copy"""
+    if self._copy is not None:
+      self._copy.flush()
+
+  def close(self):
+    """it closes the local copy, the data connection is closed by the owner"""
+    if self._copy is not None:
+      self._copy.close()
+      self._copy = None
+
+
+class KeywordScanner(object):
+  """it searches a list of keywords in lines of a log.
+  All keywords are compiled into one regular expression, so a line without keywords
+  is rejected in one pass. Only a line, which matches, is checked keyword by keyword
+  to find all (including overlapping) keywords in it.
+  @ivar _keys: keywords as byte strings and keys of annotations for them
+  @type _keys: list of tuples (string, string)
+  @ivar _pattern: a regular expression which matches any keyword
+  @type _pattern: RegexObject
   """
-  def __init__(self, timeout=10, *l, **kw):
-    # for compatibility with 2.7
-    self._connection = (None, None)
-    self._extra_headers = []
+  def __init__(self, keywords, role_name=None):
+    """constructor
+    @param keywords: list of words to search
+    @type keywords: list
+    @param role_name: a name of the role, which is added to keys of annotations: "<role_name>_<keyword>"
+    @type role_name: string
+    """
+    self._keys = []
+    self._pattern = None
+    self.add(keywords, role_name)
+
+  def add(self, keywords, role_name=None):
+    """it adds more keywords to search, for ex. keywords of another role
+    @param keywords: list of words to search
+    @type keywords: list
+    @param role_name: a name of the role, which is added to keys of annotations: "<role_name>_<keyword>"
+    @type role_name: string
+    """
+    for keyword in keywords:
+      key = keyword
+      if role_name is not None:
+        key = "%s_%s" % (role_name, keyword)
+      if isinstance(keyword, unicode):
+        keyword = keyword.encode("utf-8")
+      self._keys.append((str(keyword), key))
+    # longer keywords first, so a keyword, which is a prefix of another one, does not hide it
+    words = sorted(set(keyword for keyword, _key in self._keys), key=len, reverse=True)
+    self._pattern = re.compile("|".join(re.escape(keyword) for keyword in words))
+
+  def scan(self, line):
+    """it finds keywords in a line
+    @param line: a line of a log
+    @type line: string
+    @return: keys of annotations for found keywords in the order of keywords
+    @rtype: list
+    """
+    if self._pattern.search(line) is None:
+      return []
+    return [key for keyword, key in self._keys if keyword in line]
+
+  def find(self, data, pos=0, endpos=None):
+    """it finds the first keyword in a data
+    @param data: a data to search in, for ex. a memory-mapped file
+    @type data: string or buffer
+    @param pos: a position to start from
+    @type pos: int
+    @param endpos: a position to stop at, None means the end of the data
+    @type endpos: int
+    @return: a position of the first found keyword or -1, if there are no keywords
+    @rtype: int
+    """
+    if endpos is None:
+      endpos = len(data)
+    match = self._pattern.search(data, pos, endpos)
+    if match is None:
+      return -1
+    return match.start()
+
+
+class SysLogFollower(threading.Thread):
+  """a thread which follows a syslog while it grows during a test and finds keywords in new lines,
+  so a final analysis processes only the unread tail of the log instead of the whole log.
+  A state (a byte offset, a line number and found lines) is saved into a file after every poll,
+  so another follower (for ex. after restart of a test runner) continues from the same place.
+  The state file is a journal of json lines: new found lines are appended followed by a position
+  (the offset and the line number), found lines after the last position (if a poll is killed) are ignored.
+
+  the following commands could be used in a test:
+
+    >>> follower = SysLogFollower(log_file_name, test_hash, ["Segmentation fault"], on_match=on_crash)
+    follower.start()
+    ...
+    follower.annotate(self.result)
+
+  @ivar state_file_name: a full name of the file where the state is saved
+  @type state_file_name: string
+  @ivar _on_match: a function which is called as on_match(line_number, line, keys) in the thread
+                   of the follower for every line with keywords, the follower is not locked during the call
+  @type _on_match: function
+  @ivar _matches: found lines as (line number, line, keys)
+  @type _matches: list
+  @ivar _offset: an offset of the first unread byte
+  @type _offset: int
+  @ivar _saved_matches: a number of found lines, which are saved into the state file
+  @type _saved_matches: int
+  @ivar _is_state_file_valid: whether the state file belongs to the follower, so it could be appended
+  @type _is_state_file_valid: boolean
+  """
+  STATE_FILE_SUFFIX = ".follow"
+
+  def __init__(self, log_file_name, test_hash, keywords, role_name=None, on_match=None,
+               poll_interval=1.0, state_file_name=None):
+    """constructor
+    @param log_file_name: a full name of the log file
+    @type log_file_name: string
+    @param test_hash: a unique indentificator of a test which was printed in a log
+    @type test_hash: string
+    @param keywords: list of words to search
+    @type keywords: list
+    @param role_name: a name of the role (None by default), if there are more then one DUT in the test.
+    @type role_name: string
+    @param on_match: a function which is called as on_match(line_number, line, keys) for every line
+                     with keywords, for ex. to stop a test on a crash. None means no function.
+                     it could call methods of the follower, e.g. L{stop}
+    @type on_match: function
+    @param poll_interval: a time in sec between reads of the log
+    @type poll_interval: float
+    @param state_file_name: a full name of the file to save the state,
+                            None (by default) means "<log_file_name>.follow"
+    @type state_file_name: string
+    """
+    threading.Thread.__init__(self, name="syslog_follower")
+    self.daemon = True
+    self._log_file_name = log_file_name
+    self._test_hash = str(test_hash)
+    self._scanner = KeywordScanner(keywords, role_name)
+    self._on_match = on_match
+    self._poll_interval = poll_interval
+    self.state_file_name = state_file_name
+    if self.state_file_name is None:
+      self.state_file_name = log_file_name + self.STATE_FILE_SUFFIX
+    self._stop_event = threading.Event()
+    self._lock = threading.Lock()
+    self._matches = []
+    self._offset = 0
+    self._line_number = 0
+    self._is_test_hash_found = False
+    self._is_analysed = False
+    self._saved_matches = 0
+    self._is_state_file_valid = False
+    self._load_state()
+
+  def run(self):
+    """it polls the log until the follower is stopped
+    """
+    while not self._stop_event.is_set():
+      self.poll()
+      self._stop_event.wait(self._poll_interval)
 
-    xmlrpclib.Transport.__init__(self, *l, **kw)
+  def stop(self):
+    """it stops the thread of the follower. if it is called by the thread (from on_match),
+    the thread stops after the current poll
+    """
+    self._stop_event.set()
+    if self.is_alive() and threading.current_thread() is not self:
+      self.join()
+
+  def poll(self, is_final=False):
+    """it reads new complete lines of the log and finds keywords in them
+    @param is_final: whether to read the last line even if it is incomplete (the log is not written anymore)
+    @type is_final: boolean
+    """
+    new_matches = []
+    with self._lock:
+      if not os.path.exists(self._log_file_name):
+        return
+      # the log has been truncated or replaced, so it is read from the beginning
+      if os.path.getsize(self._log_file_name) < self._offset:
+        self._offset = 0
+        self._line_number = 0
+        self._is_test_hash_found = False
+      offset = self._offset
+      with open(self._log_file_name, "rb") as log_file:
+        log_file.seek(self._offset)
+        for line in iter(log_file.readline, ""):
+          if not line.endswith("\n") and not is_final:
+            break
+          self._offset += len(line)
+          self._line_number += 1
+          if not self._is_test_hash_found:
+            self._is_test_hash_found = self._test_hash in line
+            continue
+          self._is_analysed = True
+          keys = self._scanner.scan(line)
+          if keys:
+            new_matches.append((self._line_number, line, keys))
+      self._matches.extend(new_matches)
+      if self._offset != offset:
+        self._save_state()
+    # the lock is released, so the function could call the follower
+    for line_number, line, keys in new_matches:
+      self._notify(line_number, line, keys)
+
+  def annotate(self, test_results):
+    """it stops the follower, reads the rest of the log and adds (annotate) results into test_results
+    @param test_results: a result of execution of a test case
+    @type test_results: BeoTestResult
+    @return: whether a log file has been analysed
+    @rtype: boolean
+    """
+    self.stop()
+    self.poll(is_final=True)
+    with self._lock:
+      _annotate_sys_log_matches(test_results, [self._matches])
+      return self._is_analysed
+
+  def get_matches(self):
+    """it returns lines with keywords found so far
+    @return: found lines as (line number, line, keys)
+    @rtype: list
+    """
+    with self._lock:
+      return list(self._matches)
+
+  def _notify(self, line_number, line, keys):
+    """it calls the on_match function. an exception in the function does not stop the follower
+    @param line_number: a number of the line
+    @type line_number: int
+    @param line: the line with keywords
+    @type line: string
+    @param keys: keys of annotations for found keywords
+    @type keys: list
+    """
+    if self._on_match is None:
+      return
+    try:
+      self._on_match(line_number, line, keys)
+    # pylint: disable=W0703
+    except Exception as e:
+      print "%s: An exception '%s' happened in the on_match function of the syslog follower" % (timestamp(), e)
+      print "".join(traceback.format_exception(*sys.exc_info()))
+      sys.exc_clear()
 
-    self.timeout = timeout
+  def _load_state(self):
+    """it loads the state saved by a previous follower of the same log and the same test
+    """
+    if not os.path.exists(self.state_file_name):
+      return
+    state = None
+    matches = []
+    pending_matches = []
+    with open(self.state_file_name, "r") as f:
+      for ln in f:
+        try:
+          record = json.loads(ln)
+        except ValueError:
+          # a line could be broken, if the previous follower was killed
+          sys.exc_clear()
+          continue
+        if "match" in record:
+          pending_matches.append(record["match"])
+        else:
+          state = record
+          matches.extend(pending_matches)
+          pending_matches = []
+    if state is None or state.get("test_hash", None) != self._test_hash:
+      return
+    self._offset = state["offset"]
+    self._line_number = state["line_number"]
+    self._is_test_hash_found = state["is_test_hash_found"]
+    self._is_analysed = state["is_analysed"]
+    self._matches = [(line_number, line.encode("utf-8"), keys) for line_number, line, keys in matches]
+
+  def _save_state(self):
+    """it appends new found lines and the position into the state file.
+    The first save of the follower rewrites the file at once, so it contains only the state of the follower
+    """
+    lines = [json.dumps({"match": (line_number, line.decode("utf-8", "replace"), keys)})
+             for line_number, line, keys in self._matches[self._saved_matches:]]
+    lines.append(json.dumps({"test_hash": self._test_hash,
+                             "offset": self._offset,
+                             "line_number": self._line_number,
+                             "is_test_hash_found": self._is_test_hash_found,
+                             "is_analysed": self._is_analysed}))
+    if self._is_state_file_valid:
+      with open(self.state_file_name, "a") as f:
+        f.write("\n".join(lines) + "\n")
+    else:
+      tmp_file_name = self.state_file_name + ".tmp"
+      with open(tmp_file_name, "w") as f:
+        f.write("\n".join(lines) + "\n")
+      os.rename(tmp_file_name, self.state_file_name)
+      self._is_state_file_valid = True
+    self._saved_matches = len(self._matches)
+
+
+class SysLogIndex(object):
+  """an index of a syslog, which is stored next to the log as '<log>.idx' and updated incrementally,
+  when the log grows. The index contains:
+    - offsets of lines after lines with test hashes, a test hash is indexed when it is requested first time
+    - posting lists (offsets and numbers of lines) of keywords, a keyword is indexed when it is requested first time
+    - checkpoints (an offset, a line number and a timestamp of a line) every L{CHECKPOINT_SIZE} bytes
+  So repeated analyses of the same log (for ex. when several tests share the log of a device) become
+  seeks and short reads instead of reading the whole log.
+  Only complete lines are indexed, the incomplete last line is scanned on every request.
+  If the beginning of the log is changed (the log is replaced), the index is rebuilt.
+
+  @cvar FILE_SUFFIX: a suffix of the index file name
+  @type FILE_SUFFIX: string
+  @cvar CHECKPOINT_SIZE: a distance in bytes between checkpoints
+  @type CHECKPOINT_SIZE: int
+  @cvar HEAD_SIZE: a size of the beginning of the log, which is used to find out that the log is replaced
+  @type HEAD_SIZE: int
+  @ivar index_file_name: a full name of the index file
+  @type index_file_name: string
+  @ivar _index: the index, see L{_get_empty_index} for the format
+  @type _index: dictionary
+  """
+  FILE_SUFFIX = ".idx"
+  CHECKPOINT_SIZE = 1024 * 1024
+  HEAD_SIZE = 4096
+  TIMESTAMP_FORMAT = "%b %d %H:%M:%S"
+
+  def __init__(self, log_file_name, index_file_name=None):
+    """constructor
+    @param log_file_name: a full name of the log file
+    @type log_file_name: string
+    @param index_file_name: a full name of the index file, None (by default) means "<log_file_name>.idx"
+    @type index_file_name: string
+    """
+    self._log_file_name = log_file_name
+    self.index_file_name = index_file_name
+    if self.index_file_name is None:
+      self.index_file_name = log_file_name + self.FILE_SUFFIX
+    self._index = self._load()
+
+  def get_matches(self, test_hash, keywords, role_name=None):
+    """it finds keywords in lines after the line with the test hash, the index is updated if necessary
+    @param test_hash: a unique indentificator of a test which was printed in a log
+    @type test_hash: string
+    @param keywords: list of words to search
+    @type keywords: list
+    @param role_name: a name of the role, which is added to keys of annotations: "<role_name>_<keyword>"
+    @type role_name: string
+    @return: a list of found lines as (line number, line, keys) and whether there were lines to analyse
+    @rtype: tuple (list, boolean)
+    """
+    with open(self._log_file_name, "rb") as log_file:
+      size = os.fstat(log_file.fileno()).st_size
+      # an empty file cannot be mapped
+      if size == 0:
+        return [], False
+      data = mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+      try:
+        self._update(data)
+        self._add_test_hash(data, test_hash)
+        self._add_keywords(data, keywords)
+        self._save()
+        return self._get_matches(data, test_hash, keywords, role_name)
+      finally:
+        data.close()
+
+  def update(self):
+    """it indexes new complete lines of the log
+    """
+    with open(self._log_file_name, "rb") as log_file:
+      if os.fstat(log_file.fileno()).st_size == 0:
+        return
+      data = mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+      try:
+        self._update(data)
+        self._save()
+      finally:
+        data.close()
+
+  def find_timestamp(self, log_timestamp):
+    """it finds a place in the log to start reading lines, which were written not earlier than the timestamp.
+    The place is the last checkpoint written before the timestamp, so lines between the checkpoint and the
+    timestamp should be skipped by a reader
+    @param log_timestamp: a timestamp as it is printed in the log, for ex. "Oct 14 16:20:38"
+    @type log_timestamp: string
+    @return: an offset and a number of the line
+    @rtype: tuple (int, int)
+    """
+    wanted = self._parse_timestamp(log_timestamp)
+    offset, line_number = 0, 1
+    for checkpoint_offset, checkpoint_line_number, checkpoint_timestamp in self._index["checkpoints"]:
+      checkpoint_time = self._parse_timestamp(checkpoint_timestamp)
+      if checkpoint_time is None:
+        continue
+      if wanted is not None and checkpoint_time > wanted:
+        break
+      offset, line_number = checkpoint_offset, checkpoint_line_number
+    return offset, line_number
+
+  @staticmethod
+  def _get_empty_index():
+    """it returns an empty index
+    @return: the index: size - a number of indexed bytes, lines - a number of indexed lines,
+             head_size and head_md5 - a size and a hash of the beginning of the log,
+             hashes - {test hash: [offset, line number] or None}, keywords - {keyword: [[offset, line number], ...]},
+             checkpoints - [[offset, line number, timestamp], ...]
+    @rtype: dictionary
+    """
+    return {"size": 0,
+            "lines": 0,
+            "head_size": 0,
+            "head_md5": "",
+            "hashes": {},
+            "keywords": {},
+            "checkpoints": []}
+
+  @staticmethod
+  def _get_key(word):
+    """it returns a key of a keyword or of a test hash in the index.
+    json returns unicode strings, so keys are stored as unicode
+    @param word: a keyword or a test hash
+    @type word: string
+    @return: the key
+    @rtype: unicode
+    """
+    if isinstance(word, unicode):
+      return word
+    return str(word).decode("utf-8")
+
+  def _parse_timestamp(self, log_timestamp):
+    """it parses a timestamp of a syslog
+    @param log_timestamp: a timestamp or a line which starts with the timestamp
+    @type log_timestamp: string
+    @return: a parsed timestamp (month, day, hour, min, sec) or None, if it cannot be parsed
+    @rtype: tuple
+    """
+    try:
+      parsed = time.strptime(log_timestamp[:15], self.TIMESTAMP_FORMAT)
+    except ValueError:
+      sys.exc_clear()
+      return None
+    return parsed[1:6]
+
+  def _update(self, data):
+    """it indexes new complete lines of the log
+    @param data: a memory-mapped log
+    @type data: mmap
+    """
+    index = self._index
+    head_size = min(len(data), self.HEAD_SIZE)
+    if (index["size"] > len(data) or
+        hashlib.md5(data[:index["head_size"]]).hexdigest() != index["head_md5"]):
+      keywords, hashes = index["keywords"].keys(), index["hashes"].keys()
+      index = self._index = self._get_empty_index()
+      index["keywords"] = dict((keyword, []) for keyword in keywords)
+      index["hashes"] = dict((test_hash, None) for test_hash in hashes)
+    if index["head_size"] < head_size:
+      index["head_size"] = head_size
+      index["head_md5"] = hashlib.md5(data[:head_size]).hexdigest()
+
+    start, end = index["size"], data.rfind("\n") + 1
+    if end <= start:
+      return
+    first_line_number = index["lines"] + 1
+
+    # checkpoints
+    pos = start
+    line_number = first_line_number
+    while pos < end:
+      if not index["checkpoints"] or pos - index["checkpoints"][-1][0] >= self.CHECKPOINT_SIZE:
+        index["checkpoints"].append([pos, line_number, data[pos:pos + 15]])
+      stop = data.find("\n", min(pos + self.CHECKPOINT_SIZE, end - 1)) + 1
+      line_number += _count_lines(data, pos, stop)
+      pos = stop
+    index["lines"] = line_number - 1
+
+    # test hashes which have not been found yet
+    for test_hash, place in index["hashes"].items():
+      if place is None:
+        index["hashes"][test_hash] = self._find_test_hash(data, test_hash, start, end, first_line_number)
+
+    # keywords
+    if index["keywords"]:
+      keywords = index["keywords"].keys()
+      scanner = KeywordScanner(keywords)
+      for line_start, line_number, _line, keys in _scan_lines_mmap(data, start, end, first_line_number, scanner):
+        for keyword in keys:
+          index["keywords"][keyword].append([line_start, line_number])
+    index["size"] = end
+
+  def _add_test_hash(self, data, test_hash):
+    """it indexes a test hash in the already indexed part of the log, if it has not been indexed yet
+    @param data: a memory-mapped log
+    @type data: mmap
+    @param test_hash: a unique indentificator of a test which was printed in a log
+    @type test_hash: string
+    """
+    key = self._get_key(test_hash)
+    if key not in self._index["hashes"]:
+      self._index["hashes"][key] = self._find_test_hash(data, key, 0, self._index["size"], 1)
+
+  def _add_keywords(self, data, keywords):
+    """it indexes keywords in the already indexed part of the log, if they have not been indexed yet
+    @param data: a memory-mapped log
+    @type data: mmap
+    @param keywords: list of words to index
+    @type keywords: list
+    """
+    new_keywords = list(set(self._get_key(keyword) for keyword in keywords) - set(self._index["keywords"]))
+    if not new_keywords:
+      return
+    for keyword in new_keywords:
+      self._index["keywords"][keyword] = []
+    scanner = KeywordScanner(new_keywords)
+    for line_start, line_number, _line, keys in _scan_lines_mmap(data, 0, self._index["size"], 1, scanner):
+      for keyword in keys:
+        self._index["keywords"][keyword].append([line_start, line_number])
+
+  @staticmethod
+  def _find_test_hash(data, test_hash, start, end, line_number):
+    """it finds the line after the first line with the test hash in a part of the log
+    @param data: a memory-mapped log
+    @type data: mmap
+    @param test_hash: a test hash
+    @type test_hash: unicode
+    @param start: a start of the part, it has to be a start of a line
+    @type start: int
+    @param end: an end of the part, it has to be an end of a line or of the file
+    @type end: int
+    @param line_number: a number of the line which starts at 'start'
+    @type line_number: int
+    @return: an offset and a number of the line after the line with the test hash or None, if it is not found
+    @rtype: list [int, int]
+    """
+    pos = data.find(test_hash.encode("utf-8"), start, end)
+    if pos == -1:
+      return None
+    pos = data.find("\n", pos, end) + 1 or end
+    return [pos, line_number + _count_lines(data, start, pos)]
+
+  def _get_matches(self, data, test_hash, keywords, role_name):
+    """it finds keywords in lines after the line with the test hash using the index
+    and scanning the not indexed rest of the log
+    @param data: a memory-mapped log
+    @type data: mmap
+    @param test_hash: a test hash
+    @type test_hash: string
+    @param keywords: list of words to search
+    @type keywords: list
+    @param role_name: a name of the role
+    @type role_name: string
+    @return: a list of found lines as (line number, line, keys) and whether there were lines to analyse
+    @rtype: tuple (list, boolean)
+    """
+    size = len(data)
+    indexed_size = self._index["size"]
+    place = self._index["hashes"][self._get_key(test_hash)]
+    if place is None:
+      # the test hash can be in the incomplete last line, then there are no lines after it
+      return [], False
+    start, start_line_number = place
+    if start >= size:
+      return [], False
+
+    # offset -> [line number, keys]
+    found = {}
+    for keyword in keywords:
+      key = keyword
+      if role_name is not None:
+        key = "%s_%s" % (role_name, keyword)
+      postings = self._index["keywords"][self._get_key(keyword)]
+      for line_start, line_number in postings[bisect.bisect_left(postings, [start]):]:
+        found.setdefault(line_start, [line_number, []])[1].append(key)
+
+    matches = []
+    for line_start in sorted(found):
+      line_number, keys = found[line_start]
+      line_end = data.find("\n", line_start) + 1 or size
+      matches.append((line_number, data[line_start:line_end], keys))
+
+    # the incomplete last line is not indexed
+    if indexed_size < size:
+      scanner = KeywordScanner(keywords, role_name)
+      for _line_start, line_number, line, keys in _scan_lines_mmap(data, indexed_size, size,
+                                                                   self._index["lines"] + 1, scanner):
+        matches.append((line_number, line, keys))
+    return matches, True
+
+  def _load(self):
+    """it loads the index from the file
+    @return: the loaded index or an empty one, if the file does not exist or is broken
+    @rtype: dictionary
+    """
+    if os.path.exists(self.index_file_name):
+      try:
+        with open(self.index_file_name, "r") as f:
+          return json.load(f)
+      except ValueError:
+        print "%s: the index of the syslog '%s' is broken. Rebuilding it" % (timestamp(), self.index_file_name)
+        sys.exc_clear()
+    return self._get_empty_index()
+
+  def _save(self):
+    """it saves the index into the file. the file is replaced at once, so it is never half-written
+    """
+    tmp_file_name = self.index_file_name + ".tmp"
+    with open(tmp_file_name, "w") as f:
+      json.dump(self._index, f)
+    os.rename(tmp_file_name, self.index_file_name)
+
+
+class _TextQueueFormat(object):
+  """the format L{SerializableQueue.FORMAT_TEXT} of a serialized queue: every item is saved as a line,
+  so only strings without line breaks can be saved
+  """
+  binary = False
+
+  def pack(self, items):
+    """it packs items into lines
+    @param items: items to pack
+    @type items: iterable
+    @rtype: string
+    """
+    return "".join("%s%s" % (item, "\n") for item in items)
+
+  def iterate(self, f, skip=0, limit=None):
+    """it reads items from the current position of a file
+    @param f: the file
+    @type f: file
+    @param skip: a number of items to skip, it is always 0 for this format
+    @type skip: int
+    @param limit: a size of the file to read, the whole file by default
+    @type limit: int
+    @return: a generator of items
+    @rtype: generator
+    """
+    pos = f.tell()
+    for ln in iter(f.readline, ""):
+      if limit is not None and pos >= limit:
+        return
+      pos += len(ln)
+      yield ln.rstrip("\n")
+
+  def read(self, f, skip, n):
+    """it reads up to n items from the current position of a file
+    @param f: the file
+    @type f: file
+    @param skip: a number of items to skip, it is always 0 for this format
+    @type skip: int
+    @param n: max number of items
+    @type n: int
+    @return: the read items and a position after them: an offset and a number of items to skip
+    @rtype: tuple
+    """
+    items = []
+    while len(items) < n:
+      ln = f.readline()
+      if not ln:
+        break
+      items.append(ln.rstrip("\n"))
+    return items, (f.tell(), 0)
+
+
+class _ChunkedQueueFormat(object):
+  """the format L{SerializableQueue.FORMAT_CHUNKED} of a serialized queue: every write is saved as a binary chunk:
+  a header (L{CHUNK_HEADER}: a magic, flags, a number of items and a size of the payload) and a payload
+  of length-prefixed items (L{ITEM_HEADER}: a type and a size of the item), the payload could be compressed by zlib
+  and the chunk could be followed by a crc32 of the chunk (L{CHUNK_CRC}).
+  Items could contain any symbols, unicode strings are loaded back as unicode strings,
+  other objects are saved as str(obj).
+  @ivar compress: whether to compress payloads of chunks
+  @type compress: boolean
+  @ivar checksum: whether to add a crc32 to chunks
+  @type checksum: boolean
+  """
+  binary = True
+
+  CHUNK_MAGIC = "SQC1"
+  CHUNK_HEADER = struct.Struct(">4sBII")
+  CHUNK_FLAG_COMPRESSED = 0x01
+  CHUNK_FLAG_CRC = 0x02
+  CHUNK_CRC = struct.Struct(">I")
+  ITEM_HEADER = struct.Struct(">BI")
+  ITEM_TYPE_STR = 0
+  ITEM_TYPE_UNICODE = 1
+
+  def __init__(self, compress=False, checksum=False):
+    self.compress = compress
+    self.checksum = checksum
+
+  def pack(self, items):
+    """it packs items into a chunk
+    @param items: items to pack
+    @type items: iterable
+    @return: the chunk, an empty string if there are no items
+    @rtype: string
+    """
+    parts = []
+    count = 0
+    for item in items:
+      item_type = self.ITEM_TYPE_STR
+      if isinstance(item, unicode):
+        item = item.encode("utf-8")
+        item_type = self.ITEM_TYPE_UNICODE
+      else:
+        item = str(item)
+      parts.append(self.ITEM_HEADER.pack(item_type, len(item)))
+      parts.append(item)
+      count += 1
+    if not count:
+      return ""
+    payload = "".join(parts)
+    flags = 0
+    if self.compress:
+      payload = zlib.compress(payload)
+      flags |= self.CHUNK_FLAG_COMPRESSED
+    if not self.checksum:
+      return self.CHUNK_HEADER.pack(self.CHUNK_MAGIC, flags, count, len(payload)) + payload
+    flags |= self.CHUNK_FLAG_CRC
+    chunk = self.CHUNK_HEADER.pack(self.CHUNK_MAGIC, flags, count, len(payload)) + payload
+    return chunk + self.CHUNK_CRC.pack(zlib.crc32(chunk) & 0xffffffff)
+
+  def read_chunk(self, f):
+    """it reads a chunk from the current position of a file
+    @param f: the file
+    @type f: file
+    @return: flags, a number of items and a payload of the chunk, None at the end of the file
+    @rtype: tuple
+    @raise BTEValueError: the chunk is truncated or broken
+    """
+    header = f.read(self.CHUNK_HEADER.size)
+    if not header:
+      return None
+    if len(header) < self.CHUNK_HEADER.size:
+      raise CustomExceptions.BTEValueError("a truncated chunk in the file '%s'" % f.name)
+    magic, flags, count, length = self.CHUNK_HEADER.unpack(header)
+    if magic != self.CHUNK_MAGIC:
+      raise CustomExceptions.BTEValueError("the file '%s' is not a chunked queue" % f.name)
+    payload = f.read(length)
+    if len(payload) < length:
+      raise CustomExceptions.BTEValueError("a truncated chunk in the file '%s'" % f.name)
+    if flags & self.CHUNK_FLAG_CRC:
+      crc = f.read(self.CHUNK_CRC.size)
+      if len(crc) < self.CHUNK_CRC.size or \
+         self.CHUNK_CRC.unpack(crc)[0] != zlib.crc32(header + payload) & 0xffffffff:
+        raise CustomExceptions.BTEValueError("a broken chunk in the file '%s'" % f.name)
+    return flags, count, payload
+
+  def unpack(self, flags, payload):
+    """it unpacks items from a payload of a chunk
+    @param flags: flags of the chunk
+    @type flags: int
+    @param payload: the payload
+    @type payload: string
+    @return: a generator of items
+    @rtype: generator
+    """
+    if flags & self.CHUNK_FLAG_COMPRESSED:
+      payload = zlib.decompress(payload)
+    pos = 0
+    while pos < len(payload):
+      item_type, length = self.ITEM_HEADER.unpack_from(payload, pos)
+      pos += self.ITEM_HEADER.size
+      item = payload[pos:pos + length]
+      pos += length
+      if item_type == self.ITEM_TYPE_UNICODE:
+        item = item.decode("utf-8")
+      yield item
+
+  def iterate(self, f, skip=0, limit=None):
+    """it reads items from the current position of a file
+    @param f: the file
+    @type f: file
+    @param skip: a number of items to skip in the first chunk
+    @type skip: int
+    @param limit: a size of the file to read, the whole file by default
+    @type limit: int
+    @return: a generator of items
+    @rtype: generator
+    """
+    while limit is None or f.tell() < limit:
+      chunk = self.read_chunk(f)
+      if chunk is None:
+        return
+      flags, _count, payload = chunk
+      for item in itertools.islice(self.unpack(flags, payload), skip, None):
+        yield item
+      skip = 0
+
+  def read(self, f, skip, n):
+    """it reads up to n items from the current position of a file
+    @param f: the file
+    @type f: file
+    @param skip: a number of items to skip in the first chunk
+    @type skip: int
+    @param n: max number of items
+    @type n: int
+    @return: the read items and a position after them: an offset and a number of items to skip
+    @rtype: tuple
+    """
+    items = []
+    offset = f.tell()
+    while len(items) < n:
+      chunk = self.read_chunk(f)
+      if chunk is None:
+        break
+      flags, count, payload = chunk
+      chunk = list(itertools.islice(self.unpack(flags, payload), skip, skip + n - len(items)))
+      items.extend(chunk)
+      skip += len(chunk)
+      if skip < count:
+        break
+      offset, skip = f.tell(), 0
+    return items, (offset, skip)
+
+  def recover(self, f):
+    """it finds the end of the last valid chunk of a file
+    @param f: the file opened at the beginning
+    @type f: file
+    @return: a size of the valid part of the file and an error of the first invalid chunk (None if all are valid)
+    @rtype: tuple
+    """
+    valid_size = 0
+    try:
+      while self.read_chunk(f) is not None:
+        valid_size = f.tell()
+    except (CustomExceptions.BTEValueError, zlib.error) as e:
+      sys.exc_clear()
+      return valid_size, e
+    return valid_size, None
+
+
+###################################################################################
+class SerializableQueue(object):
+  """ the class implements a queue which could be serialized to a file and loaded back
+  if there is more than n items in a queue, it is serialized into a file and becomes empty.
+  There are two formats of the file:
+    - L{FORMAT_TEXT} (by default, L{_TextQueueFormat}). Only strings can be serialized. Every item in the queue
+      is saved as a separated string in a serialization file, so items cannot contain line breaks.
+    - L{FORMAT_CHUNKED} (L{_ChunkedQueueFormat}). Every flush is saved as a binary chunk of length-prefixed items,
+      which could be compressed, so items could contain any symbols.
+  A format, which does not exist, or compress with L{FORMAT_TEXT} are rejected by BTEValueError.
+  The serialized queue could be read item by item by L{iterate} without loading the whole file into memory.
+  A full queue is written by the calling thread, L{BackgroundSerializableQueue} writes it by a writer thread.
+  The queue could be appended from several threads.
+  Items could be consumed by L{pop_batch} from several threads, every item is returned only once.
+  A consumed position (a cursor) is kept, L{get_queue} and L{iterate} return only not consumed items.
+  If durable is set, the cursor is saved into a file <full_file_name>.cursor by L{commit},
+  and an existing file of the queue is not overwritten but loaded back from the saved cursor,
+  so a crashed consumer could resume exactly where it stopped.
+  L{WriteAheadLogQueue} writes every item into the file at once.
+  @todo: make the type check for the requirement, that "Only strings can be serialized"
+
+  @ivar _queue: a queue to store queries
+  @type _queue: deque
+  @ivar _full_file_name: a full name of the file for serialization
+  @type _full_file_name: string
+  @ivar _max_length: max length of the queue until serialization happens
+  @type _max_length: int
+  @ivar _is_queue_serialized: a flag, indicating the the queue has been serialized
+  @type _is_queue_serialized: boolean
+  @ivar _format: a format of the serialization file
+  @type _format: L{_TextQueueFormat} or L{_ChunkedQueueFormat}
+  @ivar _lock: a condition protecting the in-memory state of the queue
+  @type _lock: threading.Condition
+  @ivar _io_lock: a lock protecting the file
+  @type _io_lock: threading.RLock
+  @ivar _durable: whether the cursor is saved and the existing file is loaded back
+  @type _durable: boolean
+  @ivar _cursor: a position of the first not consumed item in the file: an offset and a number of items
+    to skip in the chunk at the offset
+  @type _cursor: tuple
+  @ivar _consumer_lock: a lock serializing consumers
+  @type _consumer_lock: threading.Lock
+  """
+  FORMAT_TEXT = "text"
+  FORMAT_CHUNKED = "chunked"
+
+  def __init__(self, full_file_name, max_length, file_format=FORMAT_TEXT, compress=False, durable=False):
+    self._queue = deque()
+    if full_file_name is None:
+      self._full_file_name = tempfile.mktemp()
+    else:
+      self._full_file_name = full_file_name
+    self._max_length = max_length
+    self._is_queue_serialized = False
+    self._format = self._create_format(file_format, compress)
+    self._lock = threading.Condition()
+    self._io_lock = threading.RLock()
+    self._durable = durable
+    self._cursor = (0, 0)
+    self._consumer_lock = threading.Lock()
+    if durable and os.path.exists(self._full_file_name):
+      self._is_queue_serialized = True
+      self._cursor = self._load_cursor()
+
+  def __del__(self):
+    if os.path.exists(self._full_file_name) and os.path.getsize(self._full_file_name) == 0:
+      os.remove(self._full_file_name)
+      if os.path.exists(self._get_cursor_file_name()):
+        os.remove(self._get_cursor_file_name())
+
+  def _create_format(self, file_format, compress):
+    """it creates a format of the file
+    @param file_format: L{FORMAT_TEXT} or L{FORMAT_CHUNKED}
+    @type file_format: string
+    @param compress: whether to compress chunks of the L{FORMAT_CHUNKED} format
+    @type compress: boolean
+    @rtype: L{_TextQueueFormat} or L{_ChunkedQueueFormat}
+    @raise BTEValueError: the format does not exist or it cannot be compressed
+    """
+    if file_format == self.FORMAT_CHUNKED:
+      return _ChunkedQueueFormat(compress)
+    if file_format != self.FORMAT_TEXT:
+      raise CustomExceptions.BTEValueError("unknown format of the queue '%s'" % file_format)
+    if compress:
+      raise CustomExceptions.BTEValueError("the text format of the queue cannot be compressed")
+    return _TextQueueFormat()
+
+  def _get_cursor_file_name(self):
+    """it returns a name of the file with the saved cursor
+    @rtype: string
+    """
+    return self._full_file_name + ".cursor"
+
+  def _load_cursor(self):
+    """it loads the saved cursor
+    @return: the cursor, the beginning of the file if there is no saved cursor
+    @rtype: tuple
+    """
+    try:
+      with open(self._get_cursor_file_name(), "r") as f:
+        cursor = json.load(f)
+      return cursor["offset"], cursor["skip"]
+    except (IOError, ValueError, KeyError, TypeError) as e:
+      if os.path.exists(self._get_cursor_file_name()):
+        print "WARNING: the cursor '%s' cannot be loaded: %s" % (self._get_cursor_file_name(), e)
+      sys.exc_clear()
+    return 0, 0
+
+  def _save_cursor(self, cursor):
+    """it saves the cursor into a temporary file and renames it, so the saved cursor is never partial
+    @param cursor: the cursor
+    @type cursor: tuple
+    """
+    tmp_file_name = self._get_cursor_file_name() + ".tmp"
+    with open(tmp_file_name, "w") as f:
+      json.dump({"offset": cursor[0], "skip": cursor[1]}, f)
+    os.rename(tmp_file_name, self._get_cursor_file_name())
+
+  def _save(self, items):
+    """ it saves items as strings into a file
+    the caller should hold L{_io_lock}
+    @param items: items to save
+    @type items: deque
+    """
+    open_mode = "a"
+    if not self._is_queue_serialized:
+      open_mode = "w"
+    if self._format.binary:
+      open_mode += "b"
+    data = self._format.pack(items)
+    # the file is not buffered, so a failed write is not repeated by close()
+    with open(self._full_file_name, open_mode, 0) as f:
+      f.seek(0, os.SEEK_END)
+      size = f.tell()
+      try:
+        f.write(data)
+      except (IOError, OSError):
+        # a partial write is removed, so the items could be written again
+        try:
+          f.truncate(size)
+        except (IOError, OSError):
+          sys.exc_clear()
+        raise
+    with self._lock:
+      self._is_queue_serialized = True
+
+  def _on_append(self):
+    """ it handles an overflow of the queue after appending
+    the caller should hold L{_lock}
+    @return: True if the queue should be flushed synchronously
+    @rtype: boolean
+    """
+    return len(self._queue) > self._max_length
+
+  def _open_file(self):
+    """it opens the file for reading
+    @rtype: file
+    """
+    return open(self._full_file_name, "rb" if self._format.binary else "r")
+
+  def _iterate_file(self, limit=None, cursor=(0, 0)):
+    """it reads the serialized queue from the file item by item
+    @param limit: a size of the file to read, the whole file by default
+    @type limit: int
+    @param cursor: a position to start reading from
+    @type cursor: tuple
+    @return: a generator of items
+    @rtype: generator
+    """
+    offset, skip = cursor
+    with self._open_file() as f:
+      f.seek(offset)
+      for item in self._format.iterate(f, skip, limit):
+        yield item
+
+  def _load(self, queue):
+    """it loads the serialized queue from the file into a temporary queue
+    @param queue: a queue to load date into
+    @type queue: deque
+    @return: a queue with loaded results
+    @rtype: deque
+    """
+    queue.extend(self._iterate_file(cursor=self._cursor))
+    return queue
+
+  def _read_file(self, n):
+    """it reads up to n not consumed items from the file and moves the cursor after them
+    the caller should hold L{_io_lock} and L{_consumer_lock}
+    @param n: max number of items
+    @type n: int
+    @return: read items
+    @rtype: list
+    """
+    offset, skip = self._cursor
+    with self._open_file() as f:
+      f.seek(offset)
+      items, self._cursor = self._format.read(f, skip, n)
+    return items
+
+  def _read_serialized(self, n):
+    """it reads up to n not consumed items from the file, if the queue is serialized
+    the caller should hold L{_consumer_lock}
+    @param n: max number of items
+    @type n: int
+    @return: read items
+    @rtype: list
+    """
+    with self._io_lock:
+      if self._is_queue_serialized:
+        return self._read_file(n)
+    return []
+
+  def _pop_from_memory(self, n):
+    """it pops up to n items, which are not written into the file
+    @param n: max number of items
+    @type n: int
+    @return: popped items
+    @rtype: list
+    """
+    items = []
+    with self._lock:
+      while self._queue and len(items) < n:
+        items.append(self._queue.popleft())
+    return items
+
+  def _wait_for_pending(self):
+    """it waits until items, which are being written into the file, are written
+    @return: True if it has waited, so the file should be read again
+    @rtype: boolean
+    """
+    return False
+
+  def _get_memory_items(self):
+    """it returns items, which are not written into the file, the caller should hold L{_lock}
+    @rtype: list
+    """
+    return list(self._queue)
+
+  def _clear_memory(self):
+    """it removes items, which are not written into the file, the caller should hold L{_lock}
+    """
+    self._queue.clear()
+
+  def pop_batch(self, n, commit=True):
+    """It pops up to n oldest not consumed items, it is safe to call it from several threads
+    @param n: max number of items
+    @type n: int
+    @param commit: whether to save the cursor at once (see L{commit}),
+      if it is False, the caller should call L{commit} after the batch is processed
+    @type commit: boolean
+    @return: popped items, an empty list if the queue is empty
+    @rtype: list
+    """
+    with self._consumer_lock:
+      items = self._read_serialized(n)
+      if len(items) < n and self._wait_for_pending():
+        items.extend(self._read_serialized(n - len(items)))
+      if len(items) < n:
+        items.extend(self._pop_from_memory(n - len(items)))
+      if commit:
+        self._commit()
+    return items
+
+  def _commit(self):
+    """it saves the cursor, the caller should hold L{_consumer_lock}
+    """
+    if self._durable:
+      self._save_cursor(self._cursor)
+
+  def commit(self):
+    """It saves the cursor, so all popped items are not returned after a restart
+    """
+    with self._consumer_lock:
+      self._commit()
+
+  def _snapshot(self):
+    """it takes a consistent snapshot of the queue
+    @return: a size of the serialized part of the file (None if it is not serialized), the cursor
+      and in-memory items
+    @rtype: tuple
+    """
+    with self._io_lock:
+      with self._lock:
+        file_size = None
+        cursor = self._cursor
+        if self._is_queue_serialized:
+          file_size = os.path.getsize(self._full_file_name)
+        items = self._get_memory_items()
+    return file_size, cursor, items
+
+  def iterate(self):
+    """It iterates through the queue without loading the whole serialized queue into memory
+    @return: a generator of items
+    @rtype: generator
+    """
+    file_size, cursor, items = self._snapshot()
+    if file_size is not None:
+      for item in self._iterate_file(file_size, cursor):
+        yield item
+    for item in items:
+      yield item
+
+  def get_queue(self):
+    """It returns the queue
+    @return: a queue with results
+    @rtype: deque
+    """
+    queue = []
+    with self._io_lock:
+      if self._is_queue_serialized:
+        queue = self._load(queue)
+      queue.extend(self._snapshot()[2])
+    return queue
+
+  def append(self, obj):
+    """append an obj to the right end of the queue
+    if there is more than n items in a queue, it is serialized into a file and becomes empty.
+    @param obj: an object to be appended
+    """
+    with self._lock:
+      self._queue.append(obj)
+      is_full = self._on_append()
+    if is_full:
+      self.flush()
+
+  def extend(self, objs):
+    """It extend a queue with another iterable object
+    if there is more than n items in a queue, it is serialized into a file and becomes empty.
+    @param objs: an iterable list of objects
+    """
+    with self._lock:
+      self._queue.extend(objs)
+      is_full = self._on_append()
+    if is_full:
+      self.flush()
+
+  def flush(self):
+    """it flushes the queue into the file
+    @raise IOError: the file cannot be written, the items are kept in memory
+    """
+    with self._io_lock:
+      with self._lock:
+        items = self._queue
+        self._queue = deque()
+      try:
+        self._save(items)
+      except (IOError, OSError):
+        with self._lock:
+          items.extend(self._queue)
+          self._queue = items
+        raise
+
+  def close(self):
+    """it releases resources of the queue, items in memory are kept
+    """
+
+  def clear(self):
+    """it clear the queue
+    """
+    with self._consumer_lock, self._io_lock:
+      with self._lock:
+        self._clear_memory()
+        self._is_queue_serialized = False
+        self._cursor = (0, 0)
+      if os.path.exists(self._get_cursor_file_name()):
+        os.remove(self._get_cursor_file_name())
+      self._clear_file()
+
+  def _clear_file(self):
+    """it is called by L{clear}, when the file is cleared, the caller should hold L{_io_lock}
+    the file is overwritten by the next write
+    """
+
+
+###################################################################################
+class BackgroundSerializableQueue(SerializableQueue):
+  """ a L{SerializableQueue}, which writes the file by a writer thread: a full queue is handed over to the thread
+  (double buffering) and the caller continues at once; the caller is blocked only when more than high_water_mark
+  items are waiting to be written. L{close} must be called to stop the writer thread,
+  after it the queue is written synchronously.
+  If the writer thread cannot write the file, it keeps the items and retries with a growing delay,
+  the error is raised by L{flush} and L{close}.
+
+  @ivar _pending: buffers waiting to be written by the writer thread
+  @type _pending: deque of deque
+  @ivar _pending_items: a number of items in L{_pending}
+  @type _pending_items: int
+  @ivar _high_water_mark: max number of pending items until producers are blocked
+  @type _high_water_mark: int
+  @ivar _writer: the writer thread
+  @type _writer: threading.Thread
+  @ivar _is_closed: a flag, indicating that the writer thread should stop
+  @type _is_closed: boolean
+  @ivar _write_error: the last error of the writer thread, None if the last write succeeded
+  @type _write_error: Exception
+  @ivar _write_failures: a number of failed writes of the writer thread
+  @type _write_failures: int
+  """
+  WRITE_RETRY_DELAY = 0.1
+  WRITE_RETRY_MAX_DELAY = 5.0
+
+  def __init__(self, full_file_name, max_length, file_format=SerializableQueue.FORMAT_TEXT, compress=False,
+               durable=False, high_water_mark=None):
+    SerializableQueue.__init__(self, full_file_name, max_length, file_format, compress, durable)
+    self._pending = deque()
+    self._pending_items = 0
+    if high_water_mark is None:
+      high_water_mark = max_length * 4
+    self._high_water_mark = high_water_mark
+    self._is_closed = False
+    self._write_error = None
+    self._write_failures = 0
+    self._writer = threading.Thread(target=self._write_pending, name="SerializableQueueWriter")
+    self._writer.daemon = True
+    self._writer.start()
+
+  def _spill(self):
+    """ it hands the current buffer over to the writer thread and starts a new one
+    the caller should hold L{_lock}
+    """
+    self._pending.append(self._queue)
+    self._pending_items += len(self._queue)
+    self._queue = deque()
+    self._lock.notify_all()
+
+  def _write_pending(self):
+    """ the main loop of the writer thread, it writes pending buffers into the file.
+    If a buffer cannot be written, it is kept and the write is retried with a growing delay
+    (or at once, when new items are handed over), until the queue is closed
+    """
+    delay = self.WRITE_RETRY_DELAY
+    while True:
+      with self._lock:
+        while not self._pending and not self._is_closed:
+          self._lock.wait()
+        if not self._pending:
+          return
+        items = self._pending[0]
+      error = None
+      with self._io_lock:
+        with self._lock:
+          # the queue could be cleared, while the thread was waiting for the file
+          if not self._pending or self._pending[0] is not items:
+            continue
+        try:
+          self._save(items)
+        except (IOError, OSError) as e:
+          print "ERROR: cannot write the queue into '%s': %s. Retrying in %s sec" % (self._full_file_name, e, delay)
+          sys.exc_clear()
+          error = e
+      with self._lock:
+        if error is not None:
+          self._write_error = error
+          self._write_failures += 1
+          self._lock.notify_all()
+          if self._is_closed:
+            return
+          self._lock.wait(delay)
+          delay = min(delay * 2, self.WRITE_RETRY_MAX_DELAY)
+          continue
+        self._write_error = None
+        self._pending.popleft()
+        self._pending_items -= len(items)
+        self._lock.notify_all()
+      delay = self.WRITE_RETRY_DELAY
+
+  def _on_append(self):
+    """ it handles an overflow of the queue after appending
+    the caller should hold L{_lock}
+    @return: True if the queue should be flushed synchronously
+    @rtype: boolean
+    """
+    if len(self._queue) <= self._max_length:
+      return False
+    if not self._writer.is_alive():
+      return True
+    self._spill()
+    while self._pending_items > self._high_water_mark and self._writer.is_alive():
+      self._lock.wait()
+    return False
+
+  def _pop_from_memory(self, n):
+    """it pops up to n items, which have not been handed over to the writer thread yet
+    @param n: max number of items
+    @type n: int
+    @return: popped items, an empty list if there are pending buffers (they should be read from the file)
+    @rtype: list
+    """
+    with self._lock:
+      if self._pending:
+        return []
+    return SerializableQueue._pop_from_memory(self, n)
+
+  def _wait_for_pending(self):
+    """it waits until the writer thread writes pending items, they must be read from the file to keep the order
+    @return: True if it has waited, so the file should be read again
+    @rtype: boolean
+    """
+    with self._lock:
+      if not self._pending:
+        return False
+      while self._pending and self._writer.is_alive():
+        self._lock.wait()
+    return True
+
+  def _get_memory_items(self):
+    """it returns pending items and items, which are not handed over, the caller should hold L{_lock}
+    @rtype: list
+    """
+    items = [item for buf in self._pending for item in buf]
+    items.extend(self._queue)
+    return items
+
+  def _clear_memory(self):
+    """it removes pending items and items, which are not handed over, the caller should hold L{_lock}
+    """
+    self._queue.clear()
+    self._pending.clear()
+    self._pending_items = 0
+    self._lock.notify_all()
+
+  def flush(self):
+    """it flushes the queue into the file, it waits until all pending items are written
+    @raise IOError: the writer thread has failed to write pending items (it keeps retrying),
+      or the file cannot be written (if the writer thread is stopped)
+    """
+    if self._writer.is_alive():
+      with self._lock:
+        write_failures = self._write_failures
+        self._spill()
+        while self._pending and self._writer.is_alive():
+          if self._write_failures != write_failures:
+            raise self._write_error
+          self._lock.wait()
+        if not self._pending:
+          return
+    # pending buffers (if the writer thread is stopped) are written before the current one
+    with self._lock:
+      items = deque(self._get_memory_items())
+      self._clear_memory()
+      self._queue = items
+    SerializableQueue.flush(self)
+
+  def close(self):
+    """it flushes the queue and stops the writer thread
+    @raise IOError: pending items cannot be written, they are kept in memory
+    """
+    try:
+      self.flush()
+    finally:
+      with self._lock:
+        self._is_closed = True
+        self._lock.notify_all()
+      self._writer.join()
+
+
+###################################################################################
+class WriteAheadLogQueue(SerializableQueue):
+  """ a L{SerializableQueue}, which works as a write-ahead log: the L{SerializableQueue.FORMAT_CHUNKED} format
+  is used, every append (or extend) is written into the file at once as a chunk followed by a crc32 of the chunk,
+  so it survives a crash of the process. fsyncs are grouped: the file is synced to the disk when sync_items
+  items are not synced or by a timer sync_delay sec after the first not synced item, and by L{flush}.
+  The queue is durable, on construction a torn or broken tail of the file (after a crash in the middle
+  of a write) is truncated and the file is never removed. The file name must be given.
+
+  @ivar _log_file: the opened file of the write-ahead log, None if it is not opened
+  @type _log_file: file
+  @ivar _sync_items: max number of not synced items
+  @type _sync_items: int
+  @ivar _sync_delay: max time in sec an item is not synced
+  @type _sync_delay: float
+  @ivar _unsynced_items: a number of not synced items
+  @type _unsynced_items: int
+  @ivar _sync_timer: a timer to sync the file, None if all items are synced
+  @type _sync_timer: threading.Timer
+  """
+  def __init__(self, full_file_name, sync_items=100, sync_delay=1.0, compress=False):
+    if full_file_name is None:
+      raise CustomExceptions.BTEValueError("the write-ahead log cannot be recovered without the file name")
+    self._log_file = None
+    self._sync_items = sync_items
+    self._sync_delay = sync_delay
+    self._unsynced_items = 0
+    self._sync_timer = None
+    SerializableQueue.__init__(self, full_file_name, sync_items, SerializableQueue.FORMAT_CHUNKED, compress,
+                               durable=True)
+    if os.path.exists(self._full_file_name):
+      self._recover()
+
+  def __del__(self):
+    # the log is never removed
+    pass
+
+  def _create_format(self, file_format, compress):
+    """it creates the chunked format with checksums
+    @rtype: L{_ChunkedQueueFormat}
+    """
+    return _ChunkedQueueFormat(compress, checksum=True)
+
+  def _recover(self):
+    """it truncates the file after the last valid chunk and moves the cursor into the file
+    """
+    size = os.path.getsize(self._full_file_name)
+    with open(self._full_file_name, "r+b") as f:
+      valid_size, error = self._format.recover(f)
+      if valid_size < size:
+        print "WARNING: the queue '%s' is recovered: %s, %d bytes are dropped" % (self._full_file_name, error,
+                                                                                size - valid_size)
+        f.truncate(valid_size)
+        f.flush()
+        os.fsync(f.fileno())
+    if self._cursor[0] > valid_size:
+      self._cursor = (valid_size, 0)
+
+  def _append_to_log(self, items):
+    """ it writes items into the file as a chunk and syncs it, if there are too many not synced items
+    @param items: items to write
+    @type items: list
+    """
+    if not items:
+      return
+    with self._io_lock:
+      if self._log_file is None:
+        self._log_file = open(self._full_file_name, "ab")
+      self._log_file.write(self._format.pack(items))
+      # the chunk is handed over to the OS at once, only fsyncs are grouped
+      self._log_file.flush()
+      with self._lock:
+        self._is_queue_serialized = True
+      self._unsynced_items += len(items)
+      if self._unsynced_items >= self._sync_items:
+        self._sync_log()
+      elif self._sync_timer is None:
+        self._sync_timer = threading.Timer(self._sync_delay, self._on_sync_timer)
+        self._sync_timer.daemon = True
+        self._sync_timer.start()
+
+  def _sync_log(self):
+    """ it syncs the file to the disk, the caller should hold L{_io_lock}
+    """
+    if self._sync_timer is not None:
+      self._sync_timer.cancel()
+      self._sync_timer = None
+    if self._log_file is not None and self._unsynced_items:
+      os.fsync(self._log_file.fileno())
+    self._unsynced_items = 0
+
+  def _on_sync_timer(self):
+    """ it syncs the file, it is called by the timer
+    """
+    with self._io_lock:
+      try:
+        self._sync_log()
+      except (IOError, OSError) as e:
+        print "ERROR: cannot sync the queue '%s': %s" % (self._full_file_name, e)
+        sys.exc_clear()
+
+  def append(self, obj):
+    """append an obj to the right end of the queue, it is written into the file at once
+    @param obj: an object to be appended
+    """
+    self._append_to_log([obj])
+
+  def extend(self, objs):
+    """It extend a queue with another iterable object, the objects are written into the file at once
+    @param objs: an iterable list of objects
+    """
+    self._append_to_log(list(objs))
+
+  def flush(self):
+    """it syncs the file to the disk
+    """
+    with self._io_lock:
+      self._sync_log()
+
+  def close(self):
+    """it syncs and closes the file
+    """
+    with self._io_lock:
+      self._sync_log()
+      if self._log_file is not None:
+        self._log_file.close()
+        self._log_file = None
+
+  def _clear_file(self):
+    """it truncates the file, the log is never removed, the caller should hold L{_io_lock}
+    """
+    if not os.path.exists(self._full_file_name):
+      return
+    self._sync_log()
+    if self._log_file is not None:
+      self._log_file.close()
+      self._log_file = None
+    with open(self._full_file_name, "wb") as f:
+      os.fsync(f.fileno())
+
+
+class TimeoutServerProxy(xmlrpclib.ServerProxy):
+  """a xmlrpc servert proxy which uses a timeout for connections
+  calls could be grouped by L{batch_calls}:
+    with proxy.batch_calls() as batch:
+      mute = batch.mute()
+      volume = batch.get_volume()
+    print volume.result()
+  @ivar _multicall_supported: whether the server supports system.multicall, None if it is unknown yet
+  @type _multicall_supported: boolean
+  """
+  def __init__(self, uri, timeout=5, *l, **kw):
+    kw['transport'] = TimeoutTransport(timeout=timeout, use_datetime=kw.get('use_datetime', 0))
+    xmlrpclib.ServerProxy.__init__(self, uri, *l, **kw)
+    self._multicall_supported = None
+
+  def batch_calls(self, max_parallel=4):
+    """it creates a batch of calls, which are executed by one system.multicall request
+    or in parallel, if the server doesn't support system.multicall
+    @param max_parallel: max number of parallel calls if system.multicall is not supported
+    @type max_parallel: int
+    @return: the batch
+    @rtype: XMLRPCBatch
+    """
+    return XMLRPCBatch(self, max_parallel)
+
+
+class XMLRPCFuture(object):
+  """ the class holds a result of a xmlrpc call, which is executed later or in another thread
+  @ivar method_name: a name of the remote method
+  @type method_name: string
+  @ivar params: parameters of the call
+  @type params: tuple
+  """
+  def __init__(self, method_name, params):
+    self.method_name = method_name
+    self.params = params
+    self._event = threading.Event()
+    self._result = None
+    self._exception = None
+
+  def set_result(self, result):
+    """it sets the result and wakes up waiting threads
+    @param result: the result of the call
+    """
+    self._result = result
+    self._event.set()
+
+  def set_exception(self, exception):
+    """it sets the exception raised by the call and wakes up waiting threads
+    @param exception: the exception
+    @type exception: Exception
+    """
+    self._exception = exception
+    self._event.set()
+
+  def done(self):
+    """it checks whether the call is completed
+    @rtype: boolean
+    """
+    return self._event.is_set()
+
+  def exception(self, timeout=None):
+    """it waits for the call and returns the exception raised by the call
+    @param timeout: a timeout in sec, infinite by default
+    @type timeout: float
+    @return: the exception, None if the call succeeded
+    @rtype: Exception
+    @raise socket.timeout: the call is not completed in time
+    """
+    if not self._event.wait(timeout):
+      raise socket.timeout("the xmlrpc call '%s' is not completed in %s sec" % (self.method_name, timeout))
+    return self._exception
+
+  def result(self, timeout=None):
+    """it waits for the call and returns its result
+    @param timeout: a timeout in sec, infinite by default
+    @type timeout: float
+    @return: the result of the call
+    @raise socket.timeout: the call is not completed in time
+    @raise Exception: the exception raised by the call
+    """
+    exception = self.exception(timeout)
+    if exception is not None:
+      raise exception
+    return self._result
+
+
+def _execute_calls_parallel(calls, max_parallel):
+  """it executes calls in several threads and sets results into their futures
+  @param calls: tuples (a future, a function to call)
+  @type calls: list
+  @param max_parallel: max number of threads
+  @type max_parallel: int
+  """
+  calls_queue = Queue.Queue()
+  for call in calls:
+    calls_queue.put(call)
+
+  def call_worker():
+    """it executes calls from the queue until it is empty"""
+    while True:
+      try:
+        future, func = calls_queue.get_nowait()
+      except Queue.Empty:
+        sys.exc_clear()
+        return
+      try:
+        future.set_result(func())
+      # the exception is passed to the caller through the future
+      # pylint: disable=W0703
+      except Exception as e:
+        future.set_exception(e)
+        sys.exc_clear()
+
+  workers = [threading.Thread(target=call_worker, name="xmlrpc_call_%s" % i)
+             for i in range(min(max_parallel, len(calls)))]
+  for worker in workers:
+    worker.daemon = True
+    worker.start()
+  for worker in workers:
+    worker.join()
+
+
+class XMLRPCBatch(object):
+  """ the class queues xmlrpc calls and executes them together by L{execute} (or on exit from a with block).
+  Every queued call returns L{XMLRPCFuture}, results are available after the execution.
+  Calls are sent by one system.multicall request, if the server doesn't support it,
+  they are sent in parallel.
+  @ivar _proxy: the proxy to execute calls
+  @type _proxy: TimeoutServerProxy
+  @ivar _max_parallel: max number of parallel calls
+  @type _max_parallel: int
+  @ivar _calls: queued calls
+  @type _calls: list of XMLRPCFuture
+  """
+  def __init__(self, proxy, max_parallel=4):
+    self._proxy = proxy
+    self._max_parallel = max_parallel
+    self._calls = []
+
+  def __getattr__(self, name):
+    return _XMLRPCBatchMethod(self, name)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, exc_traceback):
+    if exc_type is None:
+      self.execute()
+    else:
+      self.cancel()
+
+  def _queue_call(self, method_name, params):
+    """it queues a call
+    @param method_name: a name of the remote method
+    @type method_name: string
+    @param params: parameters of the call
+    @type params: tuple
+    @return: a future for the result
+    @rtype: XMLRPCFuture
+    """
+    future = XMLRPCFuture(method_name, params)
+    self._calls.append(future)
+    return future
+
+  def cancel(self):
+    """it drops queued calls, their futures get an exception
+    """
+    calls, self._calls = self._calls, []
+    for future in calls:
+      future.set_exception(CustomExceptions.BTEValueError("the xmlrpc call '%s' was cancelled" % future.method_name))
+
+  def execute(self):
+    """it executes queued calls
+    @return: futures of executed calls
+    @rtype: list of XMLRPCFuture
+    """
+    calls, self._calls = self._calls, []
+    if not calls:
+      return calls
+    # pylint: disable=W0212
+    if self._proxy._multicall_supported is not False:
+      try:
+        self._execute_multicall(calls)
+        self._proxy._multicall_supported = True
+        return calls
+      # the exception is passed to the caller through futures
+      # pylint: disable=W0703
+      except Exception as e:
+        sys.exc_clear()
+        # only a "method not found" fault means, that the server doesn't know system.multicall
+        if not self._is_multicall_not_found(e) or self._proxy._multicall_supported:
+          for future in calls:
+            future.set_exception(e)
+          return calls
+        print "%s: system.multicall is not supported, calls are sent in parallel: %s" % (timestamp(), e)
+        self._proxy._multicall_supported = False
+    _execute_calls_parallel([(future, self._get_call(future)) for future in calls], self._max_parallel)
+    return calls
+
+  @staticmethod
+  def _is_multicall_not_found(exc):
+    """it checks whether an exception is a fault of a server, which doesn't know system.multicall
+    @param exc: the exception of the multicall request
+    @type exc: Exception
+    @rtype: boolean
+    """
+    if not isinstance(exc, xmlrpclib.Fault):
+      return False
+    # SimpleXMLRPCServer reports 'method "system.multicall" is not supported' with the code 1
+    return exc.faultCode == xmlrpclib.METHOD_NOT_FOUND or "system.multicall" in str(exc.faultString)
+
+  def _get_call(self, future):
+    """it returns a function, which makes the call of the future
+    @param future: the future
+    @type future: XMLRPCFuture
+    @rtype: function
+    """
+    method = self._proxy
+    for name in future.method_name.split("."):
+      method = getattr(method, name)
+    return lambda: method(*future.params)
+
+  def _execute_multicall(self, calls):
+    """it executes calls by one system.multicall request
+    @param calls: futures of calls
+    @type calls: list of XMLRPCFuture
+    @raise Fault: the server doesn't support system.multicall
+    """
+    multicall = xmlrpclib.MultiCall(self._proxy)
+    for future in calls:
+      method = multicall
+      for name in future.method_name.split("."):
+        method = getattr(method, name)
+      method(*future.params)
+    results = multicall()
+    for index, future in enumerate(calls):
+      try:
+        future.set_result(results[index])
+      except xmlrpclib.Fault as e:
+        future.set_exception(e)
+        sys.exc_clear()
+
+
+class _XMLRPCBatchMethod(object):
+  """ a remote method of L{XMLRPCBatch}, calling it queues the call, nested names are supported
+  """
+  def __init__(self, batch, name):
+    self._batch = batch
+    self._name = name
+
+  def __getattr__(self, name):
+    return _XMLRPCBatchMethod(self._batch, "%s.%s" % (self._name, name))
+
+  def __call__(self, *params):
+    # pylint: disable=W0212
+    return self._batch._queue_call(self._name, params)
+
+
+class XMLRPCThreadPool(object):
+  """ the class implements a pool of threads, which execute xmlrpc calls
+  @ivar _calls: a queue of calls: tuples (a future, a function to call), None stops a thread
+  @type _calls: Queue.Queue
+  @ivar _workers: threads of the pool
+  @type _workers: list of threading.Thread
+  """
+  _default_pool = None
+  _default_pool_lock = threading.Lock()
+
+  def __init__(self, max_workers=16):
+    self._calls = Queue.Queue()
+    self._workers = [threading.Thread(target=self._work, name="xmlrpc_pool_%s" % i) for i in range(max_workers)]
+    for worker in self._workers:
+      worker.daemon = True
+      worker.start()
+
+  @classmethod
+  def get_default(cls):
+    """it returns a pool shared by all L{AsyncServerProxy} objects, which don't have an own pool
+    @rtype: XMLRPCThreadPool
+    """
+    with cls._default_pool_lock:
+      if cls._default_pool is None:
+        cls._default_pool = cls()
+      return cls._default_pool
+
+  def _work(self):
+    """it executes calls from the queue until it gets None"""
+    while True:
+      call = self._calls.get()
+      if call is None:
+        return
+      future, func = call
+      try:
+        future.set_result(func())
+      # the exception is passed to the caller through the future
+      # pylint: disable=W0703
+      except Exception as e:
+        future.set_exception(e)
+        sys.exc_clear()
+
+  def submit(self, future, func):
+    """it queues a call
+    @param future: a future for the result
+    @type future: XMLRPCFuture
+    @param func: a function to call
+    @type func: function
+    @return: the future
+    @rtype: XMLRPCFuture
+    """
+    self._calls.put((future, func))
+    return future
+
+  def shutdown(self):
+    """it stops threads after all queued calls are executed
+    """
+    for _worker in self._workers:
+      self._calls.put(None)
+    for worker in self._workers:
+      worker.join()
+
+
+class AsyncServerProxy(object):
+  """ a xmlrpc server proxy, which doesn't block the caller: every call returns L{XMLRPCFuture} at once
+  and is executed by a pool of threads with L{TimeoutTransport} and the same timeout as L{TimeoutServerProxy}.
+  Calls to many resources run concurrently, so the time of a fan-out is the time of the slowest call:
+    futures = [AsyncServerProxy(uri).get_volume() for uri in uris]
+    volumes = gather_calls(futures)
+  @ivar _proxy: a proxy executing calls
+  @type _proxy: TimeoutServerProxy
+  @ivar _pool: a pool of threads executing calls
+  @type _pool: XMLRPCThreadPool
+  """
+  def __init__(self, uri, timeout=5, pool=None, *l, **kw):
+    self._proxy = TimeoutServerProxy(uri, timeout, *l, **kw)
+    if pool is None:
+      pool = XMLRPCThreadPool.get_default()
+    self._pool = pool
+
+  def __getattr__(self, name):
+    # pylint: disable=W0212
+    return xmlrpclib._Method(self._submit_request, name)
+
+  def _submit_request(self, method_name, params):
+    """it submits a call into the pool
+    @param method_name: a name of the remote method
+    @type method_name: string
+    @param params: parameters of the call
+    @type params: tuple
+    @return: a future for the result
+    @rtype: XMLRPCFuture
+    """
+    # pylint: disable=W0212
+    request = self._proxy._ServerProxy__request
+    return self._pool.submit(XMLRPCFuture(method_name, params), lambda: request(method_name, params))
+
+  def get_proxy(self):
+    """it returns a blocking proxy to the same server, e.g. to make a batch of calls
+    @rtype: TimeoutServerProxy
+    """
+    return self._proxy
+
+
+def gather_calls(futures, timeout=None):
+  """it waits for all calls and returns their results
+  @param futures: futures of calls
+  @type futures: list of XMLRPCFuture
+  @param timeout: a timeout in sec to wait for all calls, infinite by default
+  @type timeout: float
+  @return: results in the order of futures
+  @rtype: list
+  @raise socket.timeout: not all calls are completed in time
+  @raise Exception: the exception of the first failed call
+  """
+  deadline = None
+  if timeout is not None:
+    deadline = time.time() + timeout
+  results = []
+  for future in futures:
+    wait_timeout = None
+    if deadline is not None:
+      wait_timeout = max(0, deadline - time.time())
+    results.append(future.result(wait_timeout))
+  return results
+
+
+XMLRPC_STATS_FILE_NAME = "xmlrpc_stats.json"
+# all created transports, to collect their statistics
+_TRANSPORTS = weakref.WeakSet()
+
+
+class TransportStats(object):
+  """ the class collects statistics of xmlrpc calls of a transport:
+  numbers of connects and the time spent on them, and per method: numbers of calls and errors (faults included),
+  request and response bytes (as sent over the network) and a histogram of latencies.
+  It could be updated from several threads.
+  @ivar _methods: statistics per method name
+  @type _methods: dict
+  @ivar _connects: a number of connects
+  @type _connects: int
+  @ivar _connect_time: a total time of connects in sec
+  @type _connect_time: float
+  """
+  # upper bounds of buckets of the latency histogram in sec, the last bucket is unlimited
+  LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10)
+  METHOD_NAME_RE = re.compile(r"<methodName>([^<]*)</methodName>")
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.reset()
+
+  def reset(self):
+    """it resets all statistics
+    """
+    with self._lock:
+      self._methods = {}
+      self._connects = 0
+      self._connect_time = 0.0
+
+  @classmethod
+  def get_method_name(cls, request_body):
+    """it gets a name of the method from the body of a xmlrpc request
+    @param request_body: the body
+    @type request_body: string
+    @rtype: string
+    """
+    match = cls.METHOD_NAME_RE.search(request_body)
+    if match is None:
+      return "unknown"
+    return match.group(1)
+
+  def _get_method(self, method_name):
+    """it returns statistics of a method, the caller should hold the lock
+    @param method_name: a name of the method
+    @type method_name: string
+    @rtype: dict
+    """
+    method = self._methods.get(method_name)
+    if method is None:
+      method = {"count": 0, "errors": 0, "latency_total": 0.0, "latency_max": 0.0,
+                "request_bytes": 0, "response_bytes": 0, "histogram": [0] * (len(self.LATENCY_BUCKETS) + 1)}
+      self._methods[method_name] = method
+    return method
+
+  def add_connect(self, duration):
+    """it records a connect
+    @param duration: a time of the connect in sec
+    @type duration: float
+    """
+    with self._lock:
+      self._connects += 1
+      self._connect_time += duration
+
+  def add_call(self, method_name, latency, request_bytes, response_bytes, is_error=False):
+    """it records a call
+    @param method_name: a name of the method
+    @type method_name: string
+    @param latency: a time of the call in sec
+    @type latency: float
+    @param request_bytes: a size of the request
+    @type request_bytes: int
+    @param response_bytes: a size of the response
+    @type response_bytes: int
+    @param is_error: whether the call failed
+    @type is_error: boolean
+    """
+    with self._lock:
+      method = self._get_method(method_name)
+      method["count"] += 1
+      if is_error:
+        method["errors"] += 1
+      method["latency_total"] += latency
+      method["latency_max"] = max(method["latency_max"], latency)
+      method["request_bytes"] += request_bytes
+      method["response_bytes"] += response_bytes
+      method["histogram"][bisect.bisect_left(self.LATENCY_BUCKETS, latency)] += 1
+
+  def merge(self, other):
+    """it adds statistics of another transport
+    @param other: the statistics to add
+    @type other: TransportStats
+    """
+    stats = other.get_stats()
+    with self._lock:
+      self._connects += stats["connects"]
+      self._connect_time += stats["connect_time"]
+      for method_name, other_method in stats["methods"].iteritems():
+        method = self._get_method(method_name)
+        for key in ("count", "errors", "latency_total", "request_bytes", "response_bytes"):
+          method[key] += other_method[key]
+        method["latency_max"] = max(method["latency_max"], other_method["latency_max"])
+        method["histogram"] = [a + b for a, b in zip(method["histogram"], other_method["histogram"])]
+
+  def get_stats(self):
+    """it returns a copy of statistics
+    @return: a dictionary with keys "connects", "connect_time", "latency_buckets" and "methods"
+      (a method name and a dictionary with keys "count", "errors", "latency_total", "latency_max",
+      "request_bytes", "response_bytes", "histogram": numbers of calls per bucket of "latency_buckets")
+    @rtype: dict
+    """
+    with self._lock:
+      methods = {}
+      for method_name, method in self._methods.iteritems():
+        methods[method_name] = dict(method, histogram=list(method["histogram"]))
+      return {"connects": self._connects, "connect_time": self._connect_time,
+              "latency_buckets": list(self.LATENCY_BUCKETS) + [None], "methods": methods}
+
+
+def get_xmlrpc_stats(reset=False):
+  """it returns statistics of xmlrpc calls of all L{TimeoutTransport} objects
+  @param reset: whether to reset the statistics of transports
+  @type reset: boolean
+  @return: see L{TransportStats.get_stats}
+  @rtype: dict
+  """
+  total = TransportStats()
+  for transport in list(_TRANSPORTS):
+    total.merge(transport.stats)
+    if reset:
+      transport.stats.reset()
+  return total.get_stats()
+
+
+def dump_xmlrpc_stats(folder, reset=True):
+  """it dumps statistics of xmlrpc calls of all L{TimeoutTransport} objects into
+  the file L{XMLRPC_STATS_FILE_NAME} in a folder, nothing is dumped if there were no calls
+  @param folder: the folder, e.g. the log folder of a test
+  @type folder: string
+  @param reset: whether to reset the statistics after the dump, so the next test has own statistics
+  @type reset: boolean
+  @return: a full name of the file, None if nothing is dumped
+  @rtype: string
+  """
+  stats = get_xmlrpc_stats(reset)
+  if not stats["methods"] and not stats["connects"]:
+    return None
+  file_name = os.path.join(folder, XMLRPC_STATS_FILE_NAME)
+  with open(file_name, "w") as f:
+    json.dump(stats, f, indent=2, sort_keys=True)
+  return file_name
+
+
+class TimeoutTransport(xmlrpclib.Transport):
+  """ a timeout transport
+  with python 2.7 it keeps a pool of keep-alive connections per host, so calls don't pay a TCP handshake:
+  a connection is taken from the pool for a call and is returned back after a successful call.
+  Connections idle for more than idle_timeout sec and connections closed by the server are not reused.
+  The transport could be used from several threads.
+  With python 2.7 the transport accepts gzip responses and, as soon as a server has sent a gzip response,
+  it compresses requests to the server longer than gzip_threshold bytes.
+  @ivar timeout: a timeout in sec for a socket
+  @type timeout: int
+  @ivar gzip_threshold: min size of a request to compress, None to never compress requests
+  @type gzip_threshold: int
+  @ivar _gzip_hosts: tuples (a host, a port) of servers, which have sent gzip responses
+  @type _gzip_hosts: set
+  @ivar stats: statistics of calls (with python 2.7), see also L{get_xmlrpc_stats}
+  @type stats: TransportStats
+  @ivar idle_timeout: a timeout in sec, after which an idle connection is closed
+  @type idle_timeout: int
+  @ivar max_pool_size: max number of idle connections kept per host
+  @type max_pool_size: int
+  @ivar _pool: idle connections: a host and a list of tuples (a connection, a time of the last use)
+  @type _pool: dict
+  @ivar _pool_lock: a lock protecting the pool
+  @type _pool_lock: threading.Lock
+  """
+
+  def __init__(self, timeout=10, idle_timeout=60, max_pool_size=4, gzip_threshold=1400, *l, **kw):
+    # for compatibility with 2.7
+    self._connection = (None, None)
+    self._extra_headers = []
+
+    xmlrpclib.Transport.__init__(self, *l, **kw)
+
+    self.timeout = timeout
+    self.idle_timeout = idle_timeout
+    self.max_pool_size = max_pool_size
+    self._pool = defaultdict(list)
+    self._pool_lock = threading.Lock()
+    self.gzip_threshold = gzip_threshold
+    self._gzip_hosts = set()
+    self.stats = TransportStats()
+    _TRANSPORTS.add(self)
 
     if sys.version.startswith("2.6"):
       self.make_connection = self.make_connection_26
     elif sys.version.startswith("2.7"):
       self.make_connection = self.make_connection_27
+      self.single_request = self.single_request_27
+      self.send_content = self.send_content_27
 
   def make_connection_26(self, host, port=None):
     conn = TimeoutHTTP(host, port)
@@ -660,13 +3778,150 @@ class TimeoutTransport(xmlrpclib.Transport):
     return conn
 
   def make_connection_27(self, host, port=None):
-    if self._connection and host == self._connection[0]:
-      return self._connection[1]
+    """it takes an idle connection to the host from the pool or creates a new one
+    @param host: a host
+    @type host: string
+    @param port: a port
+    @type port: int
+    @return: a connection
+    @rtype: httplib.HTTPConnection
+    """
+    now = time.time()
+    with self._pool_lock:
+      idle_connections = self._pool[host]
+      while idle_connections:
+        conn, last_used = idle_connections.pop()
+        if now - last_used <= self.idle_timeout and not self._is_stale(conn):
+          return conn
+        conn.close()
 
     # pylint: disable=W0612
     chost, self._extra_headers, _x509 = self.get_host_info(host)
-    self._connection = host, httplib.HTTPConnection(chost, timeout=self.timeout, port=port)
-    return self._connection[1]
+    return httplib.HTTPConnection(chost, timeout=self.timeout, port=port)
+
+  @staticmethod
+  def _is_stale(conn):
+    """it checks whether an idle connection has been closed by the server
+    an idle keep-alive socket must not be readable: it is either closed or has unexpected data
+    @param conn: a connection
+    @type conn: httplib.HTTPConnection
+    @rtype: boolean
+    """
+    if conn.sock is None:
+      return False
+    try:
+      return bool(select.select([conn.sock], [], [], 0)[0])
+    except (select.error, socket.error, ValueError):
+      sys.exc_clear()
+      return True
+
+  def _release_connection(self, host, conn, response):
+    """it returns a connection into the pool after a call
+    @param host: a host
+    @type host: string
+    @param conn: a connection
+    @type conn: httplib.HTTPConnection
+    @param response: a completely read response of the call
+    @type response: httplib.HTTPResponse
+    """
+    if response.will_close:
+      conn.close()
+      return
+    with self._pool_lock:
+      idle_connections = self._pool[host]
+      if len(idle_connections) < self.max_pool_size:
+        idle_connections.append((conn, time.time()))
+        return
+    conn.close()
+
+  def single_request_27(self, host, handler, request_body, verbose=0):
+    """it makes a call with a connection from the pool (see xmlrpclib.Transport.single_request)
+    and records statistics of the call
+    """
+    conn = self.make_connection(host)
+    conn.sent_bytes = conn.received_bytes = 0
+    start = time.time()
+    is_error = True
+    try:
+      result = self._send_call_27(conn, host, handler, request_body, verbose)
+      is_error = False
+      return result
+    finally:
+      self.stats.add_call(TransportStats.get_method_name(request_body), time.time() - start,
+                          conn.sent_bytes, conn.received_bytes, is_error)
+
+  def _send_call_27(self, conn, host, handler, request_body, verbose):
+    """it sends a call and reads the response
+    @param conn: a connection
+    @type conn: httplib.HTTPConnection
+    @return: a tuple with the result
+    @rtype: tuple
+    """
+    if verbose:
+      conn.set_debuglevel(1)
+
+    try:
+      if conn.sock is None:
+        connect_start = time.time()
+        conn.connect()
+        self.stats.add_connect(time.time() - connect_start)
+      self.send_request(conn, handler, request_body)
+      self.send_host(conn, host)
+      self.send_user_agent(conn)
+      self.send_content(conn, request_body)
+
+      response = conn.getresponse(buffering=True)
+      conn.received_bytes = int(response.getheader("Content-Length", 0) or 0)
+      if response.getheader("Content-Encoding", "") == "gzip":
+        self._gzip_hosts.add((conn.host, conn.port))
+      if response.status == 200:
+        self.verbose = verbose
+        try:
+          result = self.parse_response(response)
+        except xmlrpclib.Fault:
+          # the fault is a complete response, the connection could be reused
+          self._release_connection(host, conn, response)
+          raise
+        self._release_connection(host, conn, response)
+        return result
+    except xmlrpclib.Fault:
+      raise
+    except Exception:
+      # all unexpected errors leave connection in a strange state
+      conn.close()
+      raise
+
+    # discard any response data and raise exception
+    if response.getheader("content-length", 0):
+      response.read()
+    conn.close()
+    raise xmlrpclib.ProtocolError(host + handler, response.status, response.reason, response.msg)
+
+  def send_content_27(self, connection, request_body):
+    """it sends headers and the body of a request, the body is compressed if the server supports gzip
+    @param connection: a connection
+    @type connection: httplib.HTTPConnection
+    @param request_body: the body
+    @type request_body: string
+    """
+    connection.putheader("Content-Type", "text/xml")
+    if self.gzip_threshold is not None and len(request_body) > self.gzip_threshold and \
+       (connection.host, connection.port) in self._gzip_hosts:
+      connection.putheader("Content-Encoding", "gzip")
+      request_body = xmlrpclib.gzip_encode(request_body)
+    connection.sent_bytes = len(request_body)
+    connection.putheader("Content-Length", str(len(request_body)))
+    connection.endheaders(request_body)
+
+  def close(self):
+    """it closes all idle connections
+    """
+    with self._pool_lock:
+      pool = self._pool
+      self._pool = defaultdict(list)
+    for idle_connections in pool.itervalues():
+      for conn, _last_used in idle_connections:
+        conn.close()
 
 
 class TimeoutHTTP(httplib.HTTP):
@@ -713,7 +3968,10 @@ class TimeoutHTTP(httplib.HTTP):
 #     print "*** raising the TestTimeout exception"
 #     raise TestTimeout(self._timeout_msg)
 
+import copy
 from unittest import TestCase
+from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+from SocketServer import ThreadingMixIn
 from BTE.unittests.stubs.stubs import BeoTestResultStub
 
 
@@ -776,6 +4034,249 @@ class TimeoutTransportTest(TestCase):
     connection.close()
 
 
+class KeepAliveRequestHandler(SimpleXMLRPCRequestHandler):
+  """a request handler of a test xmlrpc server, which keeps connections alive
+  """
+  protocol_version = "HTTP/1.1"
+
+  def log_message(self, *args):
+    pass
+
+
+class RecordingRequestHandler(KeepAliveRequestHandler):
+  """a request handler of a test xmlrpc server, which records the encoding and the size of requests
+  """
+  def do_POST(self):
+    self.server.received_requests.append((self.headers.get("Content-Encoding"), int(self.headers["content-length"])))
+    KeepAliveRequestHandler.do_POST(self)
+
+
+class ThreadingXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+  """a test xmlrpc server, which serves every connection in a separate thread
+  """
+  daemon_threads = True
+
+  def __init__(self, *l, **kw):
+    SimpleXMLRPCServer.__init__(self, *l, **kw)
+    self.request_threads = []
+    self.received_requests = []
+
+  def process_request(self, request, client_address):
+    thread = threading.Thread(target=self.process_request_thread, args=(request, client_address))
+    thread.daemon = True
+    self.request_threads.append((thread, request))
+    thread.start()
+
+  def close_requests(self):
+    """it closes keep-alive connections and waits for threads serving them"""
+    for thread, request in self.request_threads:
+      try:
+        request.shutdown(socket.SHUT_RDWR)
+      except socket.error:
+        sys.exc_clear()
+      thread.join()
+
+  def handle_error(self, request, client_address):
+    # connections are broken by clients or by close_requests
+    pass
+
+
+class XMLRPCServerTestCase(TestCase):
+  """the base class for tests, which use a local xmlrpc server
+  """
+  request_handler = KeepAliveRequestHandler
+
+  def setUp(self):
+    """setup"""
+    self.server = ThreadingXMLRPCServer(("127.0.0.1", 0), requestHandler=self.request_handler, logRequests=False)
+    self.server.register_function(lambda x, y: x + y, "add")
+    self.server.register_introspection_functions()
+    self.server.register_multicall_functions()
+    self.server_thread = threading.Thread(target=self.server.serve_forever)
+    self.server_thread.daemon = True
+    self.server_thread.start()
+    self.host = "127.0.0.1:%d" % self.server.server_address[1]
+    self.uri = "http://%s" % self.host
+
+  def tearDown(self):
+    """teardown"""
+    self.server.shutdown()
+    self.server.close_requests()
+    self.server.server_close()
+
+
+class TimeoutTransportPoolTest(XMLRPCServerTestCase):
+  """the class with tests for the pool of connections of TimeoutTransport
+  """
+  def test_connection_reused(self):
+    tt = TimeoutTransport()
+    proxy = xmlrpclib.ServerProxy(self.uri, transport=tt)
+    self.assertEqual(3, proxy.add(1, 2))
+    self.assertEqual(1, len(tt._pool[self.host]))
+    conn = tt._pool[self.host][0][0]
+    self.assertEqual(5, proxy.add(2, 3))
+    self.assertTrue(conn is tt._pool[self.host][0][0])
+    tt.close()
+    self.assertEqual(0, len(tt._pool[self.host]))
+
+  def test_idle_connection_evicted(self):
+    tt = TimeoutTransport(idle_timeout=0)
+    proxy = xmlrpclib.ServerProxy(self.uri, transport=tt)
+    self.assertEqual(3, proxy.add(1, 2))
+    conn = tt._pool[self.host][0][0]
+    time.sleep(0.01)
+    self.assertEqual(5, proxy.add(2, 3))
+    self.assertFalse(conn is tt._pool[self.host][0][0])
+    self.assertTrue(conn.sock is None)
+
+  def test_stale_connection(self):
+    tt = TimeoutTransport()
+    proxy = xmlrpclib.ServerProxy(self.uri, transport=tt)
+    self.assertEqual(3, proxy.add(1, 2))
+    conn = tt._pool[self.host][0][0]
+    conn.sock.shutdown(socket.SHUT_RD)
+    self.assertEqual(5, proxy.add(2, 3))
+    self.assertFalse(conn is tt._pool[self.host][0][0])
+
+  def test_concurrent_calls(self):
+    tt = TimeoutTransport(max_pool_size=2)
+    proxy = xmlrpclib.ServerProxy(self.uri, transport=tt)
+    results = []
+    threads = [threading.Thread(target=lambda i=i: results.append(proxy.add(i, i))) for i in xrange(8)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(sorted(i * 2 for i in xrange(8)), sorted(results))
+    self.assertTrue(len(tt._pool[self.host]) <= 2)
+
+
+class XMLRPCBatchTest(XMLRPCServerTestCase):
+  """the class with tests for batches of xmlrpc calls
+  """
+  def test_multicall(self):
+    proxy = TimeoutServerProxy(self.uri)
+    with proxy.batch_calls() as batch:
+      res1 = batch.add(1, 2)
+      res2 = batch.add("a", 1)
+      res3 = batch.system.listMethods()
+    self.assertEqual(3, res1.result())
+    self.assertTrue(isinstance(res2.exception(), xmlrpclib.Fault))
+    self.assertRaises(xmlrpclib.Fault, res2.result)
+    self.assertTrue("add" in res3.result())
+    self.assertTrue(proxy._multicall_supported)
+
+  def test_parallel_without_multicall(self):
+    self.server.funcs.pop("system.multicall")
+    proxy = TimeoutServerProxy(self.uri)
+    batch = proxy.batch_calls(max_parallel=2)
+    futures = [batch.add(i, i) for i in xrange(5)]
+    futures.append(batch.add("a", 1))
+    self.assertFalse(futures[0].done())
+    batch.execute()
+    self.assertFalse(proxy._multicall_supported)
+    self.assertEqual([i * 2 for i in xrange(5)], [future.result() for future in futures[:5]])
+    self.assertTrue(isinstance(futures[5].exception(), xmlrpclib.Fault))
+
+  def test_multicall_fault(self):
+    def multicall(calls):
+      raise xmlrpclib.Fault(4, "too many calls")
+    self.server.funcs["system.multicall"] = multicall
+    proxy = TimeoutServerProxy(self.uri)
+    batch = proxy.batch_calls()
+    future = batch.add(1, 2)
+    batch.execute()
+    self.assertEqual(4, future.exception().faultCode)
+    # the fault of the application doesn't mean, that system.multicall is not supported
+    self.assertTrue(proxy._multicall_supported is None)
+
+  def test_cancel(self):
+    proxy = TimeoutServerProxy(self.uri)
+    try:
+      with proxy.batch_calls() as batch:
+        res = batch.add(1, 2)
+        raise KeyError("an error in the batch")
+    except KeyError:
+      sys.exc_clear()
+    self.assertTrue(isinstance(res.exception(), CustomExceptions.BTEValueError))
+
+
+class CompactTransportTest(XMLRPCServerTestCase):
+  """the class with tests for the gzip encoding of TimeoutTransport
+  """
+  request_handler = RecordingRequestHandler
+
+  def setUp(self):
+    """setup"""
+    XMLRPCServerTestCase.setUp(self)
+    self.server.register_function(lambda data: data, "echo")
+    self.requests = self.server.received_requests
+
+  def test_gzip_negotiation(self):
+    proxy = TimeoutServerProxy(self.uri)
+    data = "x" * 10000
+    self.assertEqual(data, proxy.echo(data))
+    self.assertEqual(None, self.requests[0][0])
+    self.assertEqual(data, proxy.echo(data))
+    self.assertEqual("gzip", self.requests[1][0])
+    self.assertTrue(self.requests[1][1] < 1000)
+    self.assertEqual(3, proxy.add(1, 2))
+    self.assertEqual(None, self.requests[2][0])
+
+
+class TransportStatsTest(XMLRPCServerTestCase):
+  """the class with tests for statistics of TimeoutTransport
+  """
+  def test_stats(self):
+    get_xmlrpc_stats(reset=True)
+    proxy = TimeoutServerProxy(self.uri)
+    self.assertEqual(3, proxy.add(1, 2))
+    self.assertEqual(5, proxy.add(2, 3))
+    self.assertRaises(xmlrpclib.Fault, proxy.add, "a", 1)
+    proxy.system.listMethods()
+    stats = get_xmlrpc_stats()
+    self.assertEqual(1, stats["connects"])
+    self.assertEqual(3, stats["methods"]["add"]["count"])
+    self.assertEqual(1, stats["methods"]["add"]["errors"])
+    self.assertEqual(3, sum(stats["methods"]["add"]["histogram"]))
+    self.assertTrue(stats["methods"]["add"]["request_bytes"] > 0)
+    self.assertTrue(stats["methods"]["add"]["response_bytes"] > 0)
+    self.assertEqual(1, stats["methods"]["system.listMethods"]["count"])
+
+    folder = tempfile.mkdtemp()
+    try:
+      file_name = dump_xmlrpc_stats(folder)
+      with open(file_name) as f:
+        self.assertEqual(3, json.load(f)["methods"]["add"]["count"])
+      self.assertEqual(None, dump_xmlrpc_stats(folder))
+    finally:
+      shutil.rmtree(folder)
+
+
+class AsyncServerProxyTest(XMLRPCServerTestCase):
+  """the class with tests for the asynchronous xmlrpc proxy
+  """
+  def setUp(self):
+    """setup"""
+    XMLRPCServerTestCase.setUp(self)
+    self.server.register_function(lambda sec: time.sleep(sec) or sec, "sleep")
+
+  def test_concurrent_calls(self):
+    pool = XMLRPCThreadPool(max_workers=4)
+    proxies = [AsyncServerProxy(self.uri, pool=pool) for _ in xrange(4)]
+    start = time.time()
+    futures = [proxy.sleep(0.3) for proxy in proxies]
+    self.assertEqual([0.3] * 4, gather_calls(futures, timeout=5))
+    self.assertTrue(time.time() - start < 1.0)
+    self.assertTrue("add" in gather_calls([proxies[0].system.listMethods()])[0])
+    pool.shutdown()
+
+  def test_fault_and_timeout(self):
+    proxy = AsyncServerProxy(self.uri)
+    self.assertRaises(xmlrpclib.Fault, gather_calls, [proxy.add(1, 2), proxy.add("a", 1)])
+    self.assertRaises(socket.timeout, gather_calls, [proxy.sleep(0.5)], 0.01)
+
+
 class SerializableQueueTest(TestCase):
   """the class with tests for the class SerializableQueue
   """
@@ -786,6 +4287,7 @@ class SerializableQueueTest(TestCase):
   test_str5 = "string5"
   test_str6 = "string6"
   max_length = 2
+  file_format = SerializableQueue.FORMAT_TEXT
 
   def setUp(self):
     """setup"""
@@ -895,6 +4397,214 @@ class SerializableQueueTest(TestCase):
     self.__extend(expected_res)
     self.assertTrue(os.path.exists(self.file_full_name), "the queue file '%s' doesn't exists" % self.file_full_name)
 
+  def test_pop_batch(self):
+    expected_res = [self.test_str1, self.test_str2, self.test_str3, self.test_str4, self.test_str5, self.test_str6]
+    self.queue.extend(expected_res[:4])
+    self.queue.append(expected_res[4])
+    self.assertEqual(expected_res[:2], self.queue.pop_batch(2))
+    self.assertEqual(expected_res[2:5], self.queue.get_queue())
+    self.queue.append(expected_res[5])
+    self.assertEqual(expected_res[2:5], self.queue.pop_batch(3))
+    self.assertEqual(expected_res[5:], self.queue.pop_batch(3))
+    self.assertEqual([], self.queue.pop_batch(3))
+
+  def test_durable_resume(self):
+    expected_res = [self.test_str1, self.test_str2, self.test_str3, self.test_str4, self.test_str5, self.test_str6]
+    self.queue = SerializableQueue(self.file_full_name, self.max_length, self.file_format, durable=True)
+    self.queue.extend(expected_res)
+    self.assertEqual(expected_res[:1], self.queue.pop_batch(1))
+    self.assertEqual(expected_res[1:4], self.queue.pop_batch(3, commit=False))
+    # a crash before the commit
+    self.queue = SerializableQueue(self.file_full_name, self.max_length, self.file_format, durable=True)
+    self.assertEqual(expected_res[1:], self.queue.get_queue())
+    self.assertEqual(expected_res[1:5], self.queue.pop_batch(4))
+    self.queue = SerializableQueue(self.file_full_name, self.max_length, self.file_format, durable=True)
+    self.assertEqual(expected_res[5:], self.queue.pop_batch(4))
+    self.queue.clear()
+    self.assertFalse(os.path.exists(self.file_full_name + ".cursor"))
+
+
+class SerializableQueueChunkedTest(SerializableQueueTest):
+  """the class with tests for the class SerializableQueue with the chunked format of the file
+  """
+  file_format = SerializableQueue.FORMAT_CHUNKED
+
+  def setUp(self):
+    """setup"""
+    self.file_full_name = tempfile.mktemp()
+    self.queue = SerializableQueue(self.file_full_name, self.max_length, SerializableQueue.FORMAT_CHUNKED)
+
+  def test_special_symbols(self):
+    expected_res = ["line1\nline2", "", u"测试\r\n", "\x00\xff"]
+    self.queue.extend(expected_res)
+    self.queue.append(self.test_str1)
+    actual_res = self.queue.get_queue()
+    self.assertEqual(expected_res + [self.test_str1], actual_res)
+    self.assertTrue(isinstance(actual_res[2], unicode))
+
+  def test_invalid_format(self):
+    self.assertRaises(CustomExceptions.BTEValueError, SerializableQueue, self.file_full_name, self.max_length,
+                      "unknown")
+    self.assertRaises(CustomExceptions.BTEValueError, SerializableQueue, self.file_full_name, self.max_length,
+                      SerializableQueue.FORMAT_TEXT, compress=True)
+
+  def test_compressed(self):
+    self.queue = SerializableQueue(self.file_full_name, self.max_length, SerializableQueue.FORMAT_CHUNKED, compress=True)
+    expected_res = [self.test_str1 * 100, self.test_str2, self.test_str3, self.test_str4, self.test_str5]
+    for res in expected_res:
+      self.queue.append(res)
+    self.assertTrue(os.path.getsize(self.file_full_name) < len(self.test_str1) * 100)
+    self.assertEqual(expected_res, list(self.queue.iterate()))
+
+
+class WriteAheadLogQueueTest(TestCase):
+  """the class with tests for the class WriteAheadLogQueue
+  """
+  test_str1 = "string1"
+  test_str2 = "string2"
+  test_str3 = "string3"
+  test_str4 = "string4"
+  test_str5 = "string5"
+  test_str6 = "string6"
+  max_length = 2
+
+  def setUp(self):
+    """setup"""
+    self.file_full_name = tempfile.mktemp()
+
+  def tearDown(self):
+    """teardown"""
+    if os.path.exists(self.file_full_name):
+      os.remove(self.file_full_name)
+
+  def test_wal_recovery(self):
+    expected_res = [self.test_str1, self.test_str2, self.test_str3, self.test_str4, self.test_str5, self.test_str6]
+    self.assertRaises(CustomExceptions.BTEValueError, WriteAheadLogQueue, None)
+    self.queue = WriteAheadLogQueue(self.file_full_name, self.max_length)
+    self.queue.extend(expected_res[:3])
+    self.queue.extend(expected_res[3:])
+    self.queue.close()
+    valid_size = os.path.getsize(self.file_full_name)
+    # a torn write of the next chunk
+    with open(self.file_full_name, "ab") as f:
+      f.write(_ChunkedQueueFormat.CHUNK_MAGIC + "\x02\x00")
+    self.queue = WriteAheadLogQueue(self.file_full_name, self.max_length)
+    self.assertEqual(valid_size, os.path.getsize(self.file_full_name))
+    self.assertEqual(expected_res, self.queue.get_queue())
+    self.queue.close()
+    # a broken last chunk
+    with open(self.file_full_name, "r+b") as f:
+      f.seek(-6, os.SEEK_END)
+      f.write("X")
+    self.queue = WriteAheadLogQueue(self.file_full_name, self.max_length)
+    self.assertEqual(expected_res[:3], self.queue.get_queue())
+    self.queue.extend(expected_res[3:])
+    self.assertEqual(expected_res, self.queue.get_queue())
+    self.queue.close()
+
+  def test_wal_append(self):
+    # every item is in the file at once, even if the queue is not closed (the process is killed)
+    self.queue = WriteAheadLogQueue(self.file_full_name, sync_delay=0.05)
+    self.queue.append(self.test_str1)
+    self.queue.extend([self.test_str2, self.test_str3])
+    self.assertEqual([self.test_str1, self.test_str2, self.test_str3],
+                     WriteAheadLogQueue(self.file_full_name).get_queue())
+    self.assertEqual([self.test_str1], self.queue.pop_batch(1))
+    self.queue.clear()
+    self.assertEqual(0, os.path.getsize(self.file_full_name))
+    self.queue.append(self.test_str4)
+    self.assertEqual([self.test_str4], self.queue.get_queue())
+    self.queue.close()
+
+
+class SerializableQueueBackgroundTest(TestCase):
+  """the class with tests for the class BackgroundSerializableQueue
+  """
+  max_length = 2
+
+  def setUp(self):
+    """setup"""
+    self.file_full_name = tempfile.mktemp()
+    self.queue = BackgroundSerializableQueue(self.file_full_name, self.max_length, high_water_mark=4)
+
+  def tearDown(self):
+    """teardown"""
+    self.queue.close()
+    del self.queue
+    if os.path.exists(self.file_full_name):
+      os.remove(self.file_full_name)
+
+  def test_append(self):
+    expected_res = ["string%d" % i for i in xrange(20)]
+    for res in expected_res:
+      self.queue.append(res)
+    self.assertEqual(expected_res, self.queue.get_queue())
+    self.assertEqual(expected_res, list(self.queue.iterate()))
+    self.queue.flush()
+    self.assertTrue(os.path.exists(self.file_full_name), "the queue file '%s' doesn't exists" % self.file_full_name)
+    self.assertEqual(expected_res, self.queue.get_queue())
+
+  def test_concurrent_producers(self):
+    def produce(prefix):
+      for i in xrange(200):
+        self.queue.append("%s%d" % (prefix, i))
+    threads = [threading.Thread(target=produce, args=("thread%d_" % i,)) for i in xrange(4)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.queue.close()
+    actual_res = self.queue.get_queue()
+    self.assertEqual(800, len(actual_res))
+    for i in xrange(4):
+      items = [item for item in actual_res if item.startswith("thread%d_" % i)]
+      self.assertEqual(["thread%d_%d" % (i, j) for j in xrange(200)], items)
+
+  def test_clear(self):
+    self.queue.extend(["string1", "string2", "string3"])
+    self.queue.clear()
+    self.assertEqual([], self.queue.get_queue())
+    self.queue.append("string4")
+    self.queue.flush()
+    self.assertEqual(["string4"], self.queue.get_queue())
+
+  def test_write_error(self):
+    folder = tempfile.mkdtemp()
+    try:
+      queue = BackgroundSerializableQueue(os.path.join(folder, "not_exists", "queue"), self.max_length)
+      expected_res = ["string%d" % i for i in xrange(5)]
+      queue.extend(expected_res)
+      self.assertRaises(IOError, queue.flush)
+      # the items are kept and written, when the file could be written
+      os.mkdir(os.path.join(folder, "not_exists"))
+      queue.flush()
+      self.assertEqual(expected_res, queue.get_queue())
+      queue.close()
+      # items appended after close are written synchronously
+      queue.extend(["string5", "string6", "string7"])
+      self.assertEqual(expected_res + ["string5", "string6", "string7"], queue.get_queue())
+      with open(os.path.join(folder, "not_exists", "queue")) as f:
+        self.assertEqual(8, len(f.readlines()))
+    finally:
+      shutil.rmtree(folder)
+
+  def test_concurrent_consumers(self):
+    expected_res = ["string%d" % i for i in xrange(500)]
+    consumed = []
+    def consume():
+      items = self.queue.pop_batch(7)
+      while items:
+        consumed.append(items)
+        items = self.queue.pop_batch(7)
+    self.queue.extend(expected_res)
+    threads = [threading.Thread(target=consume) for _ in xrange(4)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(expected_res, sorted([item for items in consumed for item in items],
+                                          key=lambda item: int(item[len("string"):])))
+
 
 class AnalyseSysLogTest(TestCase):
   """the class with tests for analyse syslogs
@@ -962,6 +4672,108 @@ class AnalyseSysLogTest(TestCase):
              ['WARN'])}
     self.assertDictEqual(self.test_result.GetAnnotations(), expected_res)
 
+  def test_mmap_equal_to_reading_lines(self):
+    for file_name in (self.file_name, self.file_name_unicode, self.file_name_empty):
+      for test_hash, keywords in ((self.hash, ["WARN", "193", "sink"]), ("Sink graph", ["(none)"]), ("23625347333", ["WARN"])):
+        self.test_result.clear_annotations()
+        is_analysed = analyze_sys_log(file_name, test_hash, self.test_result, keywords, "a3")
+        expected_res = copy.deepcopy(self.test_result.GetAnnotations())
+        self.test_result.clear_annotations()
+        self.assertEqual(analyze_sys_log(file_name, test_hash, self.test_result, keywords, "a3", use_mmap=True), is_analysed)
+        self.assertDictEqual(self.test_result.GetAnnotations(), expected_res)
+
+  def test_analyse_batch_equal_to_sequential(self):
+    jobs = [(self.file_name, self.hash, ["59"], "a3"),
+            (self.file_name, self.hash, ["193", "WARN"], "a4"),
+            (self.file_name_unicode, self.hash, ["WARN"], "a5"),
+            (self.file_name_empty, self.hash, ["WARN"], "a6"),
+            (os.path.join(self.data_path, "not_exists.txt"), self.hash, ["WARN"], "a7")]
+    expected_analysed = [analyze_sys_log(*(job[:2] + (self.test_result,) + job[2:])) for job in jobs]
+    expected_res = copy.deepcopy(self.test_result.GetAnnotations())
+    self.test_result.clear_annotations()
+    self.assertEqual(analyze_sys_logs(jobs, self.test_result, processes=2), expected_analysed)
+    self.assertDictEqual(self.test_result.GetAnnotations(), expected_res)
+
+  def test_analyse_batch_invalid_jobs(self):
+    jobs = [(self.file_name, self.hash, [], "a3"),
+            (os.path.join(self.data_path, "not_exists.txt"), self.hash, ["WARN"], "a7")]
+    self.assertEqual(analyze_sys_logs(jobs, self.test_result), [False, False])
+    self.assertDictEqual(self.test_result.GetAnnotations(), {})
+
+  def test_follower_equal_to_analyse(self):
+    self.assertTrue(analyze_sys_log(self.file_name, self.hash, self.test_result, self.keywords, "a3"))
+    expected_res = copy.deepcopy(self.test_result.GetAnnotations())
+    self.test_result.clear_annotations()
+
+    with open(self.file_name, "rb") as f:
+      content = f.read()
+    log_file_name = tempfile.mktemp()
+    found = []
+    try:
+      follower = SysLogFollower(log_file_name, self.hash, self.keywords, "a3",
+                                on_match=lambda line_number, line, keys: found.append(line_number))
+      # the log grows by parts, the part can end in the middle of a line
+      with open(log_file_name, "wb") as f:
+        for pos in range(0, len(content), 100):
+          f.write(content[pos:pos + 100])
+          f.flush()
+          follower.poll()
+      self.assertEqual(found, [14, 15])
+      self.assertTrue(follower.annotate(self.test_result))
+      self.assertEqual(found, [14, 15, 18])
+      self.assertDictEqual(self.test_result.GetAnnotations(), expected_res)
+
+      # the new follower continues from the saved state
+      follower = SysLogFollower(log_file_name, self.hash, self.keywords, "a3")
+      self.assertEqual(len(follower.get_matches()), 3)
+    finally:
+      for file_name in (log_file_name, log_file_name + SysLogFollower.STATE_FILE_SUFFIX):
+        if os.path.exists(file_name):
+          os.remove(file_name)
+
+  def test_follower_on_match_stops_follower(self):
+    log_file_name = tempfile.mktemp()
+    found = []
+
+    def on_match(line_number, line, keys):
+      found.append(len(follower.get_matches()))
+      follower.stop()
+    try:
+      shutil.copy(self.file_name, log_file_name)
+      follower = SysLogFollower(log_file_name, self.hash, self.keywords, on_match=on_match, poll_interval=0.01)
+      follower.start()
+      follower.join(5)
+      self.assertFalse(follower.is_alive())
+      # the last line of the log is incomplete, so it is read only by the final poll
+      self.assertEqual(found, [2, 2])
+    finally:
+      for file_name in (log_file_name, log_file_name + SysLogFollower.STATE_FILE_SUFFIX):
+        if os.path.exists(file_name):
+          os.remove(file_name)
+
+  def test_index_equal_to_reading_lines(self):
+    log_file_name = tempfile.mktemp()
+    index_file_name = log_file_name + SysLogIndex.FILE_SUFFIX
+    try:
+      shutil.copy(self.file_name, log_file_name)
+      with open(log_file_name, "ab") as f:
+        f.write("\nOct 14 16:20:39 (none) next test\nOct 14 16:20:40 (none) fpsd: WARN next 193")
+      # the index is built and then reused and updated for other test hashes and keywords
+      for test_hash, keywords in ((self.hash, ["WARN", "193"]), (self.hash, ["59"]), ("next test", ["WARN", "none"]),
+                                  ("Sink graph", ["(none)"]), ("23625347333", ["WARN"])):
+        self.test_result.clear_annotations()
+        is_analysed = analyze_sys_log(log_file_name, test_hash, self.test_result, keywords, "a3")
+        expected_res = copy.deepcopy(self.test_result.GetAnnotations())
+        self.test_result.clear_annotations()
+        self.assertEqual(analyze_sys_log(log_file_name, test_hash, self.test_result, keywords, "a3", use_index=True), is_analysed)
+        self.assertDictEqual(self.test_result.GetAnnotations(), expected_res)
+      self.assertTrue(os.path.exists(index_file_name))
+      self.assertEqual(SysLogIndex(log_file_name).find_timestamp("Oct 14 16:20:35"), (0, 1))
+    finally:
+      for file_name in (log_file_name, index_file_name):
+        if os.path.exists(file_name):
+          os.remove(file_name)
+
   def test_ananlyse_second_time_dict_not_empty(self):
     self.assertTrue(analyze_sys_log(self.file_name, self.hash, self.test_result, ["59"], "a3"))
     self.assertTrue(analyze_sys_log(self.file_name, self.hash, self.test_result, ["193"], "a4"))
@@ -972,6 +4784,390 @@ class AnalyseSysLogTest(TestCase):
 
     self.assertDictEqual(self.test_result.GetAnnotations(), expected_res)
 
+
+class KeywordScannerTest(TestCase):
+  """the class with tests for the class KeywordScanner
+  """
+  line = "Oct 14 16:20:38 (none) fpsd: WARN    GST: fpsd fpsd_sink_graph.c:193:bus_call: Changed sink to state 3\n"
+
+  def test_no_keywords_found(self):
+    self.assertEqual(KeywordScanner(["WRN", "ERROR"]).scan(self.line), [])
+
+  def test_overlapping_keywords(self):
+    self.assertEqual(KeywordScanner(["sink", "sink_graph", "WARN"]).scan(self.line), ["sink", "sink_graph", "WARN"])
+
+  def test_role_name(self):
+    self.assertEqual(KeywordScanner(["WARN", "ERROR"], "a3").scan(self.line), ["a3_WARN"])
+
+  def test_special_symbols(self):
+    self.assertEqual(KeywordScanner(["(none)", "c:193:"]).scan(self.line), ["(none)", "c:193:"])
+
+  def test_unicode_keyword(self):
+    line = "Oct 14 16:20:38 (none) fpsd: WARN    GST: 测试測試 fpsd_sink_graph.c\n"
+    self.assertEqual(KeywordScanner([u"测试"]).scan(line), [u"测试"])
+
+
+class FakeFTPServer(object):
+  """an in-memory ftp server for tests: remote files and folders
+  """
+
+  def __init__(self):
+    self.files = {}
+    self.folders = set()
+    self.logins = 0
+    # executed commands: tuples (a command, a path)
+    self.log = []
+    # remote files, which cannot be uploaded
+    self.failing_files = set()
+
+
+class FakeFTP(object):
+  """a ftp session to L{FakeFTPServer}, it implements methods of FTP used by upload functions
+  """
+
+  def __init__(self, server):
+    self.server = server
+    self.server.logins += 1
+    self.closed = False
+
+  def nlst(self, folder):
+    self.server.log.append(("nlst", folder))
+    return [path for path in self.server.folders.union(self.server.files) if os.path.dirname(path) == folder]
+
+  def mkd(self, path):
+    self.server.log.append(("mkd", path))
+    self.server.folders.add(path)
+    return path
+
+  def voidcmd(self, cmd):
+    return "200 %s" % cmd
+
+  def voidresp(self):
+    return "226"
+
+  def size(self, path):
+    if path not in self.server.files:
+      raise error_perm("550 %s" % path)
+    return len(self.server.files[path])
+
+  def storbinary(self, cmd, fp, blocksize=8192, callback=None, rest=None):
+    path = cmd[len("STOR "):]
+    if os.path.normpath(path) in self.server.failing_files:
+      raise IOError("cannot upload '%s'" % path)
+    data = self.server.files.get(path, "")[:rest] if rest else ""
+    for block in iter(lambda: fp.read(blocksize), ""):
+      data += block
+      if callback is not None:
+        callback(block)
+    self.server.files[path] = data
+    self.server.log.append(("stor", path))
+    return "226"
+
+  def transfercmd(self, cmd, rest=None):
+    return FakeFTPDataConnection(self.server, cmd[len("STOR "):])
+
+  def quit(self):
+    self.closed = True
+
+  def close(self):
+    self.closed = True
+
+
+class FakeFTPDataConnection(object):
+  """a data connection of L{FakeFTP}, the file is stored when the connection is closed
+  """
+
+  def __init__(self, server, path):
+    self.server = server
+    self.path = path
+    self.data = []
+
+  def sendall(self, data):
+    self.data.append(data)
+
+  def close(self):
+    self.server.files[self.path] = "".join(self.data)
+
+
+class FakeFTPSessionPool(FTPSessionPool):
+  """a pool of sessions to L{FakeFTPServer}
+  """
+
+  def __init__(self, server, *l, **kw):
+    FTPSessionPool.__init__(self, *l, **kw)
+    self.server = server
+    self.sessions = []
+
+  def _connect(self):
+    ftp_srv = FakeFTP(self.server)
+    self.sessions.append(ftp_srv)
+    self._count("connections", 1)
+    return ftp_srv
+
+
+class FTPTestCase(TestCase):
+  """a base class of tests of ftp uploads: the ftp log root is /logs on L{FakeFTPServer}
+  """
+  pool_size = 1
+
+  def setUp(self):
+    self.server = FakeFTPServer()
+    self.session_pool = FakeFTPSessionPool(self.server, size=self.pool_size)
+    self.folder = tempfile.mkdtemp()
+    self.get_ftp_log_root = Environment.get_hyperion_ftp_log_root
+    Environment.get_hyperion_ftp_log_root = staticmethod(lambda: "/logs")
+
+  def tearDown(self):
+    Environment.get_hyperion_ftp_log_root = staticmethod(self.get_ftp_log_root)
+    self.session_pool.close()
+    shutil.rmtree(self.folder)
+
+  def create_file(self, name, data):
+    """it creates a local file in the test folder
+    @return: a full name of the file
+    @rtype: string
+    """
+    file_name = os.path.join(self.folder, name)
+    with open(file_name, "wb") as f:
+      f.write(data)
+    return file_name
+
+
+class FTPSessionPoolTest(FTPTestCase):
+  """the class with tests for the class FTPSessionPool
+  """
+
+  def test_session_reused(self):
+    self.assertEqual(3, self.session_pool.execute(lambda ftp_srv: 3))
+    self.assertEqual(4, self.session_pool.execute(lambda ftp_srv: 4))
+    self.assertEqual(1, self.server.logins)
+
+  def test_broken_session_reopened(self):
+    def action(ftp_srv):
+      if len(self.session_pool.sessions) == 1:
+        raise socket.error("broken")
+      return 1
+    self.session_pool._max_count_attempts = 2
+    self.assertEqual(1, self.session_pool.execute(action))
+    self.assertTrue(self.session_pool.sessions[0].closed)
+
+  def test_unexpected_exception_discards_session(self):
+    def action(ftp_srv):
+      raise IOError("a local file cannot be read")
+    self.assertRaises(IOError, self.session_pool.execute, action)
+    self.assertTrue(self.session_pool.sessions[0].closed)
+    # the session is not returned into the pool and the slot is released
+    self.assertEqual(1, self.session_pool.execute(lambda ftp_srv: 1))
+    self.assertEqual(2, len(self.session_pool.sessions))
+
+
+class ParallelUploadTest(FTPTestCase):
+  """the class with tests for uploading of logs by several connections and for the class RemoteDirectoryCache
+  """
+  pool_size = 4
+
+  def setUp(self):
+    FTPTestCase.setUp(self)
+    for folder in ("a", os.path.join("a", "b"), "c"):
+      os.mkdir(os.path.join(self.folder, folder))
+    self.files = {}
+    for name in ("root.txt", os.path.join("a", "1.txt"), os.path.join("a", "2.txt"),
+                 os.path.join("a", "b", "3.txt"), os.path.join("c", "4.txt")):
+      self.create_file(name, "data of %s" % name)
+      self.files["/logs/1/" + name] = "data of %s" % name
+
+  def get_uploaded_files(self):
+    """it returns uploaded files with normalized paths
+    @rtype: dictionary
+    """
+    return dict((os.path.normpath(path), data) for path, data in self.server.files.items())
+
+  def test_parallel_upload(self):
+    upload_logs(self.folder, 1, session_pool=self.session_pool, connections=4)
+    self.assertEqual(self.files, self.get_uploaded_files())
+    # a folder is created before its files
+    created = set()
+    for command, path in self.server.log:
+      if command == "mkd":
+        created.add(os.path.normpath(path))
+      elif command == "stor":
+        self.assertTrue(os.path.dirname(os.path.normpath(path)) in created, path)
+    # every folder is listed at most once
+    listed = [os.path.normpath(path) for command, path in self.server.log if command == "nlst"]
+    self.assertEqual(sorted(set(listed)), sorted(listed))
+    self.assertEqual(len(listed), self.session_pool.get_stats()["listings"])
+
+  def test_parallel_upload_failing_file(self):
+    self.server.failing_files.add("/logs/1/a/1.txt")
+    upload_logs(self.folder, 1, session_pool=self.session_pool, connections=4)
+    del self.files["/logs/1/a/1.txt"]
+    self.assertEqual(self.files, self.get_uploaded_files())
+
+  def test_dir_cache_lists_folders_in_parallel(self):
+    listing = threading.Event()
+    release = threading.Event()
+
+    class BlockingFTP(FakeFTP):
+      """a session, which blocks a listing of /logs/a until it is released"""
+      def nlst(self, folder):
+        if folder == "/logs/a":
+          listing.set()
+          release.wait(5)
+        return FakeFTP.nlst(self, folder)
+
+    self.server.files["/logs/a/1.txt"] = ""
+    self.server.files["/logs/b/2.txt"] = ""
+    ftp_srv = BlockingFTP(self.server)
+    cache = RemoteDirectoryCache()
+    result = []
+    thread = threading.Thread(target=lambda: result.append(cache.exists(ftp_srv, "/logs/a/1.txt")))
+    thread.start()
+    try:
+      self.assertTrue(listing.wait(5))
+      # another folder is listed, while the first one is being listed
+      self.assertTrue(cache.exists(ftp_srv, "/logs/b/2.txt"))
+      self.assertTrue(thread.is_alive())
+      # a file added during the listing is not missed
+      adding = threading.Thread(target=cache.add, args=("/logs/a/new.txt",))
+      adding.start()
+    finally:
+      release.set()
+      thread.join()
+    adding.join()
+    self.assertEqual([True], result)
+    self.assertTrue(cache.exists(ftp_srv, "/logs/a/new.txt"))
+    self.assertFalse(cache.exists(ftp_srv, "/logs/a/2.txt"))
+    self.assertEqual(2, cache.listings)
+
+
+class CompressFilesTest(TestCase):
+  """the class with tests for the function compress_files
+  """
+
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+    self.file_name = os.path.join(self.folder, "log.txt")
+    self.data = "".join("line %s\n" % i for i in range(500))
+    with open(self.file_name, "wb") as f:
+      f.write(self.data)
+
+  def tearDown(self):
+    shutil.rmtree(self.folder)
+
+  def _read_compressed(self):
+    f = gzip.open(self.file_name + ".gz", "rb")
+    try:
+      return f.read()
+    finally:
+      f.close()
+
+  def test_split(self):
+    stats = compress_files(["txt"], self.folder, split_size=1000)
+    self.assertEqual(1, stats["files"])
+    self.assertFalse(os.path.exists(self.file_name))
+    self.assertEqual(self.data, self._read_compressed())
+
+  def test_split_file_grows(self):
+    module = sys.modules[__name__]
+    compress_chunk = module._compress_chunk
+
+    def growing_compress_chunk(job):
+      with open(job[0], "ab") as f:
+        f.write("appended\n" * 100)
+      return compress_chunk(job)
+    module._compress_chunk = growing_compress_chunk
+    try:
+      stats = compress_files(["txt"], self.folder, split_size=1000)
+    finally:
+      module._compress_chunk = compress_chunk
+    self.assertEqual(1, stats["files"])
+    self.assertFalse(os.path.exists(self.file_name))
+    self.assertTrue(self._read_compressed().startswith(self.data))
+
+  def test_processes(self):
+    small_file_name = os.path.join(self.folder, "small.log")
+    with open(small_file_name, "wb") as f:
+      f.write("small\n")
+    stats = compress_files(["txt", "log"], self.folder, processes=2, compress_level=1, split_size=1000)
+    self.assertEqual(2, stats["files"])
+    self.assertEqual(len(self.data) + len("small\n"), stats["bytes_in"])
+    self.assertFalse(os.path.exists(self.file_name))
+    self.assertFalse(os.path.exists(small_file_name))
+    self.assertEqual(self.data, self._read_compressed())
+    f = gzip.open(small_file_name + ".gz", "rb")
+    try:
+      self.assertEqual("small\n", f.read())
+    finally:
+      f.close()
+
+  def test_extension_pattern(self):
+    other_file_name = os.path.join(self.folder, "log.dat")
+    with open(other_file_name, "wb") as f:
+      f.write("other\n")
+    stats = compress_files(["t?t"], self.folder)
+    self.assertEqual(1, stats["files"])
+    self.assertEqual(self.data, self._read_compressed())
+    self.assertTrue(os.path.exists(other_file_name))
+
+
+class UploadManifestTest(FTPTestCase):
+  """the class with tests of uploading with the class UploadManifest
+  """
+
+  def setUp(self):
+    FTPTestCase.setUp(self)
+    self.source = os.path.join(self.folder, "logs")
+    os.mkdir(self.source)
+    self.file_name = os.path.join(self.source, "log.txt")
+    with open(self.file_name, "wb") as f:
+      f.write("0123456789" * 1000)
+
+  def test_uploaded_file_skipped(self):
+    upload_logs(self.source, 1, session_pool=self.session_pool, use_manifest=True)
+    upload_logs(self.source, 1, session_pool=self.session_pool, use_manifest=True)
+    self.assertEqual(["/logs/1/log.txt"], sorted(self.server.files))
+    self.assertEqual(1, self.session_pool.get_stats()["skipped"])
+
+  def test_changed_file_uploaded(self):
+    upload_logs(self.source, 1, session_pool=self.session_pool, use_manifest=True)
+    with open(self.file_name, "ab") as f:
+      f.write("more")
+    upload_logs(self.source, 1, session_pool=self.session_pool, use_manifest=True)
+    self.assertEqual(2, len(self.server.files))
+    self.assertEqual(0, self.session_pool.get_stats()["skipped"])
+
+  def test_another_destination(self):
+    upload_logs(self.source, 1, session_pool=self.session_pool, use_manifest=True)
+    upload_logs(self.source, 2, session_pool=self.session_pool, use_manifest=True)
+    self.assertEqual(["/logs/1/log.txt", "/logs/2/log.txt"], sorted(self.server.files))
+    self.assertEqual(self.server.files["/logs/1/log.txt"], self.server.files["/logs/2/log.txt"])
+    self.assertEqual(0, self.session_pool.get_stats()["skipped"])
+
+  def test_partial_upload_resumed(self):
+    # the previous upload is killed after 3000 bytes
+    manifest = UploadManifest(self.source)
+    manifest.start(self.file_name, "/logs/1/log.txt", "/logs/1/log.txt")
+    self.server.folders.update(["/logs", "/logs/1"])
+    self.server.files["/logs/1/log.txt"] = "0123456789" * 300
+    # a partial upload to another destination is not resumed
+    upload_logs(self.source, 2, session_pool=self.session_pool, use_manifest=True)
+    self.assertEqual(10000, self.session_pool.get_stats()["bytes"])
+    upload_logs(self.source, 1, session_pool=self.session_pool, use_manifest=True)
+    self.assertEqual(17000, self.session_pool.get_stats()["bytes"])
+    self.assertEqual("0123456789" * 1000, self.server.files["/logs/1/log.txt"])
+    self.assertTrue(UploadManifest(self.source).is_uploaded(self.file_name, "/logs/1/log.txt"))
+
+  def test_kept_compressed_copy_skipped(self):
+    upload_logs(self.source, 1, session_pool=self.session_pool, use_manifest=True, compress_extensions=["txt"],
+                keep_compressed=True)
+    self.assertFalse(os.path.exists(self.file_name))
+    upload_logs(self.source, 1, session_pool=self.session_pool, use_manifest=True, compress_extensions=["txt"],
+                keep_compressed=True)
+    self.assertEqual(["/logs/1/log.txt.gz"], sorted(self.server.files))
+    self.assertEqual(1, self.session_pool.get_stats()["skipped"])
+    with open(self.file_name + ".gz", "rb") as f:
+      self.assertEqual(f.read(), self.server.files["/logs/1/log.txt.gz"])
+
 # commnenting WatchDog, but keeping it for the future.
 # It is possible that it will be needed
 # class WatchDogTest(TestCase):
@@ -1033,8 +5229,21 @@ class AnalyseSysLogTest(TestCase):
   # unittests
 #   import unittest
 #   test_sutie = unittest.TestLoader().loadTestsFromTestCase(SerializableQueueTest)
+#   test_sutie.addTests(unittest.TestLoader().loadTestsFromTestCase(SerializableQueueChunkedTest))
+#   test_sutie.addTests(unittest.TestLoader().loadTestsFromTestCase(WriteAheadLogQueueTest))
+#   test_sutie.addTests(unittest.TestLoader().loadTestsFromTestCase(SerializableQueueBackgroundTest))
 #   test_sutie.addTests(unittest.TestLoader().loadTestsFromTestCase(TimeoutTransportTest))
+#   test_sutie.addTests(unittest.TestLoader().loadTestsFromTestCase(TimeoutTransportPoolTest))
+#   test_sutie.addTests(unittest.TestLoader().loadTestsFromTestCase(XMLRPCBatchTest))
+#   test_sutie.addTests(unittest.TestLoader().loadTestsFromTestCase(AsyncServerProxyTest))
+#   test_sutie.addTests(unittest.TestLoader().loadTestsFromTestCase(CompactTransportTest))
+#   test_sutie.addTests(unittest.TestLoader().loadTestsFromTestCase(TransportStatsTest))
 #   test_sutie.addTests(unittest.TestLoader().loadTestsFromTestCase(AnalyseSysLogTest))
+#   test_sutie.addTests(unittest.TestLoader().loadTestsFromTestCase(KeywordScannerTest))
+#   test_sutie.addTests(unittest.TestLoader().loadTestsFromTestCase(FTPSessionPoolTest))
+#   test_sutie.addTests(unittest.TestLoader().loadTestsFromTestCase(ParallelUploadTest))
+#   test_sutie.addTests(unittest.TestLoader().loadTestsFromTestCase(UploadManifestTest))
+#   test_sutie.addTests(unittest.TestLoader().loadTestsFromTestCase(CompressFilesTest))
 #   test_sutie.addTests(unittest.TestLoader().loadTestsFromTestCase(WatchDogTest))
 #   unittest.TextTestRunner(verbosity=2).run(test_sutie)
 